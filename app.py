@@ -1,27 +1,159 @@
+import hashlib
+import io
 import os
 from dotenv import load_dotenv  # Add this import
 import pathlib
-from flask import Flask, request, render_template_string
-import google.generativeai as genai
-from fpdf import FPDF
+from flask import Blueprint, Flask, current_app, request, render_template_string
 import json
-from flask import send_file, session, redirect, url_for
-import io
+import time
+from flask import session, redirect, url_for, jsonify, Response, stream_with_context, g
+import shutil
+import tempfile
+import threading
+import audio_preprocess
+from backends import ModelRouter, backend_stats, get_backend, run_sync
+from batch import extract_archive_pdfs, is_archive, run_batch
+import claim_bundle
+import claims
+from extraction_cache import ExtractionCache
+import instrumentation
+from jobs import JobQueue, QueueFullError
+import model_output
+import pdf_renderer
+import pdf_text
+from prompt_builder import count_tokens, truncate_tokens
+from fanout import map_chunks, merge_extractions
+from result_store import make_result_store, new_result_id
+from resilience import deadline_scope
+from uploads import UploadRequest, as_source
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # Load environment variables from .env file
 load_dotenv()
 
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', './uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Routes and request hooks; create_app() registers them on an application
+documents = Blueprint('documents', __name__)
+
+# Model routes, cheapest first; a route limited with <=bytes is only used for
+# uploads up to that size (see backends.parse_routes). The backend client is
+# created on first use.
+document_router = ModelRouter.from_spec(os.getenv('DOCUMENT_MODELS', 'gemini:gemini-1.5-flash'))
+
+# The extraction cache, result store and job queue are built on first use, so
+# importing this module (or forking workers after gunicorn --preload) neither
+# opens the SQLite cache nor starts job worker threads
+_shared_lock = threading.Lock()
+_shared = {}
+
+def _shared_instance(name, build):
+    with _shared_lock:
+        if name not in _shared:
+            _shared[name] = build()
+        return _shared[name]
+
+def get_extraction_cache():
+    # Persistent cache of extraction results keyed on PDF bytes + prompt/model
+    return _shared_instance('extraction_cache', lambda: ExtractionCache(
+        os.getenv('EXTRACTION_CACHE_PATH', './cache/extractions.sqlite3'),
+        max_entries=int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '1000')),
+        max_bytes=int(os.getenv('EXTRACTION_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+        max_age=float(os.getenv('EXTRACTION_CACHE_MAX_AGE', str(7 * 24 * 3600))),
+    ))
+
+def get_result_store():
+    # Extracted JSON is kept server-side; the session cookie only holds its ID
+    return _shared_instance('result_store', lambda: make_result_store(
+        os.getenv('RESULT_STORE', 'memory'),
+        encode=model_output.Extraction.to_record,
+        decode=model_output.from_record,
+        weigh=lambda extraction: len(extraction.raw),
+        directory=os.getenv('RESULT_STORE_DIR', './results'),
+        max_entries=int(os.getenv('RESULT_STORE_MAX_ENTRIES', '512')),
+        ttl=float(os.getenv('RESULT_STORE_TTL', '3600')),
+    ))
+
+def get_job_queue():
+    # Background workers for the asynchronous /jobs submission mode
+    return _shared_instance('job_queue', lambda: JobQueue(
+        workers=int(os.getenv('JOB_WORKERS', '4')),
+        max_queued=int(os.getenv('JOB_QUEUE_SIZE', '64')),
+        result_ttl=float(os.getenv('JOB_RESULT_TTL', '3600')),
+    ))
+
+# Read the PDF text layer locally and only send structure hints to the model
+LOCAL_TEXT_EXTRACTION = os.getenv('LOCAL_TEXT_EXTRACTION', '1') == '1'
+
+# Page-range fan-out for long documents (0 disables it)
+FANOUT_PAGES_PER_CHUNK = int(os.getenv('FANOUT_PAGES_PER_CHUNK', '20'))
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', '4'))
+
+# Concurrent Gemini calls per /bulk request
+BULK_WORKERS = int(os.getenv('BULK_WORKERS', '4'))
+
+# Claim mode sends the text layer itself; longer documents are cut to this many tokens
+CLAIM_TEXT_TOKEN_BUDGET = int(os.getenv('CLAIM_TEXT_TOKEN_BUDGET', '8000'))
+
+# Time budget for extracting one document, retries and rate-limit waits included
+EXTRACTION_DEADLINE = float(os.getenv('EXTRACTION_DEADLINE', '180'))
+
+# Claim bundles (/claims/bundle): recorded statements go to the same
+# speech-to-text routes as the voice service; photos are downscaled to
+# BUNDLE_PHOTO_MAX_SIDE pixels and near-duplicates (dHash distance) dropped
+transcribe_router = ModelRouter.from_spec(os.getenv('VOICE_TRANSCRIBE_MODELS', 'openai:whisper-1'))
+BUNDLE_WORKERS = int(os.getenv('BUNDLE_WORKERS', '8'))
+BUNDLE_PHOTO_MAX_SIDE = int(os.getenv('BUNDLE_PHOTO_MAX_SIDE', '1600'))
+BUNDLE_DUPLICATE_DISTANCE = int(os.getenv('BUNDLE_DUPLICATE_DISTANCE', '4'))
+
+EXTRACTION_PROMPT = """
+Please perform a comprehensive extraction and structural analysis of all major sections and data components from the provided PDF document.
+
+EXTRACTION REQUIREMENTS:
+
+1. DOCUMENT ANALYSIS:
+   - Identify the document type and format
+   - Detect the overall document structure and organization pattern
+   - Recognize section headers, subsections, and hierarchical relationships
+   - Identify any tables, lists, or structured data elements
+
+2. SECTION IDENTIFICATION AND EXTRACTION:
+   - Extract ALL major sections with their exact original titles/headers
+   - Identify and extract subsections maintaining their hierarchical structure
+   - Capture section metadata (numbering, formatting, position in document)
+   - Extract any standalone elements that don't fit into major sections
+
+3. CONTENT PRESERVATION STANDARDS:
+   - Maintain EXACT original text without any modifications
+   - Preserve all formatting elements
+   - Retain original punctuation, capitalization, and spacing
+   - Keep numerical data, dates, and measurements in their original format
+
+OUTPUT FORMAT:
+Return results as a JSON object with this structure:
+
+{
+  "document_metadata": {
+    "document_type": "PDF",
+    "total_sections": "Number of major sections identified",
+    "extraction_timestamp": "Current timestamp"
+  },
+  "extracted_sections": {
+    "section_1": {
+      "title": "Exact original section title/header",
+      "section_type": "header/paragraph/list/table/mixed",
+      "hierarchy_level": 1,
+      "content": {
+        "raw_text": "Complete unmodified text content",
+        "word_count": "Number of words in section"
+      }
+    }
+  }
+}
 
-# Configure the Gemini API
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+Please process the PDF document and return the structured JSON extraction.
+"""
 
-# Initialize the model
-model = genai.GenerativeModel('gemini-1.5-flash')
 
 HTML_FORM = """
 <!doctype html>
@@ -218,7 +350,7 @@ HTML_FORM = """
         <div class="error">{{ error }}</div>
         {% endif %}
         {% if result %}
-        <form action="{{ url_for('download_pdf') }}" method="get" style="text-align:center;margin-top:18px;">
+        <form action="{{ url_for('.download_pdf') }}" method="get" style="text-align:center;margin-top:18px;">
             <button type="submit" class="download-btn">Download as PDF</button>
         </form>
         <div class="result-section">
@@ -226,6 +358,16 @@ HTML_FORM = """
             <pre>{{ result }}</pre>
         </div>
         {% endif %}
+        <div class="error" id="streamError" style="display:none;"></div>
+        <div id="streamResult" style="display:none;">
+            <form action="{{ url_for('.download_pdf') }}" method="get" id="streamDownload" style="display:none;text-align:center;margin-top:18px;">
+                <button type="submit" class="download-btn">Download as PDF</button>
+            </form>
+            <div class="result-section">
+                <h2>Extracted Sections (JSON)</h2>
+                <pre id="streamOutput"></pre>
+            </div>
+        </div>
     </div>
     
     <!-- Loading Overlay -->
@@ -281,8 +423,77 @@ HTML_FORM = """
                     window.addEventListener('beforeunload', () => {
                         clearInterval(textInterval);
                     });
+
+                    // Stream sections into the page as they are generated when the browser supports it
+                    if (window.fetch && window.ReadableStream && window.TextDecoder) {
+                        e.preventDefault();
+                        streamExtraction(form, loadingOverlay, textInterval);
+                    }
                 }
             });
+
+            function streamExtraction(form, overlay, textInterval) {
+                const container = document.getElementById('streamResult');
+                const output = document.getElementById('streamOutput');
+                const download = document.getElementById('streamDownload');
+                const errorBox = document.getElementById('streamError');
+                output.textContent = '';
+                download.style.display = 'none';
+                errorBox.style.display = 'none';
+
+                const finish = () => {
+                    clearInterval(textInterval);
+                    overlay.style.display = 'none';
+                };
+                const handle = (event, data) => {
+                    finish();
+                    if (event === 'chunk' || event === 'result') {
+                        container.style.display = 'block';
+                        output.textContent += data.text;
+                    } else if (event === 'done') {
+                        download.style.display = 'block';
+                        if (data.warning) {
+                            errorBox.textContent = data.warning;
+                            errorBox.style.display = 'block';
+                        }
+                    } else if (event === 'error') {
+                        errorBox.textContent = data.error;
+                        errorBox.style.display = 'block';
+                    }
+                };
+
+                fetch("{{ url_for('.stream_extraction') }}", {method: 'POST', body: new FormData(form)})
+                    .then(response => {
+                        if (!response.ok) {
+                            return response.json().then(data => handle('error', data));
+                        }
+                        const reader = response.body.getReader();
+                        const decoder = new TextDecoder();
+                        let buffer = '';
+                        const pump = () => reader.read().then(({done, value}) => {
+                            if (done) {
+                                finish();
+                                return;
+                            }
+                            buffer += decoder.decode(value, {stream: true});
+                            let boundary;
+                            while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                                const block = buffer.slice(0, boundary);
+                                buffer = buffer.slice(boundary + 2);
+                                let event = 'message';
+                                let data = '';
+                                block.split('\\n').forEach(line => {
+                                    if (line.startsWith('event: ')) event = line.slice(7);
+                                    else if (line.startsWith('data: ')) data += line.slice(6);
+                                });
+                                if (data) handle(event, JSON.parse(data));
+                            }
+                            return pump();
+                        });
+                        return pump();
+                    })
+                    .catch(err => handle('error', {error: 'Streaming failed: ' + err}));
+            }
             
             // Hide loading overlay if there's an error or result on page load
             const hasError = document.querySelector('.error');
@@ -296,242 +507,660 @@ HTML_FORM = """
 </html>
 """
 
-app.secret_key = 'your_secret_key_change_this_in_production'  # Change this in production
+STRUCTURE_PROMPT = """
+You are given heading candidates from a document's text layer, one per row, as
+"L<line number> p<page>: <text>". Identify which rows start a major section or
+subsection of the document.
+
+Return ONLY a JSON object with this structure:
+
+{
+  "document_type": "Short description of the document type",
+  "sections": [
+    {
+      "line": 12,
+      "title": "Exact original section title/header",
+      "section_type": "header/paragraph/list/table/mixed",
+      "hierarchy_level": 1
+    }
+  ]
+}
+
+Use the line numbers exactly as given and list sections in document order.
+Do not reproduce section content.
+
+Heading candidates:
+"""
+
+def _cache_key(source, route):
+    # Uploads carry the SHA-256 computed while they were received. The
+    # extraction mode and chunking shape the output too, so changing them
+    # must not serve results produced under the old settings
+    mode = f"local_text={int(LOCAL_TEXT_EXTRACTION)};pages_per_chunk={FANOUT_PAGES_PER_CHUNK}"
+    return ExtractionCache.make_key(
+        source.sha256, EXTRACTION_PROMPT + STRUCTURE_PROMPT + mode, route.label
+    )
+
+def _route(source, latency_target=None):
+    return document_router.select(size=source.size, latency_target=latency_target)
+
+def _latency_target():
+    # Optional ?latency_target=<seconds> (or form field) on extraction requests
+    try:
+        value = float(request.values.get('latency_target', ''))
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+def _cacheable(extraction):
+    # Only cache well-formed output so a resubmission can recover from a bad run
+    return extraction.valid and not extraction.repaired
+
+def extract_document(document, latency_target=None):
+    """Extract sections from a PDF, serving repeats from the cache.
+
+    ``document`` is a path or an upload from request.files (its stream).
+    The model is picked by ``document_router`` from the file size and the
+    optional latency target in seconds. Returns a parsed
+    model_output.Extraction.
+    """
+    source = as_source(document)
+    route = _route(source, latency_target)
+    cache_key = _cache_key(source, route)
+    cached = get_extraction_cache().get(cache_key)
+    if cached is not None:
+        return model_output.parse_extraction(cached)
+    
+    with deadline_scope(EXTRACTION_DEADLINE):
+        result = _extract(source, route)
+    
+    instrumentation.record_size('documents', 'model_output', len(result))
+    with instrumentation.stage('documents', 'json_parse'):
+        extraction = model_output.parse_extraction(result)
+    if _cacheable(extraction):
+        get_extraction_cache().put(cache_key, result)
+    return extraction
+
+def _local_lines(source):
+    if not LOCAL_TEXT_EXTRACTION:
+        return []
+    try:
+        return pdf_text.extract_lines(source.reader_input())
+    except Exception:
+        return []  # Unreadable locally, let Gemini handle the original file
+
+def _extract(source, route):
+    lines = _local_lines(source)
+    if pdf_text.has_text_layer(lines):
+        return _extract_from_text_layer(lines, route)
+    return _extract_from_upload(source, route)
+
+def extract_claim(document, latency_target=None):
+    """Extract claim fields from a PDF, serving repeats from the cache.
+
+    Takes the same ``document`` and routing as extract_document, but the
+    model answers claims.CLAIM_PROMPT with a few hundred tokens instead of
+    every section's text. Returns a claims.ClaimRecord.
+    """
+    source = as_source(document)
+    route = _route(source, latency_target)
+    mode = f"local_text={int(LOCAL_TEXT_EXTRACTION)};text_budget={CLAIM_TEXT_TOKEN_BUDGET}"
+    cache_key = ExtractionCache.make_key(source.sha256, claims.CLAIM_PROMPT + mode, route.label)
+    cached = get_extraction_cache().get(cache_key)
+    if cached is not None:
+        return claims.parse_claim(cached)
+    
+    with deadline_scope(EXTRACTION_DEADLINE):
+        lines = _local_lines(source)
+        if pdf_text.has_text_layer(lines):
+            text = truncate_tokens(claims.document_text(lines), CLAIM_TEXT_TOKEN_BUDGET)
+            result = _generate(route, f"{claims.CLAIM_PROMPT}\nDocument text:\n{text}")
+        else:
+            with instrumentation.stage('documents', 'file_save'):
+                path = source.path
+            result = _upload_and_generate(path, claims.CLAIM_PROMPT, route)
+    
+    instrumentation.record_size('documents', 'model_output', len(result))
+    with instrumentation.stage('documents', 'json_parse'):
+        record = claims.parse_claim(result)
+    if record.ok:
+        get_extraction_cache().put(cache_key, result)
+    return record
+
+def _read_upload(upload):
+    data = upload.reader_input()
+    if isinstance(data, str):
+        with open(data, 'rb') as handle:
+            return handle.read()
+    return data.getvalue()
+
+def transcribe_statement(upload, filename, content_type, latency_target=None):
+    """Transcribe a recorded statement, serving repeats from the cache."""
+    audio = _read_upload(upload)
+    # Keyed on the audio as received, so a resent recording skips preprocessing too
+    cache_key = ExtractionCache.make_key(hashlib.sha256(audio).hexdigest(), 'transcript', '')
+    cached = get_extraction_cache().get(cache_key)
+    if cached is not None:
+        return cached
+    
+    with instrumentation.stage('documents', 'audio_preprocess'):
+        prepared = audio_preprocess.preprocess_audio(audio, filename, content_type)
+    instrumentation.record_size('documents', 'audio', len(prepared.data))
+    route = transcribe_router.select(size=len(prepared.data), latency_target=latency_target)
+    started = time.perf_counter()
+    with instrumentation.stage('documents', 'transcribe'):
+        backend = get_backend(route.backend)
+        transcript = run_sync(backend.transcribe(prepared.filename, prepared.data, prepared.content_type, route.model))
+    transcribe_router.observe(route, time.perf_counter() - started)
+    if transcript.strip():
+        # An empty transcript may be a transient failure; let a resend retry it
+        get_extraction_cache().put(cache_key, transcript)
+    return transcript
+
+def extract_statement(upload, filename, content_type, latency_target=None):
+    # Claim fields as stated in a recording: the transcript is read like a text layer
+    with deadline_scope(EXTRACTION_DEADLINE):
+        transcript = transcribe_statement(upload, filename, content_type, latency_target)
+        if not transcript.strip():
+            raise ValueError("No speech detected in the recording")
+        digest = hashlib.sha256(transcript.encode('utf-8')).hexdigest()
+        route = document_router.select(size=len(transcript), latency_target=latency_target)
+        cache_key = ExtractionCache.make_key(
+            digest, f"{claims.CLAIM_PROMPT}text_budget={CLAIM_TEXT_TOKEN_BUDGET}", route.label
+        )
+        result = get_extraction_cache().get(cache_key)
+        if result is None:
+            text = truncate_tokens(transcript, CLAIM_TEXT_TOKEN_BUDGET)
+            result = _generate(route, f"{claims.CLAIM_PROMPT}\nDocument text:\n{text}")
+    record = claims.parse_claim(result, source=filename)
+    if record.ok:
+        get_extraction_cache().put(cache_key, result)
+    return claim_bundle.StatementResult(transcript, record)
+
+def assess_photo(photo, latency_target=None):
+    # Damage assessment of one prepared (downscaled, deduplicated) photo
+    route = document_router.select(size=len(photo.data), latency_target=latency_target)
+    cache_key = ExtractionCache.make_key(photo.digest, claim_bundle.DAMAGE_PROMPT, route.label)
+    result = get_extraction_cache().get(cache_key)
+    if result is None:
+        instrumentation.record_size('documents', 'photo', len(photo.data))
+        fd, path = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix=photo.suffix)
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(photo.data)
+            with deadline_scope(EXTRACTION_DEADLINE):
+                result = _upload_and_generate(path, claim_bundle.DAMAGE_PROMPT, route, photo.content_type)
+        finally:
+            os.remove(path)
+    damage = claim_bundle.parse_damage(result)
+    if damage['severity'] is not None:
+        get_extraction_cache().put(cache_key, result)
+    return damage
+
+def _generate(route, prompt, filepath=None, mime_type=None):
+    instrumentation.record_tokens('documents', {'prompt': count_tokens(prompt)})
+    started = time.perf_counter()
+    with instrumentation.stage('documents', 'model'):
+        text = get_backend(route.backend).generate(prompt, route.model, filepath, mime_type)
+    document_router.observe(route, time.perf_counter() - started)
+    return text
 
-@app.route('/', methods=['GET', 'POST'])
+def _extract_structure(lines, route):
+    text = _generate(route, STRUCTURE_PROMPT + pdf_text.structure_hints(lines))
+    structure = model_output.load_json(text)
+    return structure if isinstance(structure, dict) else {}
+
+def _extract_from_text_layer(lines, route):
+    # The model only sees heading candidates and returns section boundaries;
+    # the section text itself is reassembled from the local lines. Line
+    # numbers are global, so page groups can be asked about in parallel.
+    groups = pdf_text.group_by_pages(lines, FANOUT_PAGES_PER_CHUNK) if FANOUT_PAGES_PER_CHUNK else [lines]
+    structures = map_chunks(
+        groups, lambda group: _extract_structure(group, route), max_workers=FANOUT_WORKERS
+    )
+    
+    boundaries = []
+    document_type = None
+    for structure in structures:
+        document_type = document_type or structure.get('document_type')
+        boundaries.extend(b for b in structure.get('sections') or [] if isinstance(b, dict))
+    document = pdf_text.assemble_sections(lines, boundaries, document_type or 'PDF')
+    return json.dumps(document, indent=2)
+
+def _fanout_page_count(source):
+    # Page count of a document long enough to split into ranges, else None
+    if not FANOUT_PAGES_PER_CHUNK:
+        return None
+    page_count = pdf_text.count_pages(source.reader_input())
+    return page_count if page_count > FANOUT_PAGES_PER_CHUNK else None
+
+def _extract_from_upload(source, route):
+    page_count = _fanout_page_count(source)
+    if page_count is None:
+        # File uploads need a path, so in-memory uploads are written out here
+        with instrumentation.stage('documents', 'file_save'):
+            path = source.path
+        return _upload_and_generate(path, EXTRACTION_PROMPT, route)
+    return _extract_page_ranges(source, route, page_count)
+
+def _extract_page_ranges(source, route, page_count):
+    # Split long documents into page ranges and extract them concurrently
+    with tempfile.TemporaryDirectory(dir=UPLOAD_FOLDER) as chunk_dir:
+        chunks = pdf_text.split_pdf(source.reader_input(), FANOUT_PAGES_PER_CHUNK, chunk_dir)
+        
+        def extract_chunk(chunk):
+            first_page, last_page, chunk_path = chunk
+            prompt = (f"This file contains pages {first_page}-{last_page} of {page_count} "
+                      f"of a larger document.\n{EXTRACTION_PROMPT}")
+            text = _upload_and_generate(chunk_path, prompt, route)
+            partial = model_output.load_json(text)
+            return text if partial is None else partial
+        
+        partials = map_chunks(chunks, extract_chunk, max_workers=FANOUT_WORKERS)
+    
+    merged = merge_extractions([
+        (first_page, last_page, partial)
+        for (first_page, last_page, _), partial in zip(chunks, partials)
+    ])
+    return json.dumps(merged, indent=2)
+
+def _upload_and_generate(filepath, prompt, route, mime_type='application/pdf'):
+    # The backend uploads the file, generates content and removes the upload.
+    # The type is passed explicitly; spooled uploads may have no telling suffix
+    return _generate(route, prompt, filepath, mime_type)
+
+def _upload_and_stream(filepath, prompt, route, mime_type='application/pdf'):
+    # Same as _upload_and_generate, but yields text as the model produces it
+    instrumentation.record_tokens('documents', {'prompt': count_tokens(prompt)})
+    started = time.perf_counter()
+    with instrumentation.stage('documents', 'model'):
+        yield from get_backend(route.backend).generate_stream(prompt, route.model, filepath, mime_type)
+    document_router.observe(route, time.perf_counter() - started)
+
+@documents.route('/', methods=['GET', 'POST'])
 def upload_file():
     result = None
     error = None
     
     if request.method == 'POST':
         try:
-            if 'file' not in request.files:
+            # The body is received (hashed, spooled) on first access to request.files
+            with instrumentation.stage('documents', 'receive'):
+                files = request.files
+            if 'file' not in files:
                 error = "No file selected"
                 return render_template_string(HTML_FORM, result=result, error=error)
             
-            file = request.files['file']
+            file = files['file']
             if file.filename == '':
                 error = "No file selected"
                 return render_template_string(HTML_FORM, result=result, error=error)
             
             if file and file.filename.endswith('.pdf'):
-                # Save the uploaded file
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-                file.save(filepath)
-                
-                # Process the PDF
-                prompt = """
-Please perform a comprehensive extraction and structural analysis of all major sections and data components from the provided PDF document.
-
-EXTRACTION REQUIREMENTS:
-
-1. DOCUMENT ANALYSIS:
-   - Identify the document type and format
-   - Detect the overall document structure and organization pattern
-   - Recognize section headers, subsections, and hierarchical relationships
-   - Identify any tables, lists, or structured data elements
-
-2. SECTION IDENTIFICATION AND EXTRACTION:
-   - Extract ALL major sections with their exact original titles/headers
-   - Identify and extract subsections maintaining their hierarchical structure
-   - Capture section metadata (numbering, formatting, position in document)
-   - Extract any standalone elements that don't fit into major sections
-
-3. CONTENT PRESERVATION STANDARDS:
-   - Maintain EXACT original text without any modifications
-   - Preserve all formatting elements
-   - Retain original punctuation, capitalization, and spacing
-   - Keep numerical data, dates, and measurements in their original format
-
-OUTPUT FORMAT:
-Return results as a JSON object with this structure:
-
-{
-  "document_metadata": {
-    "document_type": "PDF",
-    "total_sections": "Number of major sections identified",
-    "extraction_timestamp": "Current timestamp"
-  },
-  "extracted_sections": {
-    "section_1": {
-      "title": "Exact original section title/header",
-      "section_type": "header/paragraph/list/table/mixed",
-      "hierarchy_level": 1,
-      "content": {
-        "raw_text": "Complete unmodified text content",
-        "word_count": "Number of words in section"
-      }
-    }
-  }
-}
-
-Please process the PDF document and return the structured JSON extraction.
-"""
-                
+                # The upload was already received into file.stream; it is
+                # removed when the request closes
                 try:
-                    # Upload the file to Gemini and generate content
-                    uploaded_file = genai.upload_file(filepath)
-                    
-                    response = model.generate_content([
-                        uploaded_file,
-                        prompt
-                    ])
+                    instrumentation.record_size('documents', 'upload', file.stream.size)
+                    extraction = extract_document(file.stream, _latency_target())
+                    result = extraction.raw
+                    session['result_id'] = get_result_store().save(extraction)  # Store for PDF download
                     
-                    result = response.text
-                    
-                    # Try to parse the JSON to validate it
-                    try:
-                        json.loads(result)
-                        session['extracted_json'] = result  # Store for PDF download
-                    except json.JSONDecodeError:
-                        # If it's not valid JSON, still show the result but note the issue
-                        session['extracted_json'] = result
+                    # If it's not valid JSON, still show the result but note the issue
+                    if not extraction.valid:
                         error = "Note: The extracted content may not be in perfect JSON format."
                     
-                    # Clean up the uploaded file from Gemini
-                    try:
-                        genai.delete_file(uploaded_file.name)
-                    except:
-                        pass  # File might already be deleted
-                    
                 except Exception as e:
                     error = f"Error processing with Gemini API: {str(e)}"
-                
-                # Clean up the local file
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
                     
             else:
                 error = "Please upload a PDF file"
                 
+        except RequestEntityTooLarge:
+            raise  # Rendered by upload_too_large
         except Exception as e:
             error = f"An error occurred: {str(e)}"
     
     return render_template_string(HTML_FORM, result=result, error=error)
 
-@app.route('/download_pdf')
+@documents.route('/download_pdf')
 def download_pdf():
-    extracted_json = session.get('extracted_json')
-    if not extracted_json:
-        return redirect(url_for('upload_file'))
+    result_id = request.args.get('result_id') or session.get('result_id')
+    extraction = get_result_store().get(result_id) if result_id else None
+    if extraction is None:
+        return redirect(url_for('.upload_file'))
+    
+    try:
+        with instrumentation.stage('documents', 'pdf_render'):
+            pdf_bytes, etag = pdf_renderer.render_cached(extraction)
+        instrumentation.record_size('documents', 'pdf', len(pdf_bytes))
+        response = Response(pdf_bytes, mimetype='application/pdf')
+        response.headers['Content-Disposition'] = 'attachment; filename=extracted_sections.pdf'
+        response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+        response.set_etag(etag)
+        # Answers 304 Not Modified when the browser already has this PDF
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        # If PDF generation fails, redirect back with error
+        return redirect(url_for('.upload_file'))
+
+def _run_job(upload, latency_target=None):
+    try:
+        return extract_document(upload, latency_target).payload()
+    finally:
+        upload.release()
+
+@documents.route('/jobs', methods=['POST'])
+def submit_job():
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    if not file.filename.endswith('.pdf'):
+        return jsonify({'error': 'Please upload a PDF file'}), 400
     
+    # The job outlives this request, so take ownership of the received upload
+    upload = file.stream.detach()
+    latency_target = _latency_target()
     try:
-        # Try to parse as JSON
+        job = get_job_queue().submit(lambda: _run_job(upload, latency_target))
+    except QueueFullError:
+        upload.release()
+        response = jsonify({'error': 'Too many pending jobs, retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('.job_status', job_id=job.id),
+    }), 202
+
+@documents.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@documents.route('/jobs/stats')
+def job_stats():
+    return jsonify(get_job_queue().stats())
+
+def _iter_bulk_uploads(uploads, scratch_dir):
+    for upload in uploads:
+        if upload.filename.lower().endswith('.pdf'):
+            # Already received; released when the request closes
+            yield upload.filename, upload.stream
+        elif is_archive(upload.filename):
+            for member, path in extract_archive_pdfs(upload.stream, scratch_dir, upload.filename):
+                yield f"{upload.filename}!{member}", path
+
+@documents.route('/bulk', methods=['POST'])
+def bulk_upload():
+    uploads = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not uploads:
+        return jsonify({'error': 'No file selected'}), 400
+    
+    scratch_dir = tempfile.mkdtemp(dir=UPLOAD_FOLDER)
+    
+    def generate():
+        # Each line is written as soon as its document finishes
         try:
-            # Clean the JSON string if it has markdown formatting
-            clean_json = extracted_json.strip()
-            if clean_json.startswith('```json'):
-                clean_json = clean_json[7:]  # Remove ```json
-            if clean_json.endswith('```'):
-                clean_json = clean_json[:-3]  # Remove ```
-            
-            data = json.loads(clean_json)
-            sections = data.get('extracted_sections', {})
-        except json.JSONDecodeError:
-            # If not valid JSON, create a simple structure
-            sections = {"raw_content": {"title": "Extracted Content", "section_type": "text", "hierarchy_level": 1}}
-            data = {"extracted_sections": sections}
+            items = _iter_bulk_uploads(uploads, scratch_dir)
+            extract = lambda path: extract_document(path).payload()
+            for record in run_batch(items, extract, max_workers=BULK_WORKERS, scratch_dir=scratch_dir):
+                yield json.dumps(record) + '\n'
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@documents.route('/claims', methods=['POST'])
+def claims_upload():
+    # Claim fields for many PDFs (and archives of them) in one export.
+    # ?format=jsonl (default) streams a line per document as it finishes;
+    # csv (?table=claims or line_items) and parquet answer once all are done
+    uploads = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not uploads:
+        return jsonify({'error': 'No file selected'}), 400
+    export = request.values.get('format', 'jsonl')
+    table = request.values.get('table', 'claims')
+    if export not in claims.EXPORT_FORMATS or table not in ('claims', 'line_items'):
+        return jsonify({'error': f"format must be one of {', '.join(claims.EXPORT_FORMATS)}"
+                                 " and table claims or line_items"}), 400
+    if export == 'parquet' and not claims.parquet_available():
+        return jsonify({'error': 'Parquet export needs pyarrow installed on the server'}), 501
+    
+    latency_target = _latency_target()
+    scratch_dir = tempfile.mkdtemp(dir=UPLOAD_FOLDER)
+    
+    def run():
+        items = _iter_bulk_uploads(uploads, scratch_dir)
+        extract = lambda path: extract_claim(path, latency_target)
+        return run_batch(items, extract, max_workers=BULK_WORKERS, scratch_dir=scratch_dir)
+    
+    if export == 'jsonl':
+        def generate():
+            try:
+                for entry in run():
+                    if entry['status'] == 'ok':
+                        entry['result'].source = entry['document']
+                        entry['result'] = entry['result'].to_dict()
+                    yield json.dumps(entry) + '\n'
+            finally:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
         
-        # Create PDF with better formatting
-        class PDF(FPDF):
-            def header(self):
-                self.set_font('Arial', 'B', 16)
-                self.cell(0, 10, 'Extracted Document Sections', 0, 1, 'C')
-                self.ln(10)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    try:
+        records = list(claims.from_batch(run()))
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    if export == 'csv':
+        out = io.StringIO()
+        claims.write_csv(records, out, table)
+        response = Response(out.getvalue(), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename={table}.csv'
+        return response
+    out = io.BytesIO()
+    claims.write_parquet(records, out)
+    response = Response(out.getvalue(), mimetype='application/vnd.apache.parquet')
+    response.headers['Content-Disposition'] = 'attachment; filename=claims.parquet'
+    return response
+
+@documents.route('/claims/bundle', methods=['POST'])
+def claim_bundle_upload():
+    # Everything submitted for one claim: PDFs, damage photos and recorded
+    # statements are processed concurrently and merged into one claim record
+    uploads = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not uploads:
+        return jsonify({'error': 'No file selected'}), 400
+    items = [
+        claim_bundle.BundleItem(f.filename, claim_bundle.classify(f.filename, f.mimetype), f.stream, f.mimetype)
+        for f in uploads
+    ]
+    if not any(item.kind for item in items):
+        return jsonify({'error': 'Upload PDFs, photos or audio recordings'}), 400
+    
+    latency_target = _latency_target()
+    for item in items:
+        if item.kind:
+            instrumentation.record_size('documents', 'upload', item.source.size)
+    
+    def extract_document(item):
+        record = extract_claim(item.source, latency_target)
+        record.source = item.name
+        return record
+    
+    bundle = claim_bundle.process_bundle(
+        items,
+        extract_document=extract_document,
+        transcribe_statement=lambda item: extract_statement(
+            item.source, item.name, item.content_type, latency_target
+        ),
+        assess_photo=lambda photo: assess_photo(photo, latency_target),
+        read_photo=lambda item: _read_upload(item.source),
+        max_workers=BUNDLE_WORKERS,
+        photo_max_side=BUNDLE_PHOTO_MAX_SIDE,
+        duplicate_distance=BUNDLE_DUPLICATE_DISTANCE,
+    )
+    return jsonify(bundle.to_dict())
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@documents.route('/stream', methods=['POST'])
+def stream_extraction():
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    if not file.filename.endswith('.pdf'):
+        return jsonify({'error': 'Please upload a PDF file'}), 400
+    
+    upload = file.stream
+    route = _route(upload, _latency_target())
+    # The session cookie goes out before the body, so reserve the result ID now
+    result_id = new_result_id()
+    session['result_id'] = result_id
+    
+    def generate():
+        try:
+            cache_key = _cache_key(upload, route)
+            cached = get_extraction_cache().get(cache_key)
+            if cached is not None:
+                yield _sse('result', {'text': cached})
+                extraction = model_output.parse_extraction(cached)
+            else:
+                with deadline_scope(EXTRACTION_DEADLINE):
+                    # Same paths as extract_document: only a short document
+                    # without a text layer is streamed from a single model call
+                    lines = _local_lines(upload)
+                    text_layer = pdf_text.has_text_layer(lines)
+                    page_count = None if text_layer else _fanout_page_count(upload)
+                    if text_layer or page_count:
+                        if text_layer:
+                            result = _extract_from_text_layer(lines, route)
+                        else:
+                            result = _extract_page_ranges(upload, route, page_count)
+                        yield _sse('result', {'text': result})
+                        extraction = model_output.parse_extraction(result)
+                    else:
+                        # Parse while streaming so the result is ready as soon as the last chunk arrives
+                        parser = model_output.IncrementalJSONParser()
+                        for text in _upload_and_stream(upload.path, EXTRACTION_PROMPT, route):
+                            parser.feed(text)
+                            yield _sse('chunk', {'text': text})
+                        extraction = parser.result()
+                instrumentation.record_size('documents', 'model_output', len(extraction.raw))
+                if _cacheable(extraction):
+                    get_extraction_cache().put(cache_key, extraction.raw)
             
-            def section_header(self, title):
-                self.set_font('Arial', 'B', 12)
-                self.cell(0, 8, title, 0, 1, 'L')
-                self.ln(2)
+            get_result_store().put(result_id, extraction)
             
-            def section_content(self, content):
-                self.set_font('Arial', '', 10)
-                # Handle text encoding for special characters
-                try:
-                    content = content.encode('latin-1', 'replace').decode('latin-1')
-                except:
-                    content = str(content)
-                
-                # Split content into lines and add them
-                lines = content.split('\n')
-                for line in lines:
-                    if len(line) > 80:  # Wrap long lines
-                        words = line.split(' ')
-                        current_line = ''
-                        for word in words:
-                            if len(current_line + word) < 80:
-                                current_line += word + ' '
-                            else:
-                                if current_line:
-                                    self.cell(0, 6, current_line.strip(), 0, 1, 'L')
-                                current_line = word + ' '
-                        if current_line:
-                            self.cell(0, 6, current_line.strip(), 0, 1, 'L')
-                    else:
-                        self.cell(0, 6, line, 0, 1, 'L')
-                self.ln(3)
-        
-        pdf = PDF()
-        pdf.add_page()
-        
-        # Add document metadata if available
-        if 'document_metadata' in data:
-            metadata = data['document_metadata']
-            pdf.section_header('Document Information')
-            pdf.section_content(f"Document Type: {metadata.get('document_type', 'Unknown')}")
-            pdf.section_content(f"Total Sections: {metadata.get('total_sections', 'Unknown')}")
-            pdf.section_content(f"Extraction Date: {metadata.get('extraction_timestamp', 'Unknown')}")
-            pdf.ln(5)
-        
-        # Add sections with full content
-        for sec_key, sec_data in sections.items():
-            if isinstance(sec_data, dict):
-                title = sec_data.get('title', sec_key)
-                section_type = sec_data.get('section_type', 'unknown')
-                level = sec_data.get('hierarchy_level', '')
-                
-                # Add section header
-                pdf.section_header(f"{title} (Type: {section_type}, Level: {level})")
-                
-                # Add section content
-                if 'content' in sec_data and isinstance(sec_data['content'], dict):
-                    raw_text = sec_data['content'].get('raw_text', '')
-                    word_count = sec_data['content'].get('word_count', '')
-                    
-                    if raw_text:
-                        pdf.section_content(raw_text)
-                    if word_count:
-                        pdf.section_content(f"Word Count: {word_count}")
-                elif 'content' in sec_data:
-                    pdf.section_content(str(sec_data['content']))
-                
-                pdf.ln(3)
-                
-                # Check if we need a new page
-                if pdf.get_y() > 250:
-                    pdf.add_page()
-        
-        # Create BytesIO buffer
-        pdf_output = io.BytesIO()
-        pdf_string = pdf.output(dest='S')
-        if isinstance(pdf_string, str):
-            pdf_output.write(pdf_string.encode('latin-1'))
-        else:
-            pdf_output.write(pdf_string)
-        pdf_output.seek(0)
-        
-        return send_file(
-            pdf_output, 
-            as_attachment=True, 
-            download_name="extracted_sections.pdf", 
-            mimetype='application/pdf'
+            warning = None
+            if not extraction.valid:
+                warning = "Note: The extracted content may not be in perfect JSON format."
+            yield _sse('done', {
+                'result_id': result_id,
+                'download_url': url_for('.download_pdf', result_id=result_id),
+                'warning': warning,
+            })
+        except Exception as e:
+            yield _sse('error', {'error': f"Error processing with Gemini API: {str(e)}"})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@documents.app_errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit = current_app.config['MAX_CONTENT_LENGTH']
+    message = f"File is too large (limit is {limit // (1024 * 1024)} MB)"
+    if request.path == url_for('.upload_file'):
+        return render_template_string(HTML_FORM, result=None, error=message), 413
+    return jsonify({'error': message}), 413
+
+@documents.route('/parse/stats')
+def parse_stats():
+    return jsonify(model_output.parse_stats())
+
+def _endpoint_name():
+    # View name without the blueprint prefix, for metric labels and profile files
+    return (request.endpoint or 'unmatched').rpartition('.')[2]
+
+@documents.before_app_request
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.profile = None
+    if instrumentation.profiling_requested(request.headers, request.args):
+        g.profile = instrumentation.RequestProfile('documents', _endpoint_name()).start()
+
+@documents.after_app_request
+def _tag_profile(response):
+    g.status = response.status_code
+    if g.get('profile') is not None and g.profile.filename:
+        response.headers['X-Profile-File'] = g.profile.filename
+    return response
+
+@documents.teardown_app_request
+def _finish_request(error=None):
+    # Runs after streamed bodies have been sent, so they are timed in full
+    if g.get('profile') is not None:
+        g.profile.stop()
+    if 'request_started' in g:
+        instrumentation.REQUEST_SECONDS.observe(
+            time.perf_counter() - g.request_started,
+            service='documents',
+            endpoint=_endpoint_name(),
+            status=str(g.get('status', 500)),
         )
-        
-    except Exception as e:
-        # If PDF generation fails, redirect back with error
-        return redirect(url_for('upload_file'))
+
+@documents.route('/healthz')
+def healthz():
+    # Answered without touching the model SDKs or PDF libraries, which load on first use
+    return jsonify({'status': 'ok'})
+
+@documents.route('/metrics')
+def metrics():
+    return Response(instrumentation.render(), content_type=instrumentation.CONTENT_TYPE)
+
+@documents.route('/models/stats')
+def model_stats():
+    # Smoothed latency per document route (null until used) and the circuit
+    # breaker / rate limit state of each backend in use
+    return jsonify({'routes': document_router.stats(), 'backends': backend_stats()})
+
+@documents.route('/cache/stats')
+def cache_stats():
+    return jsonify({
+        'extractions': get_extraction_cache().stats(),
+        'rendered_pdfs': pdf_renderer.cache_stats(),
+    })
+
+def create_app(config=None):
+    """Build the document service; ``config`` overrides Flask settings.
+
+    Model SDKs and the PDF libraries are not imported here but on first use.
+    """
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # Uploads are hashed and size-checked while the request body is parsed;
+    # files up to UPLOAD_SPOOL_MAX stay in memory, larger ones spill to UPLOAD_FOLDER
+    app.request_class = UploadRequest
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_BYTES', str(100 * 1024 * 1024)))
+    app.config['UPLOAD_SPOOL_MAX'] = int(os.getenv('UPLOAD_SPOOL_MAX', str(4 * 1024 * 1024)))
+    app.secret_key = 'your_secret_key_change_this_in_production'  # Change this in production
+    if config:
+        app.config.update(config)
+    # Fan-out chunks are written to UPLOAD_FOLDER off the request thread
+    for folder in {UPLOAD_FOLDER, app.config['UPLOAD_FOLDER']}:
+        os.makedirs(folder, exist_ok=True)
+    app.register_blueprint(documents)
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
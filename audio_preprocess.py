@@ -0,0 +1,149 @@
+"""Shrink uploaded audio before it is sent for transcription.
+
+Clients upload whatever their recorder produced: often stereo, 44.1 or
+48 kHz, with seconds of silence either side of the question. Whisper works
+at 16 kHz mono, so the rest is upload time spent for nothing. An upload is
+decoded, downmixed to mono, resampled to 16 kHz, trimmed of leading and
+trailing silence, and re-encoded compactly.
+
+Decoding and encoding use ``ffmpeg`` when it is on the PATH, and Opus is
+used for the output. Without it, only WAV input can be decoded (with the
+standard library), and the output is 16-bit WAV. Anything that cannot be
+decoded, or that would not get smaller, is passed through unchanged, as
+is everything when NumPy is not installed.
+"""
+
+import io
+import shutil
+import subprocess
+import time
+import wave
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+import optional_deps
+from audio_stream import SAMPLE_WIDTH, pcm_to_wav
+
+if TYPE_CHECKING:  # pragma: no cover
+    import numpy as np
+
+TARGET_RATE = 16000
+_FFMPEG = shutil.which("ffmpeg")
+
+
+@dataclass
+class PreprocessedAudio:
+    data: bytes
+    filename: str
+    content_type: str
+    original_bytes: int
+    seconds: float = 0.0  # duration after trimming; 0 when passed through
+    trimmed_seconds: float = 0.0
+    elapsed: float = 0.0
+
+    @property
+    def changed(self) -> bool:
+        return self.original_bytes != len(self.data)
+
+
+def _decode_ffmpeg(audio: bytes) -> Optional["np.ndarray"]:
+    result = subprocess.run(
+        [_FFMPEG, "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+         "-ac", "1", "-ar", str(TARGET_RATE), "-f", "s16le", "pipe:1"],
+        input=audio, capture_output=True, timeout=60,
+    )
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return optional_deps.numpy().frombuffer(result.stdout, dtype="<i2")
+
+
+def _decode_wav(audio: bytes) -> Optional["np.ndarray"]:
+    try:
+        with wave.open(io.BytesIO(audio), "rb") as wav:
+            if wav.getsampwidth() != SAMPLE_WIDTH:
+                return None
+            channels, rate = wav.getnchannels(), wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    np = optional_deps.numpy()
+    samples = np.frombuffer(frames, dtype="<i2")
+    if channels > 1:
+        samples = samples[: len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    if rate != TARGET_RATE and len(samples):
+        # Linear interpolation; speech has little energy above 8 kHz anyway
+        positions = np.arange(0, len(samples), rate / TARGET_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return samples.astype("<i2")
+
+
+def decode(audio: bytes) -> Optional["np.ndarray"]:
+    """Decode to 16 kHz mono 16-bit samples, or ``None`` if the format is unsupported."""
+    if _FFMPEG is not None:
+        return _decode_ffmpeg(audio)
+    return _decode_wav(audio)
+
+
+def trim_silence(
+    samples: "np.ndarray",
+    sample_rate: int = TARGET_RATE,
+    frame_ms: int = 20,
+    floor: float = 100.0,
+    ratio: float = 0.05,
+    pad_ms: int = 200,
+) -> "np.ndarray":
+    """Drop leading and trailing silence.
+
+    A frame counts as sound when its RMS energy is above ``floor`` and above
+    ``ratio`` times the loudest frame, so quiet recordings are not trimmed to
+    nothing. ``pad_ms`` of audio is kept either side of the first and last
+    sounding frames. Audio with no sounding frame is returned as is.
+    """
+    np = optional_deps.numpy()
+    frame = sample_rate * frame_ms // 1000
+    count = len(samples) // frame
+    if count == 0:
+        return samples
+    frames = samples[: count * frame].astype(np.float32).reshape(count, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    loud = np.flatnonzero(rms > max(floor, ratio * float(rms.max())))
+    if not len(loud):
+        return samples
+    pad = sample_rate * pad_ms // 1000
+    start = max(loud[0] * frame - pad, 0)
+    end = min((loud[-1] + 1) * frame + pad, len(samples))
+    return samples[start:end]
+
+
+def _encode_opus(samples: "np.ndarray") -> Optional[bytes]:
+    result = subprocess.run(
+        [_FFMPEG, "-nostdin", "-loglevel", "error", "-f", "s16le", "-ac", "1",
+         "-ar", str(TARGET_RATE), "-i", "pipe:0",
+         "-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg", "pipe:1"],
+        input=samples.tobytes(), capture_output=True, timeout=60,
+    )
+    return result.stdout if result.returncode == 0 and result.stdout else None
+
+
+def preprocess_audio(audio: bytes, filename: str, content_type: str) -> PreprocessedAudio:
+    """Decode, downmix, resample, trim and re-encode ``audio`` if that makes it smaller."""
+    started = time.perf_counter()
+    passthrough = PreprocessedAudio(audio, filename, content_type, len(audio))
+    samples = decode(audio) if optional_deps.numpy() is not None else None
+    if samples is None or not len(samples):
+        passthrough.elapsed = time.perf_counter() - started
+        return passthrough
+
+    trimmed = trim_silence(samples)
+    encoded = _encode_opus(trimmed) if _FFMPEG is not None else None
+    if encoded is not None:
+        result = PreprocessedAudio(encoded, "audio.ogg", "audio/ogg", len(audio))
+    else:
+        result = PreprocessedAudio(pcm_to_wav(trimmed.tobytes(), TARGET_RATE), "audio.wav", "audio/wav", len(audio))
+    if len(result.data) >= len(audio):
+        result = passthrough
+    else:
+        result.seconds = len(trimmed) / TARGET_RATE
+        result.trimmed_seconds = (len(samples) - len(trimmed)) / TARGET_RATE
+    result.elapsed = time.perf_counter() - started
+    return result
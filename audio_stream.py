@@ -0,0 +1,124 @@
+"""In-memory buffering and silence segmentation of streamed PCM audio.
+
+The voice WebSocket receives raw 16-bit little-endian mono PCM in arbitrary
+frame sizes. :class:`SilenceSegmenter` measures the energy of fixed-length
+analysis frames and cuts a segment once speech is followed by enough
+silence, so each phrase can be sent for transcription while the speaker
+is still talking. Segments are wrapped as WAV in memory; nothing touches
+disk.
+"""
+
+import io
+import math
+import wave
+from array import array
+from typing import List, Optional
+
+import optional_deps
+
+SAMPLE_WIDTH = 2  # bytes per sample, 16-bit PCM
+
+
+def frame_rms(frame: bytes) -> float:
+    """Root-mean-square amplitude of a 16-bit little-endian PCM frame."""
+    if not frame:
+        return 0.0
+    np = optional_deps.numpy()
+    if np is not None:
+        samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        return float(np.sqrt(np.mean(samples * samples)))
+    samples = array("h", frame)
+    return math.sqrt(sum(sample * sample for sample in samples) / len(samples))
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int, channels: int = 1) -> bytes:
+    """Wrap raw 16-bit PCM in a WAV container, in memory."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class SilenceSegmenter:
+    """Split a PCM stream into speech segments at pauses.
+
+    ``feed`` returns the segments completed by the new audio; ``flush``
+    returns whatever speech is still buffered when the utterance ends.
+    Segments that never rise above ``threshold`` are dropped.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        frame_ms: int = 30,
+        threshold: float = 500.0,
+        min_silence_ms: int = 500,
+        min_segment_ms: int = 400,
+        max_segment_ms: int = 15000,
+    ):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self._frame_bytes = sample_rate * frame_ms // 1000 * SAMPLE_WIDTH
+        if self._frame_bytes <= 0:
+            # feed() would never consume input (or divide by zero) otherwise
+            raise ValueError(f"{frame_ms} ms frames at {sample_rate} Hz hold no samples")
+        self._min_silence_frames = max(min_silence_ms // frame_ms, 1)
+        self._min_segment_frames = max(min_segment_ms // frame_ms, 1)
+        self._max_segment_frames = max(max_segment_ms // frame_ms, 1)
+        self._pending = bytearray()  # partial analysis frame
+        self._segment = bytearray()
+        self._frames = 0
+        self._speech_frames = 0
+        self._silent_run = 0
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        self._pending.extend(pcm)
+        completed: List[bytes] = []
+        offset = 0
+        while len(self._pending) - offset >= self._frame_bytes:
+            frame = bytes(self._pending[offset:offset + self._frame_bytes])
+            offset += self._frame_bytes
+            segment = self._add_frame(frame)
+            if segment is not None:
+                completed.append(segment)
+        del self._pending[:offset]
+        return completed
+
+    def flush(self) -> Optional[bytes]:
+        self._segment.extend(self._pending)
+        self._pending.clear()
+        return self._cut()
+
+    def _add_frame(self, frame: bytes) -> Optional[bytes]:
+        if frame_rms(frame) >= self.threshold:
+            self._speech_frames += 1
+            self._silent_run = 0
+        elif not self._speech_frames:
+            # Leading silence is not worth sending; keep only a short lead-in
+            self._segment = self._segment[-self._frame_bytes * 2:]
+            self._frames = len(self._segment) // self._frame_bytes
+            self._silent_run += 1
+        else:
+            self._silent_run += 1
+        self._segment.extend(frame)
+        self._frames += 1
+
+        if self._silent_run >= self._min_silence_frames and self._speech_frames:
+            if self._speech_frames >= self._min_segment_frames:
+                return self._cut()
+            # Too short to be speech (a click or cough); drop it
+            self._speech_frames = 0
+        if self._frames >= self._max_segment_frames:
+            return self._cut()
+        return None
+
+    def _cut(self) -> Optional[bytes]:
+        segment = bytes(self._segment) if self._speech_frames else None
+        self._segment = bytearray()
+        self._frames = 0
+        self._speech_frames = 0
+        self._silent_run = 0
+        return segment
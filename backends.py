@@ -0,0 +1,508 @@
+"""Model backends shared by the document and voice services.
+
+A backend wraps one provider behind a small interface: synchronous text
+generation (optionally over an uploaded file) for the Flask document
+service, and asynchronous chat and transcription for the voice service.
+Backends are registered by name and built lazily on first use, so a
+service only imports and configures the SDKs it actually routes to.
+
+Which backend and model serve a request is decided by a
+:class:`ModelRouter`: routes are listed from cheapest to most capable, each
+optionally limited to inputs up to a given size, and a request can pass a
+latency target, in which case the most capable route whose observed
+latency meets it is chosen.
+
+The ``local`` backend answers deterministically after a configurable
+delay without any network access, for offline development and benchmarks.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+
+from instrumentation import stage
+from resilience import UploadJanitor, caller_from_env, remaining_time
+
+Messages = List[Dict[str, str]]
+
+
+class BackendNotConfigured(RuntimeError):
+    """Raised when a backend is missing credentials or its SDK."""
+
+
+class BackendError(RuntimeError):
+    """A provider call failed; raised in place of SDK-specific errors."""
+
+
+class BackendTimeout(BackendError):
+    """A provider call timed out."""
+
+
+class Backend:
+    """Interface for model providers; unsupported operations raise ``NotImplementedError``."""
+
+    name = "backend"
+
+    def check(self) -> None:
+        """Raise :class:`BackendNotConfigured` if the backend cannot serve requests."""
+
+    def generate(
+        self, prompt: str, model: str, file_path: Optional[str] = None, mime_type: Optional[str] = None
+    ) -> str:
+        raise NotImplementedError(f"{self.name} does not support text generation")
+
+    def generate_stream(
+        self, prompt: str, model: str, file_path: Optional[str] = None, mime_type: Optional[str] = None
+    ) -> Iterator[str]:
+        raise NotImplementedError(f"{self.name} does not support streamed generation")
+
+    async def chat(self, messages: Messages, model: str) -> str:
+        raise NotImplementedError(f"{self.name} does not support chat")
+
+    def chat_stream(self, messages: Messages, model: str) -> AsyncIterator[str]:
+        raise NotImplementedError(f"{self.name} does not support streamed chat")
+
+    async def transcribe(self, filename: str, audio: bytes, content_type: str, model: str) -> str:
+        raise NotImplementedError(f"{self.name} does not support transcription")
+
+    async def aclose(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, object]:
+        calls = getattr(self, "calls", None)
+        return calls.stats() if calls is not None else {}
+
+
+# Uploads are named with this prefix so the janitor can recognise its own
+_UPLOAD_PREFIX = "docunder-"
+
+
+class GeminiBackend(Backend):
+    """Google Gemini through ``google.generativeai`` (synchronous).
+
+    Calls are rate-limited and retried by a ``RemoteCaller``. Uploaded files
+    are deleted by a background janitor, which also sweeps up uploads older
+    than ``upload_max_age`` that an earlier run failed to delete.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str], upload_max_age: float = 3600.0, sweep_interval: float = 600.0):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self._api_key = api_key
+        self._models: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.calls = caller_from_env(self.name)
+        self.janitor = UploadJanitor(
+            self.name,
+            self._delete_now,
+            self._own_uploads if api_key else None,
+            sweep_interval=sweep_interval,
+            max_age=upload_max_age,
+        )
+
+    def check(self) -> None:
+        if not self._api_key:
+            raise BackendNotConfigured("GEMINI_API_KEY is not configured")
+
+    def _model(self, name: str):
+        with self._lock:
+            if name not in self._models:
+                self._models[name] = self._genai.GenerativeModel(name)
+            return self._models[name]
+
+    def _generate_content(self, model: str, contents, stream: bool = False):
+        def attempt():
+            timeout = remaining_time()
+            options = {"timeout": timeout} if timeout is not None else None
+            return self._model(model).generate_content(contents, stream=stream, request_options=options)
+
+        with stage(self.name, "generate_content"):
+            return self.calls.call(attempt)
+
+    def generate(
+        self, prompt: str, model: str, file_path: Optional[str] = None, mime_type: Optional[str] = None
+    ) -> str:
+        if file_path is None:
+            return self._generate_content(model, prompt).text
+        uploaded_file = self._upload(file_path, mime_type)
+        try:
+            return self._generate_content(model, [uploaded_file, prompt]).text
+        finally:
+            self._delete(uploaded_file)
+
+    def generate_stream(
+        self, prompt: str, model: str, file_path: Optional[str] = None, mime_type: Optional[str] = None
+    ) -> Iterator[str]:
+        uploaded_file = self._upload(file_path, mime_type) if file_path is not None else None
+        try:
+            contents = [uploaded_file, prompt] if uploaded_file is not None else prompt
+            # Only opening the stream is retried; a failure mid-stream surfaces
+            for chunk in self._generate_content(model, contents, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # Chunk without text parts (e.g. finish/safety metadata)
+                if text:
+                    yield text
+        finally:
+            if uploaded_file is not None:
+                self._delete(uploaded_file)
+
+    def _upload(self, file_path: str, mime_type: Optional[str] = None):
+        # The SDK would otherwise guess the type from the path's extension
+        with stage(self.name, "upload_file"):
+            return self.calls.call(
+                self._genai.upload_file,
+                file_path,
+                mime_type=mime_type,
+                display_name=f"{_UPLOAD_PREFIX}{uuid.uuid4().hex}",
+            )
+
+    def _delete(self, uploaded_file) -> None:
+        # Off the request path; the janitor retries until the delete succeeds
+        self.janitor.schedule(uploaded_file.name)
+
+    def _delete_now(self, name: str) -> None:
+        with stage(self.name, "delete_file"):
+            try:
+                self._genai.delete_file(name)
+            except Exception as e:
+                if getattr(e, "code", None) == 404:
+                    return  # Already gone
+                raise
+
+    def _own_uploads(self):
+        now = time.time()
+        for uploaded in self._genai.list_files():
+            if (uploaded.display_name or "").startswith(_UPLOAD_PREFIX):
+                yield uploaded.name, now - uploaded.create_time.timestamp()
+
+
+class OpenAIBackend(Backend):
+    """OpenAI chat and Whisper on one pooled async client."""
+
+    name = "openai"
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        max_concurrency: int = 32,
+        transcribe_timeout: float = 30.0,
+        chat_timeout: float = 30.0,
+        max_retries: int = 2,
+    ):
+        # The SDK raises its own error for a missing key while the client is
+        # built; report it as unconfigured, like the other backends
+        if not api_key:
+            raise BackendNotConfigured("OPENAI_API_KEY is not configured")
+        import httpx
+        import openai
+
+        self.transcribe_timeout = transcribe_timeout
+        self.chat_timeout = chat_timeout
+        # One pooled connection set shared by every request; keep-alive avoids
+        # a TLS handshake per call
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            timeout=httpx.Timeout(max(transcribe_timeout, chat_timeout), connect=5.0),
+        )
+        # Retries are done by the shared call layer, not the SDK, so they
+        # share the rate limit, deadline and circuit breaker
+        self._openai = openai
+        self.client = openai.AsyncOpenAI(api_key=api_key, http_client=self._http_client, max_retries=0)
+        self.calls = caller_from_env(self.name, retries=max_retries)
+        # Bounds in-flight calls so a burst queues here instead of at the API
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    @contextmanager
+    def _errors(self) -> Iterator[None]:
+        # Callers handle BackendError, so they never need to import the SDK
+        try:
+            yield
+        except self._openai.APITimeoutError as e:
+            raise BackendTimeout(f"OpenAI request timed out: {e}") from e
+        except self._openai.APIError as e:
+            raise BackendError(f"OpenAI request failed: {e}") from e
+
+    async def _completion(self, **params):
+        async with self._slots:
+            return await self.client.chat.completions.create(timeout=remaining_time(self.chat_timeout), **params)
+
+    async def _transcription(self, **params):
+        async with self._slots:
+            return await self.client.audio.transcriptions.create(
+                timeout=remaining_time(self.transcribe_timeout), **params
+            )
+
+    async def chat(self, messages: Messages, model: str) -> str:
+        with self._errors():
+            response = await self.calls.acall(self._completion, model=model, messages=messages)
+        return response.choices[0].message.content
+
+    async def chat_stream(self, messages: Messages, model: str) -> AsyncIterator[str]:
+        with self._errors():
+            # Only opening the stream is retried; a failure mid-stream surfaces
+            stream = await self.calls.acall(self._completion, model=model, messages=messages, stream=True)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def transcribe(self, filename: str, audio: bytes, content_type: str, model: str) -> str:
+        with self._errors():
+            return await self.calls.acall(
+                self._transcription, model=model, file=(filename, audio, content_type), response_format="text"
+            )
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+
+_HINT_ROW = re.compile(r"^L(\d+) p\d+: (.+)$", re.MULTILINE)
+
+
+class LocalBackend(Backend):
+    """Deterministic offline stand-in with a fixed delay per call.
+
+    Replies depend only on the input, so repeated runs are comparable.
+    ``latency`` is the delay before a reply (or its first token) and
+    ``token_latency`` the delay between streamed tokens.
+    """
+
+    name = "local"
+
+    def __init__(self, latency: float = 0.0, token_latency: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+
+    @staticmethod
+    def _digest(*parts) -> str:
+        hasher = hashlib.sha256()
+        for part in parts:
+            hasher.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        return hasher.hexdigest()[:12]
+
+    def _document(self, prompt: str, model: str, file_path: Optional[str]) -> str:
+        rows = _HINT_ROW.findall(prompt)
+        if rows:
+            # Structure prompt: treat every heading candidate as a section start
+            return json.dumps({
+                "document_type": f"PDF ({model})",
+                "sections": [
+                    {"line": int(line), "title": title, "section_type": "header", "hierarchy_level": 1}
+                    for line, title in rows
+                ],
+            })
+        size = os.path.getsize(file_path) if file_path else 0
+        text = f"Local extraction {self._digest(prompt, model, size)} of a {size}-byte file."
+        return json.dumps({
+            "document_metadata": {"document_type": f"PDF ({model})", "total_sections": 1},
+            "extracted_sections": {
+                "section_1": {
+                    "title": "Document",
+                    "section_type": "paragraph",
+                    "hierarchy_level": 1,
+                    "content": {"raw_text": text, "word_count": len(text.split())},
+                }
+            },
+        }, indent=2)
+
+    def generate(
+        self, prompt: str, model: str, file_path: Optional[str] = None, mime_type: Optional[str] = None
+    ) -> str:
+        time.sleep(self.latency)
+        return self._document(prompt, model, file_path)
+
+    def generate_stream(
+        self, prompt: str, model: str, file_path: Optional[str] = None, mime_type: Optional[str] = None
+    ) -> Iterator[str]:
+        time.sleep(self.latency)
+        text = self._document(prompt, model, file_path)
+        for start in range(0, len(text), 64):
+            if start:
+                time.sleep(self.token_latency)
+            yield text[start:start + 64]
+
+    def _answer(self, messages: Messages, model: str) -> str:
+        question = messages[-1]["content"] if messages else ""
+        return f"Local answer {self._digest(question, model)} from {model}."
+
+    async def chat(self, messages: Messages, model: str) -> str:
+        await asyncio.sleep(self.latency)
+        return self._answer(messages, model)
+
+    async def chat_stream(self, messages: Messages, model: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.latency)
+        for index, word in enumerate(self._answer(messages, model).split(" ")):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            yield word if not index else " " + word
+
+    async def transcribe(self, filename: str, audio: bytes, content_type: str, model: str) -> str:
+        await asyncio.sleep(self.latency)
+        return f"Local transcript {self._digest(audio, model)} of {len(audio)} bytes."
+
+
+_FACTORIES: Dict[str, Callable[[], Backend]] = {}
+_INSTANCES: Dict[str, Backend] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable[[], Backend]) -> None:
+    """Register ``factory`` under ``name``, replacing any built instance."""
+    with _REGISTRY_LOCK:
+        _FACTORIES[name] = factory
+        _INSTANCES.pop(name, None)
+
+
+def get_backend(name: str) -> Backend:
+    """Return the backend registered as ``name``, building it on first use."""
+    with _REGISTRY_LOCK:
+        if name not in _INSTANCES:
+            if name not in _FACTORIES:
+                raise KeyError(f"Unknown model backend: {name}")
+            _INSTANCES[name] = _FACTORIES[name]()
+        return _INSTANCES[name]
+
+
+def available_backends() -> List[str]:
+    return sorted(_FACTORIES)
+
+
+def backend_stats() -> Dict[str, Dict[str, object]]:
+    """Call-layer state (circuit breaker, rate limit) of every backend built so far."""
+    with _REGISTRY_LOCK:
+        instances = dict(_INSTANCES)
+    return {name: backend.stats() for name, backend in instances.items()}
+
+
+async def close_backends() -> None:
+    """Close the async clients of every backend built so far."""
+    with _REGISTRY_LOCK:
+        instances = list(_INSTANCES.values())
+    for backend in instances:
+        await backend.aclose()
+
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def run_sync(coroutine, timeout: Optional[float] = None):
+    """Run an async backend call from synchronous code and return its result.
+
+    For the Flask service, whose worker threads have no event loop. Every
+    call runs on one background loop, so pooled async clients are reused
+    across requests. The caller's context, and with it any request
+    deadline, is carried over. A process should use this or its own loop
+    for a backend, not both, as async clients are bound to one loop.
+    """
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="backend-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _LOOP).result(timeout)
+
+
+register_backend("gemini", lambda: GeminiBackend(
+    os.getenv("GEMINI_API_KEY"),
+    upload_max_age=float(os.getenv("GEMINI_UPLOAD_MAX_AGE", "3600")),
+    sweep_interval=float(os.getenv("GEMINI_JANITOR_INTERVAL", "600")),
+))
+register_backend("openai", lambda: OpenAIBackend(
+    os.getenv("OPENAI_API_KEY"),
+    max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "32")),
+    transcribe_timeout=float(os.getenv("OPENAI_TRANSCRIBE_TIMEOUT", "30")),
+    chat_timeout=float(os.getenv("OPENAI_CHAT_TIMEOUT", "30")),
+    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "2")),
+))
+register_backend("local", lambda: LocalBackend(
+    latency=float(os.getenv("LOCAL_BACKEND_LATENCY", "0")),
+    token_latency=float(os.getenv("LOCAL_BACKEND_TOKEN_LATENCY", "0")),
+))
+
+
+@dataclass(frozen=True)
+class Route:
+    backend: str
+    model: str
+    max_size: Optional[int] = None  # largest input this route is used for
+
+    @property
+    def label(self) -> str:
+        return f"{self.backend}:{self.model}"
+
+
+def parse_routes(spec: str) -> List[Route]:
+    """Parse ``"backend:model[<=max_size], ..."``, cheapest route first."""
+    routes = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        target, _, limit = entry.partition("<=")
+        backend, separator, model = target.strip().partition(":")
+        if not separator or not backend or not model:
+            raise ValueError(f"Model route must look like backend:model, got {entry!r}")
+        routes.append(Route(backend, model, int(limit) if limit else None))
+    if not routes:
+        raise ValueError("At least one model route is required")
+    return routes
+
+
+class ModelRouter:
+    """Pick a route per request from input size and an optional latency target.
+
+    Routes are ordered cheapest first. A route with ``max_size`` is only
+    used for inputs up to that size; without a latency target the first
+    route that fits the input is chosen. With a target, the most capable
+    fitting route whose observed latency (an exponential moving average fed
+    by :meth:`observe`) meets it is chosen, falling back to the fastest.
+    Routes not yet observed are assumed to meet any target.
+    """
+
+    def __init__(self, routes: Sequence[Route], smoothing: float = 0.2):
+        self.routes = list(routes)
+        self._smoothing = smoothing
+        self._latency: Dict[Route, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "ModelRouter":
+        return cls(parse_routes(spec))
+
+    def select(self, size: int = 0, latency_target: Optional[float] = None) -> Route:
+        fitting = [route for route in self.routes if route.max_size is None or size <= route.max_size]
+        # Nothing is large enough: the last route is the most capable one
+        fitting = fitting or self.routes[-1:]
+        if latency_target is None:
+            return fitting[0]
+        with self._lock:
+            latency = dict(self._latency)
+        meeting = [route for route in fitting if latency.get(route, 0.0) <= latency_target]
+        if meeting:
+            return meeting[-1]
+        return min(fitting, key=lambda route: latency[route])
+
+    def observe(self, route: Route, seconds: float) -> None:
+        with self._lock:
+            previous = self._latency.get(route)
+            self._latency[route] = seconds if previous is None else (
+                previous + self._smoothing * (seconds - previous)
+            )
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            return {route.label: self._latency.get(route) for route in self.routes}
@@ -0,0 +1,188 @@
+"""Bulk claim ingestion: run many extractions with bounded concurrency.
+
+``run_batch`` keeps at most ``max_workers`` extractions in flight and yields
+one record per document as soon as it finishes, so results can be streamed to
+a JSON-lines file or HTTP response without holding the whole batch in memory.
+
+Command-line usage::
+
+    python batch.py claims/ -o results.jsonl --workers 8
+    python batch.py claims/ --claims -o claims.parquet
+
+With ``--claims`` only claim fields are extracted (see ``claims``), and the
+output may also be a ``.csv`` or ``.parquet`` file, written once every
+document is done. Directories are walked recursively; ``.zip`` and ``.tar`` archives found
+along the way are expanded and every PDF inside is processed too.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+def is_archive(name: str) -> bool:
+    """Return True if ``name`` looks like a supported archive."""
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def extract_archive_pdfs(archive, dest_dir: str, archive_name: str = "") -> Iterator[Tuple[str, str]]:
+    """Yield ``(member_name, path)`` for every PDF inside a zip or tar archive.
+
+    ``archive`` may be a path or a seekable binary file object. Members are
+    copied one at a time to unique paths in ``dest_dir``; archive-provided
+    paths are never used on disk.
+    """
+    name = archive_name or str(archive)
+    if name.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive) as bundle:
+            for info in bundle.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                    continue
+                path = os.path.join(dest_dir, f"{uuid.uuid4().hex}.pdf")
+                with bundle.open(info) as src, open(path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                yield info.filename, path
+    else:
+        if isinstance(archive, (str, os.PathLike)):
+            bundle = tarfile.open(archive, mode="r:*")
+        else:
+            bundle = tarfile.open(fileobj=archive, mode="r:*")
+        with bundle:
+            for member in bundle:
+                if not member.isfile() or not member.name.lower().endswith(".pdf"):
+                    continue
+                path = os.path.join(dest_dir, f"{uuid.uuid4().hex}.pdf")
+                with bundle.extractfile(member) as src, open(path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                yield member.name, path
+
+
+def run_batch(
+    items: Iterable[Tuple[str, str]],
+    extract: Callable[[str], Any],
+    max_workers: int = 4,
+    scratch_dir: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Extract ``(name, path)`` items concurrently, yielding records as they complete.
+
+    ``items`` is consumed lazily: a new document is only started when a slot
+    frees up. Files located inside ``scratch_dir`` are removed once processed.
+    Instead of a path, an item may carry an in-flight upload (anything with a
+    ``size`` attribute, see ``uploads.SpooledUpload``); it is passed to
+    ``extract`` unchanged and its owner cleans it up.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+
+        def fill() -> None:
+            while len(pending) < max_workers:
+                try:
+                    name, path = next(items)
+                except StopIteration:
+                    return
+                pending[pool.submit(_extract_one, extract, name, path, scratch_dir)] = name
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                yield future.result()
+            fill()
+
+
+def _extract_one(extract: Callable[[str], Any], name: str, path: str, scratch_dir: Optional[str]) -> Dict[str, Any]:
+    on_disk = isinstance(path, (str, os.PathLike))
+    record: Dict[str, Any] = {"document": name, "bytes": os.path.getsize(path) if on_disk else path.size}
+    start = time.perf_counter()
+    try:
+        record["result"] = extract(path)
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        if on_disk and scratch_dir and os.path.dirname(os.path.abspath(path)) == os.path.abspath(scratch_dir):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return record
+
+
+def iter_directory(root: str, scratch_dir: str) -> Iterator[Tuple[str, str]]:
+    """Walk ``root`` yielding PDFs directly and PDFs expanded from archives."""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            rel = os.path.relpath(path, root)
+            if filename.lower().endswith(".pdf"):
+                yield rel, path
+            elif is_archive(filename):
+                for member, member_path in extract_archive_pdfs(path, scratch_dir):
+                    yield f"{rel}!{member}", member_path
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Extract sections from every PDF under a directory.")
+    parser.add_argument("directory", help="directory of PDFs and/or zip/tar archives")
+    parser.add_argument("-o", "--output", default="-", help="JSON-lines output file (default: stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="concurrent extractions")
+    parser.add_argument(
+        "--claims", action="store_true",
+        help="extract claim fields instead of sections; -o may then name a .csv or .parquet file",
+    )
+    args = parser.parse_args(argv)
+
+    import claims
+    from app import extract_claim, extract_document
+
+    if args.claims:
+        extract = extract_claim
+        columnar = args.output != "-" and claims.export_format(args.output) != "jsonl"
+        if columnar and claims.export_format(args.output) == "parquet" and not claims.parquet_available():
+            parser.error("Parquet output needs pyarrow installed")
+    else:
+        extract = lambda path: extract_document(path).payload()
+        columnar = False
+    collected = []  # ClaimRecords for a columnar export, kept until the end
+
+    out = sys.stdout if args.output == "-" or columnar else open(args.output, "w", encoding="utf-8")
+    failures = 0
+    try:
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            items = iter_directory(args.directory, scratch_dir)
+            for record in run_batch(items, extract, max_workers=args.workers, scratch_dir=scratch_dir):
+                failures += record["status"] != "ok"
+                if columnar:
+                    collected.extend(claims.from_batch([record]))
+                    continue
+                if args.claims and record["status"] == "ok":
+                    record["result"].source = record["document"]
+                    record["result"] = record["result"].to_dict()
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if columnar:
+        for path in claims.export_claims(collected, args.output):
+            print(f"wrote {path}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Benchmark PDF rendering of large synthetic extraction payloads.
+
+Compares the original per-download renderer (character-count wrapping with
+string concatenation and a BytesIO copy) against ``pdf_renderer`` on a cold
+render and on a cached repeat download. Times are medians over ``--repeat``
+runs. Most of the saving on downloads comes from the byte cache and ETag. A
+cold render is faster only by its cheaper line wrapping, as FPDF's own cell
+output dominates both renderers.
+
+    python benchmarks/bench_pdf_render.py --sections 200 --words 400
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fpdf import FPDF  # noqa: E402
+
+import model_output  # noqa: E402
+import pdf_renderer  # noqa: E402
+
+_WORDS = (
+    "claim policy insured damage vehicle property adjuster estimate invoice "
+    "deductible coverage liability medical report incident statement repair "
+    "total amount payable date loss claimant witness exhibit schedule"
+).split()
+
+
+def synthetic_payload(sections: int, words: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    extracted = {}
+    for i in range(1, sections + 1):
+        paragraphs = []
+        remaining = words
+        while remaining > 0:
+            count = min(remaining, rng.randint(20, 120))
+            paragraphs.append(" ".join(rng.choice(_WORDS) for _ in range(count)))
+            remaining -= count
+        text = "\n".join(paragraphs)
+        extracted[f"section_{i}"] = {
+            "title": f"Section {i}",
+            "section_type": "paragraph",
+            "hierarchy_level": 1,
+            "content": {"raw_text": text, "word_count": words},
+        }
+    return json.dumps({
+        "document_metadata": {
+            "document_type": "PDF",
+            "total_sections": sections,
+            "extraction_timestamp": "2024-01-01T00:00:00Z",
+        },
+        "extracted_sections": extracted,
+    })
+
+
+def legacy_render(extracted_json: str) -> bytes:
+    """The renderer as it was inlined in ``download_pdf`` before pdf_renderer."""
+    data = json.loads(extracted_json)
+    sections = data.get("extracted_sections", {})
+
+    class PDF(FPDF):
+        def header(self):
+            self.set_font("Arial", "B", 16)
+            self.cell(0, 10, "Extracted Document Sections", 0, 1, "C")
+            self.ln(10)
+
+        def section_header(self, title):
+            self.set_font("Arial", "B", 12)
+            self.cell(0, 8, title, 0, 1, "L")
+            self.ln(2)
+
+        def section_content(self, content):
+            self.set_font("Arial", "", 10)
+            content = content.encode("latin-1", "replace").decode("latin-1")
+            for line in content.split("\n"):
+                if len(line) > 80:
+                    current_line = ""
+                    for word in line.split(" "):
+                        if len(current_line + word) < 80:
+                            current_line += word + " "
+                        else:
+                            if current_line:
+                                self.cell(0, 6, current_line.strip(), 0, 1, "L")
+                            current_line = word + " "
+                    if current_line:
+                        self.cell(0, 6, current_line.strip(), 0, 1, "L")
+                else:
+                    self.cell(0, 6, line, 0, 1, "L")
+            self.ln(3)
+
+    pdf = PDF()
+    pdf.add_page()
+    metadata = data["document_metadata"]
+    pdf.section_header("Document Information")
+    pdf.section_content(f"Document Type: {metadata.get('document_type', 'Unknown')}")
+    pdf.section_content(f"Total Sections: {metadata.get('total_sections', 'Unknown')}")
+    pdf.section_content(f"Extraction Date: {metadata.get('extraction_timestamp', 'Unknown')}")
+    pdf.ln(5)
+    for sec_key, sec_data in sections.items():
+        pdf.section_header(f"{sec_data['title']} (Type: {sec_data['section_type']}, Level: {sec_data['hierarchy_level']})")
+        pdf.section_content(sec_data["content"]["raw_text"])
+        pdf.section_content(f"Word Count: {sec_data['content']['word_count']}")
+        pdf.ln(3)
+        if pdf.get_y() > 250:
+            pdf.add_page()
+    buffer = io.BytesIO()
+    buffer.write(pdf.output(dest="S").encode("latin-1"))
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def _time(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=200)
+    parser.add_argument("--words", type=int, default=400, help="words per section")
+    parser.add_argument("--repeat", type=int, default=9)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    payload = synthetic_payload(args.sections, args.words)
+    extraction = model_output.parse_extraction(payload)
+
+    def render_cold():
+        pdf_renderer._render_cache.clear()
+        pdf_renderer.render_cached(extraction)
+
+    pdf_renderer.render_cached(extraction)
+    results = {
+        "sections": args.sections,
+        "words_per_section": args.words,
+        "payload_bytes": len(payload),
+        "legacy_seconds": _time(lambda: legacy_render(payload), args.repeat),
+        "cold_seconds": _time(render_cold, args.repeat),
+        "cached_seconds": _time(lambda: pdf_renderer.render_cached(extraction), args.repeat),
+    }
+    results["cold_speedup"] = results["legacy_seconds"] / results["cold_seconds"]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>18}: {value:.6f}" if isinstance(value, float) else f"{key:>18}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""End-to-end load benchmark of the document and voice services.
+
+Both apps are served on real sockets (werkzeug for Flask, uvicorn for
+FastAPI) with every model route pointed at a recording wrapper around the
+``local`` backend, so no network access is needed and model latency is
+set on the command line. Synthetic claim PDFs and audio clips of several
+sizes are generated up front; each request uses distinct bytes so the
+extraction, render and transcript caches do not short-circuit the work.
+
+Scenarios:
+
+- ``documents``: ``POST /`` with a PDF, then ``GET /download_pdf`` of that
+  result on the same session.
+- ``voice``: ``POST /upload_context`` with a context document, then
+  ``POST /process_audio`` with a clip, on the same session.
+
+Each endpoint reports throughput and p50/p95/p99 latency. Each scenario
+also reports the prompt sizes the model received and the peak memory use.
+That is tracemalloc's peak of Python allocations with ``--trace-memory``,
+and the process's peak RSS otherwise. ``--output`` saves the results as
+JSON. ``--compare`` prints the change against an earlier run.
+
+    python benchmarks/bench_services.py --requests 40 --concurrency 8 --latency 0.2 --output run.json
+    python benchmarks/bench_services.py --compare run.json
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Sequence, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+from fpdf import FPDF  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import backends  # noqa: E402
+from bench_pdf_render import _WORDS  # noqa: E402
+from bench_voice_load import _free_port, serve  # noqa: E402
+from prompt_builder import count_tokens  # noqa: E402
+
+_HEADINGS = ["CLAIM SUMMARY", "POLICY DETAILS", "DESCRIPTION OF LOSS", "DAMAGE ESTIMATE",
+             "WITNESS STATEMENTS", "ADJUSTER NOTES", "PAYMENT SCHEDULE"]
+
+
+def synthetic_claim_pdf(pages: int, seed: int) -> bytes:
+    """A claim-like PDF with a text layer: numbered headings and filler paragraphs."""
+    rng = random.Random(seed)
+    pdf = FPDF()
+    pdf.set_font("Arial", size=10)
+    for page in range(pages):
+        pdf.add_page()
+        for number, heading in enumerate(rng.sample(_HEADINGS, 3), start=1):
+            pdf.set_font("Arial", "B", 12)
+            pdf.cell(0, 8, f"{page * 3 + number}. {heading}", ln=1)
+            pdf.set_font("Arial", size=10)
+            words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(60, 140)))
+            pdf.multi_cell(0, 5, f"Claim {seed:06d}: {words}.")
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def synthetic_clip(seconds: float, seed: int, sample_rate: int = 44100, channels: int = 2) -> bytes:
+    """A stereo WAV with silence either side of a speech-like burst, as a recorder would produce."""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    lead, tail = int(0.8 * sample_rate), int(0.6 * sample_rate)
+    t = np.arange(max(total - lead - tail, 0)) / sample_rate
+    # Voiced harmonics under a syllable-rate envelope, plus a little noise
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+    voice = sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((140, 280, 420, 700), start=1))
+    speech = 6000 * envelope * voice + rng.normal(0, 300, len(t))
+    signal = np.concatenate([rng.normal(0, 30, lead), speech, rng.normal(0, 30, tail)])
+    samples = np.repeat(signal.clip(-32768, 32767).astype("<i2")[:, None], channels, axis=1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def synthetic_context(kilobytes: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    words = []
+    while sum(len(word) + 1 for word in words) < kilobytes * 1024:
+        words.append(rng.choice(_WORDS))
+    return " ".join(words).encode("utf-8")
+
+
+class RecordingBackend(backends.Backend):
+    """Delegates to another backend and records the size of every prompt it is sent."""
+
+    name = "bench"
+
+    def __init__(self, inner: backends.Backend):
+        self.inner = inner
+        self.prompt_tokens: List[int] = []
+        self._lock = threading.Lock()
+
+    def _record(self, text: str) -> None:
+        tokens = count_tokens(text)
+        with self._lock:
+            self.prompt_tokens.append(tokens)
+
+    def drain(self) -> List[int]:
+        with self._lock:
+            recorded, self.prompt_tokens = self.prompt_tokens, []
+        return recorded
+
+    def generate(self, prompt, model, file_path=None, mime_type=None):
+        self._record(prompt)
+        return self.inner.generate(prompt, model, file_path, mime_type)
+
+    def generate_stream(self, prompt, model, file_path=None, mime_type=None):
+        self._record(prompt)
+        return self.inner.generate_stream(prompt, model, file_path, mime_type)
+
+    async def chat(self, messages, model):
+        self._record("\n".join(message["content"] for message in messages))
+        return await self.inner.chat(messages, model)
+
+    def chat_stream(self, messages, model):
+        self._record("\n".join(message["content"] for message in messages))
+        return self.inner.chat_stream(messages, model)
+
+    async def transcribe(self, filename, audio, content_type, model):
+        return await self.inner.transcribe(filename, audio, content_type, model)
+
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def _latency_summary(latencies: List[float], errors: int, wall: float) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "mean_seconds": round(sum(ordered) / len(ordered), 4) if ordered else 0.0,
+        "p50_seconds": round(_percentile(ordered, 0.50), 4),
+        "p95_seconds": round(_percentile(ordered, 0.95), 4),
+        "p99_seconds": round(_percentile(ordered, 0.99), 4),
+    }
+
+
+def _size_summary(values: List[int]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 1) if ordered else 0.0,
+        "p95": _percentile(ordered, 0.95),
+        "max": ordered[-1] if ordered else 0,
+    }
+
+
+def _run_scenario(
+    steps: Sequence[str],
+    turn: Callable[[httpx.Client, int], Dict[str, Tuple[float, bool]]],
+    make_client: Callable[[int], httpx.Client],
+    requests: int,
+    concurrency: int,
+    trace_memory: bool,
+) -> Dict:
+    """Run ``requests`` turns on ``concurrency`` threads; each turn times its steps."""
+    latencies: Dict[str, List[float]] = {step: [] for step in steps}
+    errors = {step: 0 for step in steps}
+    lock = threading.Lock()
+    local = threading.local()
+    clients: List[httpx.Client] = []
+
+    def one(i: int) -> None:
+        if not hasattr(local, "client"):
+            with lock:
+                local.client = make_client(len(clients))
+                clients.append(local.client)
+        for step, (seconds, ok) in turn(local.client, i).items():
+            with lock:
+                latencies[step].append(seconds)
+                errors[step] += not ok
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    for client in clients:
+        client.close()
+    result = {step: _latency_summary(latencies[step], errors[step], wall) for step in steps}
+    result["wall_seconds"] = round(wall, 3)
+    if trace_memory:
+        result["memory_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    else:
+        # ru_maxrss is KiB on Linux (bytes on macOS); peak over the whole process so far
+        scale = 1 if sys.platform == "darwin" else 1024
+        result["rss_peak_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20, 2)
+    return result
+
+
+def _timed(send: Callable[[], httpx.Response]) -> Tuple[float, bool]:
+    started = time.perf_counter()
+    response = send()
+    return time.perf_counter() - started, response.status_code == 200
+
+
+def bench_documents(args, recorder: RecordingBackend) -> Dict:
+    import app as document_app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no per-request access log
+    port = _free_port()
+    server = make_server("127.0.0.1", port, document_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+
+    pdfs = [synthetic_claim_pdf(args.pages[i % len(args.pages)], seed=i) for i in range(args.requests)]
+
+    def turn(http: httpx.Client, i: int):
+        upload = _timed(lambda: http.post("/", files={"file": (f"claim{i}.pdf", pdfs[i], "application/pdf")}))
+        download = _timed(lambda: http.get("/download_pdf"))
+        return {"upload_file": upload, "download_pdf": download}
+
+    try:
+        result = _run_scenario(
+            ("upload_file", "download_pdf"), turn,
+            lambda worker: httpx.Client(base_url=base_url, timeout=300),
+            args.requests, args.concurrency, args.trace_memory,
+        )
+    finally:
+        server.shutdown()
+    result["pdf_bytes"] = _size_summary([len(pdf) for pdf in pdfs])
+    result["prompt_tokens"] = _size_summary(recorder.drain())
+    return result
+
+
+def bench_voice(args, recorder: RecordingBackend) -> Dict:
+    import voice_assistant
+
+    base_url = serve(voice_assistant.app)
+    clips = [synthetic_clip(args.clip_seconds[i % len(args.clip_seconds)], seed=i) for i in range(args.requests)]
+    contexts = [synthetic_context(args.context_kb[i % len(args.context_kb)], seed=i) for i in range(args.requests)]
+
+    def make_client(worker: int) -> httpx.Client:
+        # One conversation per worker, so history and context build up over turns
+        return httpx.Client(base_url=base_url, timeout=300, headers={"X-Session-ID": f"bench-session-{worker:04d}"})
+
+    def turn(http: httpx.Client, i: int):
+        context = _timed(lambda: http.post("/upload_context", files={"file": (f"context{i}.txt", contexts[i])}))
+        audio = _timed(lambda: http.post("/process_audio", files={"file": (f"turn{i}.wav", clips[i], "audio/wav")}))
+        return {"upload_context": context, "process_audio": audio}
+
+    result = _run_scenario(
+        ("upload_context", "process_audio"), turn, make_client,
+        args.requests, args.concurrency, args.trace_memory,
+    )
+    result["clip_bytes"] = _size_summary([len(clip) for clip in clips])
+    result["prompt_tokens"] = _size_summary(recorder.drain())
+    return result
+
+
+def compare(current: Dict, previous: Dict) -> List[str]:
+    """Relative change of throughput and tail latency per endpoint."""
+    lines = []
+    for scenario, endpoints in current.get("scenarios", {}).items():
+        for endpoint, stats in endpoints.items():
+            before = previous.get("scenarios", {}).get(scenario, {}).get(endpoint)
+            if not isinstance(stats, dict) or not isinstance(before, dict) or "p95_seconds" not in stats:
+                continue
+            changes = []
+            for key in ("throughput_rps", "p50_seconds", "p95_seconds", "p99_seconds"):
+                if before.get(key):
+                    changes.append(f"{key} {100 * (stats[key] - before[key]) / before[key]:+.1f}%")
+            lines.append(f"{scenario}/{endpoint}: " + ", ".join(changes))
+    return lines
+
+
+def _sizes(text: str, kind=int) -> List:
+    return [kind(value) for value in text.split(",") if value.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default="documents,voice", help="comma-separated: documents, voice")
+    parser.add_argument("--requests", type=int, default=40, help="turns per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model delay per call in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="fake delay between streamed chunks")
+    parser.add_argument("--pages", default="1,5,20", help="PDF sizes in pages, cycled over requests")
+    parser.add_argument("--clip-seconds", default="2,6,15", help="audio clip lengths, cycled over requests")
+    parser.add_argument("--context-kb", default="2,20", help="context upload sizes, cycled over requests")
+    parser.add_argument("--trace-memory", action="store_true", help="track Python allocations with tracemalloc")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier --output file to compare against")
+    args = parser.parse_args(argv)
+    args.pages = _sizes(args.pages)
+    args.clip_seconds = _sizes(args.clip_seconds, float)
+    args.context_kb = _sizes(args.context_kb)
+
+    recorder = RecordingBackend(backends.LocalBackend(args.latency, args.token_latency))
+    backends.register_backend("bench", lambda: recorder)
+    scratch = tempfile.mkdtemp(prefix="bench-services-")
+    # Read by the services at import; keep caches and uploads out of the checkout
+    os.environ.update({
+        "DOCUMENT_MODELS": "bench:document",
+        "VOICE_TRANSCRIBE_MODELS": "bench:transcribe",
+        "VOICE_CHAT_MODELS": "bench:chat",
+        "UPLOAD_FOLDER": os.path.join(scratch, "uploads"),
+        "EXTRACTION_CACHE_PATH": os.path.join(scratch, "extractions.sqlite3"),
+        "RESULT_STORE": "memory",
+    })
+
+    results = {
+        "config": {
+            key: getattr(args, key)
+            for key in ("requests", "concurrency", "latency", "token_latency", "pages", "clip_seconds", "context_kb")
+        },
+        "scenarios": {},
+    }
+    runners = {"documents": bench_documents, "voice": bench_voice}
+    for name in _sizes(args.scenarios, str):
+        results["scenarios"][name.strip()] = runners[name.strip()](args, recorder)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            previous = json.load(handle)
+        for line in compare(results, previous):
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
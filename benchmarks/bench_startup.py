@@ -0,0 +1,208 @@
+"""Startup cost of the document and voice services.
+
+Each run starts a fresh interpreter under ``python -X importtime``. The
+interpreter imports the service module, serves it on a real socket
+(werkzeug for Flask, uvicorn for FastAPI) and polls ``GET /healthz`` until
+it answers. It then records which provider SDKs, PDF libraries, NumPy and
+tiktoken had been imported by that point. None should be, since they are
+loaded on first use.
+
+For each service the report gives the median import time, the median time
+until the first successful health check, and the direct imports of the
+service module that cost the most, from ``-X importtime``. With
+``--strict`` the script exits non-zero if any SDK was loaded before the
+health check answered, so it can guard startup in CI. ``--output`` saves
+the results as JSON. ``--compare`` prints the change against an earlier run.
+
+    python benchmarks/bench_startup.py --runs 5 --output startup.json
+    python benchmarks/bench_startup.py --compare startup.json
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SERVICES = {"documents": "app", "voice": "voice_assistant"}
+# Modules that must not be needed to answer a health check
+DEFERRED_MODULES = ("google.generativeai", "openai", "fpdf", "pypdf", "numpy", "tiktoken")
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _wait_healthy(port: int, timeout: float = 30.0) -> None:
+    import http.client
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/healthz")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"/healthz did not answer within {timeout:.0f}s")
+        time.sleep(0.005)
+
+
+def probe(service: str) -> None:
+    """Child process: import, serve, wait for /healthz and print the timings as JSON."""
+    import threading
+
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    module = __import__(SERVICES[service])
+    imported = time.perf_counter()
+
+    port = _free_port()
+    if service == "documents":
+        import logging
+
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", port, module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stop = server.shutdown
+    else:
+        import uvicorn
+
+        server = uvicorn.Server(uvicorn.Config(module.app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+
+        def stop():
+            server.should_exit = True
+            thread.join(timeout=5)
+
+    _wait_healthy(port)
+    ready = time.perf_counter()
+    loaded = [name for name in DEFERRED_MODULES if name in sys.modules]
+    stop()
+    print(json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "ready_ms": (ready - started) * 1000,
+        "deferred_loaded": loaded,
+    }))
+
+
+def direct_imports(stderr: str, module: str) -> Dict[str, float]:
+    """Cumulative milliseconds of each module imported directly by ``module``."""
+    rows: List[Tuple[int, str, int]] = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            rows.append((int(match.group(2)), match.group(4), len(match.group(3))))
+    for index in range(len(rows) - 1, -1, -1):
+        if rows[index][1] == module:
+            break
+    else:
+        return {}
+    # Children are printed before their parent, indented one level deeper
+    depth = rows[index][2]
+    children: Dict[str, float] = {}
+    for cumulative, name, indent in reversed(rows[:index]):
+        if indent <= depth:
+            break
+        if indent == depth + 2:
+            children[name] = cumulative / 1000
+    return children
+
+
+def run_service(service: str, runs: int, top: int) -> Dict:
+    imports, readies, wall = [], [], []
+    loaded = set()
+    children: Dict[str, List[float]] = {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--probe", service],
+            capture_output=True, text=True, timeout=120,
+        )
+        wall.append((time.perf_counter() - started) * 1000)
+        if result.returncode != 0:
+            raise RuntimeError(f"{service} probe failed:\n{result.stderr[-2000:]}")
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        imports.append(report["import_ms"])
+        readies.append(report["ready_ms"])
+        loaded.update(report["deferred_loaded"])
+        for name, ms in direct_imports(result.stderr, SERVICES[service]).items():
+            children.setdefault(name, []).append(ms)
+    heaviest = sorted(((statistics.median(ms), name) for name, ms in children.items()), reverse=True)[:top]
+    return {
+        "runs": runs,
+        "import_ms": statistics.median(imports),
+        "ready_ms": statistics.median(readies),
+        "process_ms": statistics.median(wall),
+        "deferred_loaded": sorted(loaded),
+        "top_imports": {name: ms for ms, name in heaviest},
+    }
+
+
+def print_report(results: Dict[str, Dict]) -> None:
+    for service, result in results.items():
+        loaded = ", ".join(result["deferred_loaded"]) or "none"
+        print(f"{service} ({SERVICES[service]}.py, median of {result['runs']} runs)")
+        print(f"  import {result['import_ms']:8.1f} ms")
+        print(f"  /healthz ready {result['ready_ms']:8.1f} ms after import started")
+        print(f"  process {result['process_ms']:8.1f} ms (spawn to exit)")
+        print(f"  SDKs loaded before /healthz: {loaded}")
+        for name, ms in result["top_imports"].items():
+            print(f"    {ms:8.1f} ms  {name}")
+
+
+def print_comparison(results: Dict[str, Dict], baseline: Dict[str, Dict]) -> None:
+    for service, result in results.items():
+        before = baseline.get(service)
+        if before is None:
+            continue
+        for key in ("import_ms", "ready_ms"):
+            change = (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            print(f"{service} {key}: {before[key]:.1f} -> {result[key]:.1f} ms ({change:+.1f}%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--probe", choices=sorted(SERVICES), help=argparse.SUPPRESS)
+    parser.add_argument("--service", choices=sorted(SERVICES), action="append", help="default: both")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="direct imports to list per service")
+    parser.add_argument("--strict", action="store_true", help="fail if an SDK loads before /healthz answers")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier --output run")
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.probe)
+        return
+
+    results = {service: run_service(service, args.runs, args.top) for service in args.service or sorted(SERVICES)}
+    print_report(results)
+    if args.compare:
+        with open(args.compare) as handle:
+            print_comparison(results, json.load(handle))
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+    if args.strict and any(result["deferred_loaded"] for result in results.values()):
+        sys.exit("SDKs were loaded before the first health check")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Load-test /process_audio against a local stub of the OpenAI API.
+
+A stub server answers the transcription and chat endpoints (plain or
+streamed) after a fixed delay. It is started alongside two copies of the voice service: the
+original handler, which used the synchronous client and blocked the event
+loop, and the current ``voice_assistant`` app. Both are served by uvicorn
+on real sockets and hit with the same number of concurrent voice turns.
+
+    python benchmarks/bench_voice_load.py --requests 64 --concurrency 32 --latency 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from fastapi import FastAPI, Request, UploadFile  # noqa: E402
+from fastapi.responses import PlainTextResponse, StreamingResponse  # noqa: E402
+
+_ANSWER = "The deductible is $500."
+
+
+def stub_openai(latency: float) -> FastAPI:
+    """Minimal OpenAI-compatible API that answers after ``latency`` seconds."""
+    stub = FastAPI()
+
+    @stub.post("/v1/audio/transcriptions")
+    async def transcriptions(request: Request):
+        await request.body()
+        await asyncio.sleep(latency)
+        return PlainTextResponse("What is the deductible on this policy?")
+
+    @stub.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        if body.get("stream"):
+            return StreamingResponse(_stream_chunks(body.get("model", "stub")), media_type="text/event-stream")
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": _ANSWER},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    return stub
+
+
+async def _stream_chunks(model: str):
+    for word in _ANSWER.split(" "):
+        chunk = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(0.01)
+    yield "data: [DONE]\n\n"
+
+
+def legacy_app(base_url: str) -> FastAPI:
+    """The original handler: synchronous client calls inside an async endpoint."""
+    from openai import OpenAI
+
+    client = OpenAI(api_key="stub", base_url=base_url, http_client=httpx.Client())
+    legacy = FastAPI()
+
+    @legacy.post("/process_audio")
+    async def process_audio(file: UploadFile):
+        transcript = client.audio.transcriptions.create(
+            model="whisper-1", file=("audio.webm", await file.read()), response_format="text"
+        )
+        chat_response = client.chat.completions.create(
+            model="gpt-4o-mini", messages=[{"role": "user", "content": transcript}]
+        )
+        return {"answer": chat_response.choices[0].message.content}
+
+    return legacy
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(asgi_app) -> str:
+    """Run ``asgi_app`` with uvicorn in a daemon thread and return its base URL."""
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+async def _load(url: str, requests: int, concurrency: int, audio: bytes) -> dict:
+    latencies = []
+    errors = 0
+    slots = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=300) as http:
+        async def one(i: int):
+            nonlocal errors
+            # Distinct bytes per turn so the transcript cache does not short-circuit the calls
+            clip = audio + i.to_bytes(4, "little")
+            async with slots:
+                start = time.perf_counter()
+                response = await http.post("/process_audio", files={"file": ("turn.webm", clip, "audio/webm")})
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2),
+        "p50_seconds": round(statistics.median(latencies), 3),
+        "p95_seconds": round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.25, help="stub delay per OpenAI call in seconds")
+    parser.add_argument("--audio-bytes", type=int, default=32 * 1024)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    base_url = serve(stub_openai(args.latency)) + "/v1"
+    # voice_assistant reads these when its client is created at import
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    import voice_assistant
+
+    audio = os.urandom(args.audio_bytes)
+    results = {"stub_latency_seconds": args.latency, "concurrency": args.concurrency}
+    for name, asgi_app in (("legacy_sync", legacy_app(base_url)), ("async", voice_assistant.app)):
+        url = serve(asgi_app)
+        results[name] = asyncio.run(_load(url, args.requests, args.concurrency, audio))
+    results["speedup"] = round(results["async"]["throughput_rps"] / results["legacy_sync"]["throughput_rps"], 2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:>20}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
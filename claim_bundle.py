@@ -0,0 +1,394 @@
+"""Multimodal claim bundles: documents, damage photos and recorded statements.
+
+A bundle is every file submitted for one claim. Each file is classified by
+name or content type:
+
+- documents (PDF) are read for claim fields;
+- photos are shrunk and deduplicated locally, then assessed for damage;
+- statements (audio) are transcribed, and the transcript is read for
+  claim fields too.
+
+:func:`process_bundle` starts every document and statement on a thread
+pool at once. While they run, photos are prepared on the calling thread,
+and only the unique ones are then assessed on the same pool. A bundle
+therefore takes about as long as its slowest item, not the sum of all of
+them. The results are merged into one :class:`ClaimBundle`. Its claim
+record takes each field from the first document that states it, then from
+the statements. Disagreements between sources are listed in ``conflicts``.
+
+The model calls are passed in by the caller (see ``app.py``), so this
+module needs no model SDK. Photo resizing and near-duplicate detection use
+Pillow, which is in ``requirements.txt``. If it is missing, a warning is
+logged with the first photo, photos are sent as uploaded and only exact
+duplicates are dropped.
+"""
+
+import contextvars
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from claims import CLAIM_FIELDS, ClaimRecord
+from model_output import load_json
+
+DOCUMENT = "document"
+PHOTO = "photo"
+STATEMENT = "statement"
+
+_SUFFIXES = {
+    DOCUMENT: (".pdf",),
+    PHOTO: (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff", ".heic", ".heif"),
+    STATEMENT: (".wav", ".mp3", ".m4a", ".mp4", ".ogg", ".oga", ".opus", ".webm", ".flac", ".aac"),
+}
+_CONTENT_TYPES = {"application/pdf": DOCUMENT, "image/": PHOTO, "audio/": STATEMENT}
+
+_SEVERITY = ("none", "minor", "moderate", "severe")
+
+logger = logging.getLogger(__name__)
+
+DAMAGE_PROMPT = f"""
+This photo was submitted with an insurance claim. Describe the visible damage.
+
+Reply with ONE minified JSON object in exactly this shape and nothing else:
+{{"damaged_parts":[str],"severity":"{'|'.join(_SEVERITY)}","description":str}}
+
+Keep description under 25 words. Use [] and "none" if no damage is visible.
+"""
+
+
+def classify(filename: str, content_type: str = "") -> Optional[str]:
+    """``DOCUMENT``, ``PHOTO`` or ``STATEMENT`` for a file, or ``None`` if unsupported."""
+    name = (filename or "").lower()
+    for kind, suffixes in _SUFFIXES.items():
+        if name.endswith(suffixes):
+            return kind
+    content_type = (content_type or "").lower()
+    for prefix, kind in _CONTENT_TYPES.items():
+        if content_type.startswith(prefix):
+            return kind
+    return None
+
+
+@dataclass
+class BundleItem:
+    """One submitted file; ``source`` is whatever the handlers accept (an upload, a path)."""
+
+    name: str
+    kind: str
+    source: Any
+    content_type: str = ""
+
+
+@dataclass
+class ItemResult:
+    name: str
+    kind: str
+    status: str  # "ok", "error" or "duplicate"
+    seconds: float = 0.0
+    result: Any = None
+    error: Optional[str] = None
+    duplicate_of: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"name": self.name, "status": self.status, "seconds": round(self.seconds, 4)}
+        if self.error is not None:
+            data["error"] = self.error
+        if self.duplicate_of is not None:
+            data["duplicate_of"] = self.duplicate_of
+        if isinstance(self.result, ClaimRecord):
+            data["claim"] = self.result.to_dict()
+        elif isinstance(self.result, StatementResult):
+            data["transcript"] = self.result.transcript
+            data["claim"] = self.result.claim.to_dict()
+        elif self.result is not None:
+            data["result"] = self.result
+        return data
+
+
+@dataclass
+class StatementResult:
+    transcript: str
+    claim: ClaimRecord
+
+
+# Photos
+
+
+@lru_cache(maxsize=None)
+def _pil():
+    # Imported with the first photo rather than at startup
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:  # pragma: no cover - optional dependency
+        logger.warning(
+            "Pillow is not installed: claim photos are sent full size and only exact duplicates are dropped"
+        )
+        return None
+    return Image, ImageOps
+
+
+@dataclass
+class PreparedPhoto:
+    name: str
+    data: bytes
+    content_type: str
+    original_bytes: int
+    digest: str  # SHA-256 of ``data``
+    fingerprint: Optional[int] = None  # 64-bit difference hash; None without Pillow
+    size: Tuple[int, int] = (0, 0)
+
+    @property
+    def suffix(self) -> str:
+        return mimetypes.guess_extension(self.content_type) or os.path.splitext(self.name)[1] or ".bin"
+
+
+def _fingerprint(image) -> int:
+    # dHash: compare neighbouring pixels of a 9x8 greyscale thumbnail, so
+    # re-encoded, resized or slightly recropped copies hash alike
+    Image, _ = _pil()
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+def prepare_photo(name: str, data: bytes, content_type: str = "", max_side: int = 1600, quality: int = 85) -> PreparedPhoto:
+    """Orient, downscale to ``max_side`` pixels and re-encode as JPEG if that makes the photo smaller."""
+    content_type = content_type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+    original = PreparedPhoto(name, data, content_type, len(data), hashlib.sha256(data).hexdigest())
+    pil = _pil()
+    if pil is None:
+        return original
+    Image, ImageOps = pil
+    try:
+        with Image.open(io.BytesIO(data)) as opened:
+            image = ImageOps.exif_transpose(opened)
+            image = image.convert("RGB")
+    except Exception:
+        return original  # Not decodable here (e.g. HEIC without a plugin); send as is
+    image.thumbnail((max_side, max_side))
+    original.fingerprint = _fingerprint(image)
+    original.size = image.size
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    encoded = out.getvalue()
+    if len(encoded) >= len(data):
+        return original
+    return PreparedPhoto(
+        name, encoded, "image/jpeg", len(data), hashlib.sha256(encoded).hexdigest(), original.fingerprint, image.size
+    )
+
+
+def find_duplicates(photos: Sequence[PreparedPhoto], max_distance: int = 4) -> Dict[int, int]:
+    """Map the index of each duplicate photo to the index of the first photo it repeats.
+
+    Identical images always match. With fingerprints, images whose hashes
+    differ in at most ``max_distance`` of 64 bits also match.
+    """
+    duplicates: Dict[int, int] = {}
+    kept: List[int] = []
+    for index, photo in enumerate(photos):
+        for first in kept:
+            other = photos[first]
+            if photo.digest == other.digest or (
+                photo.fingerprint is not None and other.fingerprint is not None
+                and bin(photo.fingerprint ^ other.fingerprint).count("1") <= max_distance
+            ):
+                duplicates[index] = first
+                break
+        else:
+            kept.append(index)
+    return duplicates
+
+
+def parse_damage(text: str) -> Dict[str, Any]:
+    """The model's answer to :data:`DAMAGE_PROMPT`, normalised."""
+    data = load_json(text)
+    if not isinstance(data, dict):
+        data = {}
+    parts = data.get("damaged_parts")
+    severity = str(data.get("severity") or "").lower()
+    return {
+        "damaged_parts": [str(part) for part in parts] if isinstance(parts, list) else [],
+        "severity": severity if severity in _SEVERITY else None,
+        "description": data.get("description") if isinstance(data.get("description"), str) else None,
+    }
+
+
+# Merging
+
+
+def merge_claims(records: Sequence[ClaimRecord]) -> Tuple[ClaimRecord, List[str]]:
+    """One record from several, in priority order; returns it and the conflicts found.
+
+    Each field comes from the first record that has it. A later record with
+    a different value is reported as a conflict. Line items are
+    concatenated, with exact repeats dropped, and errors are kept with
+    their source.
+    """
+    merged = ClaimRecord.empty()
+    merged.source = ", ".join(record.source for record in records if record.source)
+    origin: Dict[str, str] = {}
+    conflicts: List[str] = []
+    seen_items = set()
+    for record in records:
+        for name, _, _ in CLAIM_FIELDS:
+            value = getattr(record, name)
+            if value is None:
+                continue
+            current = getattr(merged, name)
+            if current is None:
+                setattr(merged, name, value)
+                origin[name] = record.source
+            elif value != current:
+                conflicts.append(f"{name}: {current} ({origin[name]}) vs {value} ({record.source})")
+        for item in record.line_items:
+            key = tuple(item.to_dict().values())
+            if key not in seen_items:
+                seen_items.add(key)
+                merged.line_items.append(item)
+        merged.errors.extend(f"{record.source}: {error}" for error in record.errors)
+    return merged, conflicts
+
+
+def damage_summary(assessments: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    parts: List[str] = []
+    for assessment in assessments:
+        for part in assessment.get("damaged_parts") or []:
+            if part.lower() not in (seen.lower() for seen in parts):
+                parts.append(part)
+    ranks = [_SEVERITY.index(a["severity"]) for a in assessments if a.get("severity") in _SEVERITY]
+    return {"damaged_parts": parts, "severity": _SEVERITY[max(ranks)] if ranks else None}
+
+
+@dataclass
+class ClaimBundle:
+    claim: ClaimRecord
+    documents: List[ItemResult] = field(default_factory=list)
+    statements: List[ItemResult] = field(default_factory=list)
+    photos: List[ItemResult] = field(default_factory=list)
+    rejected: List[ItemResult] = field(default_factory=list)
+    conflicts: List[str] = field(default_factory=list)
+    damage: Dict[str, Any] = field(default_factory=dict)
+    seconds: float = 0.0
+
+    @property
+    def items(self) -> List[ItemResult]:
+        return self.documents + self.statements + self.photos + self.rejected
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "claim": self.claim.to_dict(),
+            "damage": self.damage,
+            "conflicts": self.conflicts,
+            "documents": [item.to_dict() for item in self.documents],
+            "statements": [item.to_dict() for item in self.statements],
+            "photos": [item.to_dict() for item in self.photos],
+            "rejected": [item.to_dict() for item in self.rejected],
+            # Wall time against the sum of per-item times shows the overlap
+            "seconds": round(self.seconds, 4),
+            "item_seconds": round(sum(item.seconds for item in self.items), 4),
+        }
+
+
+# Pipeline
+
+
+def _run(item: BundleItem, func: Callable[[Any], Any], arg: Any) -> ItemResult:
+    started = time.perf_counter()
+    try:
+        result = ItemResult(item.name, item.kind, "ok", result=func(arg))
+    except Exception as e:
+        result = ItemResult(item.name, item.kind, "error", error=str(e))
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def process_bundle(
+    items: Sequence[BundleItem],
+    extract_document: Callable[[BundleItem], ClaimRecord],
+    transcribe_statement: Callable[[BundleItem], StatementResult],
+    assess_photo: Callable[[PreparedPhoto], Dict[str, Any]],
+    read_photo: Callable[[BundleItem], bytes],
+    max_workers: int = 8,
+    photo_max_side: int = 1600,
+    duplicate_distance: int = 4,
+) -> ClaimBundle:
+    """Process every item of a bundle concurrently and merge the results.
+
+    Items whose ``kind`` is ``None`` are reported under ``rejected``. Work
+    runs in a copy of the caller's context, so a request deadline set with
+    ``resilience.deadline_scope`` covers every item.
+    """
+    started = time.perf_counter()
+    bundle = ClaimBundle(ClaimRecord.empty())
+    handlers = {DOCUMENT: extract_document, STATEMENT: transcribe_statement}
+    photos = [item for item in items if item.kind == PHOTO]
+    for item in items:
+        if item.kind not in handlers and item.kind != PHOTO:
+            bundle.rejected.append(ItemResult(item.name, "", "error", error="unsupported file type"))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+
+        def submit(item: BundleItem, func: Callable[[Any], Any], arg: Any) -> "Future[ItemResult]":
+            return pool.submit(contextvars.copy_context().run, _run, item, func, arg)
+
+        remote = [(item, submit(item, handlers[item.kind], item)) for item in items if item.kind in handlers]
+
+        # Local photo work overlaps the remote calls already in flight
+        prepared: List[Optional[PreparedPhoto]] = []
+        prepare_seconds: List[float] = []
+        for item in photos:
+            photo_started = time.perf_counter()
+            try:
+                prepared.append(prepare_photo(item.name, read_photo(item), item.content_type, photo_max_side))
+            except Exception as e:
+                prepared.append(None)
+                bundle.photos.append(ItemResult(item.name, PHOTO, "error", error=str(e)))
+            prepare_seconds.append(time.perf_counter() - photo_started)
+        readable = [(item, photo, seconds) for item, photo, seconds in zip(photos, prepared, prepare_seconds) if photo]
+        duplicates = find_duplicates([photo for _, photo, _ in readable], duplicate_distance)
+        assessed = []
+        for index, (item, photo, seconds) in enumerate(readable):
+            if index in duplicates:
+                first = readable[duplicates[index]][0].name
+                bundle.photos.append(ItemResult(item.name, PHOTO, "duplicate", seconds, duplicate_of=first))
+            else:
+                assessed.append((item, photo, seconds, submit(item, assess_photo, photo)))
+
+        for item, future in remote:
+            result = future.result()
+            (bundle.documents if item.kind == DOCUMENT else bundle.statements).append(result)
+        for item, photo, seconds, future in assessed:
+            result = future.result()
+            result.seconds += seconds
+            if result.status == "ok":
+                result.result = {
+                    **result.result,
+                    "bytes": len(photo.data),
+                    "original_bytes": photo.original_bytes,
+                    "size": list(photo.size) if photo.fingerprint is not None else None,
+                }
+            bundle.photos.append(result)
+
+    order = {item.name: index for index, item in enumerate(items)}
+    bundle.photos.sort(key=lambda result: order.get(result.name, 0))
+
+    # Documents outrank what was said in a statement
+    records = [result.result for result in bundle.documents if result.status == "ok"]
+    records += [result.result.claim for result in bundle.statements if result.status == "ok"]
+    bundle.claim, bundle.conflicts = merge_claims(records)
+    bundle.damage = damage_summary([
+        result.result for result in bundle.photos if result.status == "ok" and isinstance(result.result, dict)
+    ])
+    bundle.seconds = time.perf_counter() - started
+    return bundle
@@ -0,0 +1,364 @@
+"""Claim field extraction: a compact declared schema and typed records.
+
+The section extraction in ``app.py`` asks the model to repeat every
+section of a document verbatim. Claims handling only needs a handful of
+fields. This module declares those fields once in :data:`CLAIM_FIELDS` and
+:data:`LINE_ITEM_FIELDS`. :data:`CLAIM_PROMPT` is generated from them and
+asks for one minified JSON object, with line items as positional rows
+instead of repeated keys, so the model's answer stays a few hundred
+tokens long.
+
+:func:`parse_claim` turns that answer into a :class:`ClaimRecord`. Money
+becomes ``float``, dates become :class:`datetime.date`, and anything that
+does not fit its declared type becomes ``None`` and is noted in
+``errors``. Records use ``__slots__``, so a batch run can hold many of
+them cheaply before export.
+
+Many records can be exported together as JSON lines, CSV (one table of
+claims and one of line items) or Parquet (line items nested per claim).
+Parquet needs ``pyarrow``, which is optional.
+"""
+
+import csv
+import json
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+from model_output import load_json
+
+# (name, type, hint); types are "text", "date", "money" or "number"
+CLAIM_FIELDS: Tuple[Tuple[str, str, str], ...] = (
+    ("policy_number", "text", ""),
+    ("claim_number", "text", ""),
+    ("claimant", "text", "person or company making the claim"),
+    ("insured", "text", "policy holder"),
+    ("date_of_loss", "date", ""),
+    ("date_reported", "date", ""),
+    ("loss_type", "text", "e.g. collision, theft, water damage, injury"),
+    ("loss_location", "text", ""),
+    ("loss_description", "text", "at most 30 words"),
+    ("currency", "text", "ISO 4217 code"),
+    ("total_claimed", "money", ""),
+    ("deductible", "money", ""),
+)
+LINE_ITEM_FIELDS: Tuple[Tuple[str, str, str], ...] = (
+    ("description", "text", ""),
+    ("quantity", "number", ""),
+    ("unit_price", "money", ""),
+    ("amount", "money", ""),
+)
+
+_TYPE_NAMES = {"text": "str", "date": "YYYY-MM-DD", "money": "number", "number": "number"}
+
+
+def _schema() -> str:
+    columns = ",".join(f"{name}:{_TYPE_NAMES[kind]}" for name, kind, _ in LINE_ITEM_FIELDS)
+    keys = [f'"{name}":{_TYPE_NAMES[kind]}' for name, kind, _ in CLAIM_FIELDS]
+    keys.append(f'"line_items":[[{columns}]]')
+    return "{" + ",".join(keys) + "}"
+
+
+def _hints() -> str:
+    return "\n".join(f"- {name}: {hint}" for name, _, hint in CLAIM_FIELDS if hint)
+
+
+CLAIM_PROMPT = f"""
+Extract the claim fields below from the insurance claim document.
+
+Reply with ONE minified JSON object in exactly this shape and nothing else:
+{_schema()}
+
+Field notes:
+{_hints()}
+- line_items: one array per billed item, values in the order shown; [] if none
+
+Use null for anything the document does not state; do not guess. Write
+dates as YYYY-MM-DD and money as plain numbers without currency symbols or
+thousands separators. Do not copy any other document text.
+"""
+
+
+@dataclass
+class LineItem:
+    __slots__ = ("description", "quantity", "unit_price", "amount")
+
+    description: Optional[str]
+    quantity: Optional[float]
+    unit_price: Optional[float]
+    amount: Optional[float]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+@dataclass
+class ClaimRecord:
+    """Claim fields of one document; ``source`` names the document."""
+
+    __slots__ = tuple(name for name, _, _ in CLAIM_FIELDS) + ("source", "line_items", "errors")
+
+    policy_number: Optional[str]
+    claim_number: Optional[str]
+    claimant: Optional[str]
+    insured: Optional[str]
+    date_of_loss: Optional[date]
+    date_reported: Optional[date]
+    loss_type: Optional[str]
+    loss_location: Optional[str]
+    loss_description: Optional[str]
+    currency: Optional[str]
+    total_claimed: Optional[float]
+    deductible: Optional[float]
+    source: str
+    line_items: List[LineItem]
+    errors: List[str]
+
+    @classmethod
+    def empty(cls, source: str = "", errors: Optional[List[str]] = None) -> "ClaimRecord":
+        values = {name: None for name, _, _ in CLAIM_FIELDS}
+        return cls(source=source, line_items=[], errors=list(errors or []), **values)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-ready form; dates as ISO strings."""
+        data: Dict[str, Any] = {"source": self.source}
+        for name, kind, _ in CLAIM_FIELDS:
+            value = getattr(self, name)
+            data[name] = value.isoformat() if kind == "date" and value is not None else value
+        data["line_items"] = [item.to_dict() for item in self.line_items]
+        data["errors"] = list(self.errors)
+        return data
+
+
+_MONEY_NOISE = re.compile(r"[^\d.\-]")
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%d.%m.%Y", "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y")
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    text = " ".join(str(value).split())
+    return text or None
+
+
+def _money(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str) or not value.strip():
+        return None
+    text = value.strip()
+    negative = text.startswith("(") and text.endswith(")")
+    try:
+        amount = float(_MONEY_NOISE.sub("", text))
+    except ValueError:
+        raise ValueError(f"not an amount: {value!r}") from None
+    return -amount if negative else amount
+
+
+def _date(value: Any) -> Optional[date]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    text = str(value).strip()
+    for pattern in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, pattern).date()
+        except ValueError:
+            continue
+    raise ValueError(f"not a date: {value!r}")
+
+
+_COERCE = {"text": _text, "date": _date, "money": _money, "number": _money}
+
+
+def _coerce(kind: str, name: str, value: Any, errors: List[str]) -> Any:
+    try:
+        return _COERCE[kind](value)
+    except ValueError as e:
+        errors.append(f"{name}: {e}")
+        return None
+
+
+def _line_item(row: Any, index: int, errors: List[str]) -> Optional[LineItem]:
+    if isinstance(row, dict):
+        row = [row.get(name) for name, _, _ in LINE_ITEM_FIELDS]
+    if not isinstance(row, list):
+        errors.append(f"line_items[{index}]: not a row")
+        return None
+    row = (row + [None] * len(LINE_ITEM_FIELDS))[: len(LINE_ITEM_FIELDS)]
+    values = [
+        _coerce(kind, f"line_items[{index}].{name}", value, errors)
+        for (name, kind, _), value in zip(LINE_ITEM_FIELDS, row)
+    ]
+    return LineItem(*values)
+
+
+def parse_claim(text: str, source: str = "") -> ClaimRecord:
+    """Build a :class:`ClaimRecord` from the model's answer to :data:`CLAIM_PROMPT`."""
+    data = load_json(text)
+    if not isinstance(data, dict):
+        return ClaimRecord.empty(source, ["model output is not a JSON object"])
+    errors: List[str] = []
+    values = {name: _coerce(kind, name, data.get(name), errors) for name, kind, _ in CLAIM_FIELDS}
+    if isinstance(values["currency"], str):
+        values["currency"] = values["currency"].upper()
+    rows = data.get("line_items") or []
+    items = [_line_item(row, index, errors) for index, row in enumerate(rows if isinstance(rows, list) else [])]
+    return ClaimRecord(
+        source=source, line_items=[item for item in items if item is not None], errors=errors, **values
+    )
+
+
+def document_text(lines: Sequence[Any]) -> str:
+    """The text layer from ``pdf_text.extract_lines`` as prompt input, with page breaks marked."""
+    parts: List[str] = []
+    page = None
+    for line in lines:
+        if line.page != page:
+            page = line.page
+            parts.append(f"[page {page}]")
+        parts.append(line.text)
+    return "\n".join(parts)
+
+
+# Export
+
+CLAIM_COLUMNS = ("source",) + tuple(name for name, _, _ in CLAIM_FIELDS) + (
+    "line_item_count", "line_items_total", "errors",
+)
+LINE_ITEM_COLUMNS = ("source", "item") + tuple(name for name, _, _ in LINE_ITEM_FIELDS)
+
+
+def claim_rows(records: Iterable[ClaimRecord]) -> Iterator[Tuple[Any, ...]]:
+    """One flat row per claim, in :data:`CLAIM_COLUMNS` order."""
+    for record in records:
+        amounts = [item.amount for item in record.line_items if item.amount is not None]
+        yield (
+            (record.source,)
+            + tuple(getattr(record, name) for name, _, _ in CLAIM_FIELDS)
+            + (len(record.line_items), round(sum(amounts), 2) if amounts else None, "; ".join(record.errors))
+        )
+
+
+def line_item_rows(records: Iterable[ClaimRecord]) -> Iterator[Tuple[Any, ...]]:
+    """One row per line item, in :data:`LINE_ITEM_COLUMNS` order."""
+    for record in records:
+        for index, item in enumerate(record.line_items, start=1):
+            yield (record.source, index) + tuple(getattr(item, name) for name, _, _ in LINE_ITEM_FIELDS)
+
+
+def _cell(value: Any) -> Any:
+    if value is None:
+        return ""
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def write_csv(records: Iterable[ClaimRecord], out: TextIO, table: str = "claims") -> int:
+    """Write the ``claims`` or ``line_items`` table as CSV; returns the row count."""
+    columns, rows = (CLAIM_COLUMNS, claim_rows(records)) if table == "claims" else (
+        LINE_ITEM_COLUMNS, line_item_rows(records)
+    )
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow([_cell(value) for value in row])
+        count += 1
+    return count
+
+
+def write_jsonl(records: Iterable[ClaimRecord], out: TextIO) -> int:
+    count = 0
+    for record in records:
+        out.write(json.dumps(record.to_dict()) + "\n")
+        count += 1
+    return count
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:  # pragma: no cover - optional dependency
+        raise RuntimeError("pyarrow is required for Parquet export") from None
+    return pyarrow
+
+
+def parquet_available() -> bool:
+    try:
+        _pyarrow()
+    except RuntimeError:
+        return False
+    return True
+
+
+def write_parquet(records: Sequence[ClaimRecord], out) -> int:
+    """Write one Parquet table of claims with their line items nested; ``out`` is a path or binary file."""
+    pa = _pyarrow()
+    item_type = pa.struct([
+        (name, pa.string() if kind == "text" else pa.float64()) for name, kind, _ in LINE_ITEM_FIELDS
+    ])
+    types = {"text": pa.string(), "date": pa.date32(), "money": pa.float64(), "number": pa.float64()}
+    schema = pa.schema(
+        [("source", pa.string())]
+        + [(name, types[kind]) for name, kind, _ in CLAIM_FIELDS]
+        + [("line_items", pa.list_(item_type)), ("errors", pa.list_(pa.string()))]
+    )
+    columns: Dict[str, List[Any]] = {name: [] for name in schema.names}
+    for record in records:
+        columns["source"].append(record.source)
+        for name, _, _ in CLAIM_FIELDS:
+            columns[name].append(getattr(record, name))
+        columns["line_items"].append([item.to_dict() for item in record.line_items])
+        columns["errors"].append(list(record.errors))
+    pa.parquet.write_table(pa.table(columns, schema=schema), out)
+    return len(records)
+
+
+EXPORT_FORMATS = ("jsonl", "csv", "parquet")
+
+
+def export_format(path: str) -> str:
+    """Export format implied by a file name (``.jsonl``/``.ndjson``, ``.csv``, ``.parquet``)."""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in (".csv", ".parquet"):
+        return suffix[1:]
+    return "jsonl"
+
+
+def export_claims(records: Sequence[ClaimRecord], path: str) -> List[str]:
+    """Write ``records`` to ``path`` in the format its suffix names; returns the files written.
+
+    CSV export writes the claims table to ``path`` and the line items next
+    to it, as ``<name>.line_items.csv``.
+    """
+    kind = export_format(path)
+    if kind == "parquet":
+        write_parquet(records, path)
+        return [path]
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        if kind == "jsonl":
+            write_jsonl(records, out)
+            return [path]
+        write_csv(records, out, "claims")
+    items_path = f"{os.path.splitext(path)[0]}.line_items.csv"
+    with open(items_path, "w", encoding="utf-8", newline="") as out:
+        write_csv(records, out, "line_items")
+    return [path, items_path]
+
+
+def from_batch(batch_records: Iterable[Dict[str, Any]]) -> Iterator[ClaimRecord]:
+    """Claim records from ``batch.run_batch`` output; failed documents keep their error."""
+    for entry in batch_records:
+        record = entry.get("result")
+        if not isinstance(record, ClaimRecord):
+            record = ClaimRecord.empty(errors=[entry.get("error") or "extraction failed"])
+        record.source = entry["document"]
+        yield record
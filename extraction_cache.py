@@ -0,0 +1,149 @@
+"""Disk-backed cache of Gemini extraction results.
+
+Entries are keyed on the SHA-256 of the uploaded PDF bytes combined with a
+hash of the prompt and model name, so resubmitting an identical claim packet
+returns the stored JSON without another remote round trip. The store is a
+single SQLite file with size- and age-based eviction; hit/miss counters are
+kept per process so the cache can be sized from real traffic.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """Return the hex SHA-256 digest of a file, read in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """SQLite-backed LRU cache with a maximum entry count, byte size and age."""
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 1000,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age: float = 7 * 24 * 3600,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS extractions_accessed ON extractions (accessed)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(document_sha256: str, prompt: str, model_name: str) -> str:
+        """Combine the document digest with a digest of the prompt and model."""
+        request_digest = hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+        return f"{document_sha256}:{request_digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached extraction for ``key`` or ``None`` on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                if row is not None:
+                    self._conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE extractions SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Store an extraction and evict stale or least recently used entries."""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        cursor = self._conn.execute(
+            "DELETE FROM extractions WHERE created < ?", (now - self.max_age,)
+        )
+        self.evictions += max(cursor.rowcount, 0)
+
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # Walk from least recently used and drop until both limits are met
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM extractions ORDER BY accessed ASC"
+        ).fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached extraction."""
+        with self._lock:
+            self._conn.execute("DELETE FROM extractions")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current footprint of the store."""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+        }
@@ -0,0 +1,95 @@
+"""Concurrent page-range fan-out for long documents.
+
+Large PDFs are split into page ranges that are sent to the model in parallel
+through a bounded thread pool. Transient provider failures are retried by
+the backend's ``RemoteCaller``, so a range is not retried again here. The
+partial ``extracted_sections`` results are then merged back into a single
+document in page order with sections renumbered.
+"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Sequence, Tuple, TypeVar
+
+from resilience import CallRejected
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class ChunkError(Exception):
+    """Raised when a chunk fails; the provider call was already retried."""
+
+
+def map_chunks(chunks: Sequence[T], func: Callable[[T], R], max_workers: int = 4) -> List[R]:
+    """Apply ``func`` to every chunk concurrently and return results in input order."""
+    if len(chunks) == 1:
+        return [_run_chunk(func, chunks[0], 0)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        # Each chunk runs in a copy of the caller's context, so the request
+        # deadline follows it onto the pool thread
+        futures = [
+            pool.submit(contextvars.copy_context().run, _run_chunk, func, chunk, index)
+            for index, chunk in enumerate(chunks)
+        ]
+        return [future.result() for future in futures]
+
+
+def _run_chunk(func: Callable[[T], R], chunk: T, index: int) -> R:
+    # No retry loop here: on top of RemoteCaller's own retries it would
+    # multiply the calls made to a provider that is already failing
+    try:
+        return func(chunk)
+    except CallRejected:
+        raise  # Deadline passed or provider circuit open
+    except Exception as e:
+        raise ChunkError(f"chunk {index + 1} failed: {e}") from e
+
+
+def _section_order(key: str) -> Tuple[int, str]:
+    suffix = key.rsplit("_", 1)[-1]
+    return (int(suffix), key) if suffix.isdigit() else (1 << 30, key)
+
+
+def merge_extractions(partials: Sequence[Tuple[int, int, Any]]) -> Dict[str, Any]:
+    """Merge ``(first_page, last_page, extraction)`` partials into one document.
+
+    Partials are taken in the order given and their sections are renumbered
+    ``section_1..N``. A partial that is not a JSON object is kept as a single
+    section holding its raw text, so nothing the model returned is lost.
+    """
+    sections: Dict[str, Any] = {}
+    document_type = None
+    for first_page, last_page, extraction in partials:
+        if not isinstance(extraction, dict):
+            extraction = {
+                "extracted_sections": {
+                    "section_1": {
+                        "title": f"Pages {first_page}-{last_page}",
+                        "section_type": "mixed",
+                        "hierarchy_level": 1,
+                        "content": {"raw_text": str(extraction), "word_count": len(str(extraction).split())},
+                    }
+                }
+            }
+        metadata = extraction.get("document_metadata") or {}
+        document_type = document_type or metadata.get("document_type")
+        partial_sections = extraction.get("extracted_sections") or {}
+        for key in sorted(partial_sections, key=_section_order):
+            section = partial_sections[key]
+            if isinstance(section, dict):
+                section = dict(section)
+                section.setdefault("page_start", first_page)
+                section.setdefault("page_end", last_page)
+            sections[f"section_{len(sections) + 1}"] = section
+
+    return {
+        "document_metadata": {
+            "document_type": document_type or "PDF",
+            "total_sections": len(sections),
+            "total_pages": partials[-1][1] if partials else 0,
+            "extraction_timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "extracted_sections": sections,
+    }
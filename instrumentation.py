@@ -0,0 +1,230 @@
+"""Stage timers, size histograms and request profiling for both services.
+
+Metrics live in one process-wide :data:`REGISTRY` and are rendered in the
+Prometheus text exposition format by :func:`render`, which both apps serve
+at ``/metrics``. The main series are:
+
+- ``stage_seconds{service, stage}``: time spent in each step of a request
+  (receiving the upload, model calls, JSON parsing, PDF rendering,
+  transcription, prompt building, chat).
+- ``payload_bytes{service, kind}`` and ``tokens{service, kind}``: sizes of
+  what flows through those steps.
+- ``request_seconds{service, endpoint, status}``: whole requests.
+
+Profiling is opt-in. With ``PROFILE_REQUESTS=1``, a request that sends
+``X-Profile: 1`` (or ``?profile=1``) runs under cProfile. The stats are
+dumped to ``PROFILE_DIR`` and the file name is returned in the
+``X-Profile-File`` header. Only one request is profiled at a time, and a
+second request asking meanwhile runs unprofiled.
+"""
+
+import cProfile
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(11))  # 1 KiB .. 1 GiB
+TOKEN_BUCKETS = tuple(2 ** power for power in range(4, 18))  # 16 .. 131072
+
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label combination."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: per-bucket counts (last slot is +Inf), sum, count
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            series[0][index] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), list(totals)) for key, (counts, totals) in sorted(self._series.items())]
+        for key, counts, (total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:g}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count:g}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("stage_seconds", "Time spent in one stage of a request.", ("service", "stage"))
+PAYLOAD_BYTES = Histogram("payload_bytes", "Size of payloads handled per stage.", ("service", "kind"), SIZE_BUCKETS)
+TOKENS = Histogram("tokens", "Token counts of prompts and their parts.", ("service", "kind"), TOKEN_BUCKETS)
+REQUEST_SECONDS = Histogram(
+    "request_seconds", "Time to complete a request.", ("service", "endpoint", "status")
+)
+PROFILED_REQUESTS = Counter("profiled_requests_total", "Requests dumped as cProfile traces.", ("service",))
+
+REGISTRY = [STAGE_SECONDS, PAYLOAD_BYTES, TOKENS, REQUEST_SECONDS, PROFILED_REQUESTS]
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def stage(service: str, name: str) -> Iterator[None]:
+    """Time the enclosed block as ``stage_seconds{service, stage=name}``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, service=service, stage=name)
+
+
+def record_size(service: str, kind: str, size: int) -> None:
+    PAYLOAD_BYTES.observe(size, service=service, kind=kind)
+
+
+def record_tokens(service: str, counts: Dict[str, int]) -> None:
+    for kind, count in counts.items():
+        TOKENS.observe(count, service=service, kind=kind)
+
+
+_profile_lock = threading.Lock()
+
+
+def profiling_requested(headers, params) -> bool:
+    return PROFILE_REQUESTS and "1" in (headers.get("x-profile"), params.get("profile"))
+
+
+class RequestProfile:
+    """cProfile session for one request; a no-op if another is already running.
+
+    ``filename`` is chosen when profiling starts (so it can be sent in the
+    response headers) and is ``None`` when this request is not profiled.
+    """
+
+    def __init__(self, service: str, endpoint: str):
+        self.service = service
+        self.endpoint = endpoint
+        self.filename: Optional[str] = None
+        self._profiler: Optional[cProfile.Profile] = None
+
+    def start(self) -> "RequestProfile":
+        if _profile_lock.acquire(blocking=False):
+            stamp = time.strftime("%Y%m%dT%H%M%S")
+            self.filename = f"{self.service}-{self.endpoint}-{stamp}-{uuid.uuid4().hex[:8]}.prof"
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def stop(self) -> None:
+        """Stop profiling and dump the stats to ``PROFILE_DIR/filename``."""
+        if self._profiler is None:
+            return
+        try:
+            self._profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            self._profiler.dump_stats(os.path.join(PROFILE_DIR, self.filename))
+            PROFILED_REQUESTS.inc(service=self.service)
+        finally:
+            self._profiler = None
+            _profile_lock.release()
+
+
+class ASGIInstrumentation:
+    """ASGI middleware recording ``request_seconds`` and running opt-in profiles.
+
+    Timing runs until the last body chunk is sent, so streamed responses
+    are measured in full. WebSocket and lifespan traffic pass straight through.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = {"code": 500}
+        profile = None
+        if PROFILE_REQUESTS:
+            headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+            params = dict(pair.split("=", 1) for pair in scope["query_string"].decode("latin-1").split("&") if "=" in pair)
+            if profiling_requested(headers, params):
+                profile = RequestProfile(self.service, scope["path"].strip("/").replace("/", "_") or "root").start()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if profile is not None and profile.filename:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-profile-file", profile.filename.encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profile is not None:
+                profile.stop()
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started, service=self.service, endpoint=endpoint, status=str(status["code"])
+            )
@@ -0,0 +1,122 @@
+"""Bounded background job queue for long-running extractions.
+
+Requests submit a callable and immediately get a job ID back; a fixed pool of
+worker threads drains a bounded queue and records each job's status and
+result. When the queue is full, ``submit`` raises :class:`QueueFullError` so
+the web layer can push back on clients instead of piling up work.
+"""
+
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be accepted because the queue is at capacity."""
+
+
+@dataclass
+class Job:
+    id: str
+    func: Callable[[], Any] = field(repr=False)
+    status: str = QUEUED
+    result: Any = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return a JSON-serialisable snapshot of the job."""
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == DONE:
+            data["result"] = self.result
+        if self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """Thread pool fed by a bounded queue, with finished jobs kept for ``result_ttl``."""
+
+    def __init__(self, workers: int = 4, max_queued: int = 64, result_ttl: float = 3600):
+        self.result_ttl = result_ttl
+        self._queue: "queue.Queue[Job]" = queue.Queue(maxsize=max_queued)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, func: Callable[[], Any]) -> Job:
+        """Queue ``func`` for execution and return its job record."""
+        job = Job(id=uuid.uuid4().hex, func=func)
+        self._prune()
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFullError("job queue is full")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by ID."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Return queue depth and job counts by status."""
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        counts["workers"] = len(self._workers)
+        counts["queue_depth"] = self._queue.qsize()
+        return counts
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                job.result = job.func()
+                job.status = DONE
+            except Exception as e:
+                job.error = str(e)
+                job.status = FAILED
+            finally:
+                job.finished_at = time.time()
+                job.func = None
+                self._queue.task_done()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
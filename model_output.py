@@ -0,0 +1,358 @@
+"""Parsing, repair and validation of model extraction output.
+
+Every consumer of Gemini output goes through this module once: the JSON
+value is located (skipping markdown fences or prose around it), parsed,
+repaired if it was truncated mid-value, validated against the
+``document_metadata``/``extracted_sections`` schema and turned into an
+:class:`Extraction`. The same scanner backs :class:`IncrementalJSONParser`,
+which is fed streamed chunks and only scans each byte once.
+
+Parse time, failures and repairs are recorded per document and aggregated
+in :func:`parse_stats`.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# Only these characters can change the scanner state
+_STRUCTURAL = re.compile(r'[{}\[\]",\\]')
+_CLOSERS = {"{": "}", "[": "]"}
+# How many recent commas to keep as fallback cut points when repairing
+_REPAIR_CUTS = 16
+
+
+class _Scanner:
+    """Tracks nesting and string state of the first JSON value in a text."""
+
+    __slots__ = ("start", "end", "stack", "in_string", "skip", "commas", "last_open", "pos")
+
+    def __init__(self):
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self.stack: List[str] = []
+        self.in_string = False
+        self.skip = -1  # position of a character escaped by a backslash
+        self.commas: deque = deque(maxlen=_REPAIR_CUTS)
+        self.last_open = -1  # position just after the most recent { or [
+        self.pos = 0
+
+    def feed(self, chunk: str) -> None:
+        base = self.pos
+        self.pos += len(chunk)
+        if self.end is not None:
+            return
+        for match in _STRUCTURAL.finditer(chunk):
+            i = base + match.start()
+            ch = match.group()
+            if self.start is None:
+                if ch in _CLOSERS:
+                    self.start = i
+                    self.last_open = i + 1
+                    self.stack.append(_CLOSERS[ch])
+                continue
+            if self.in_string:
+                if i == self.skip:
+                    continue
+                if ch == "\\":
+                    self.skip = i + 1
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in _CLOSERS:
+                self.last_open = i + 1
+                self.stack.append(_CLOSERS[ch])
+            elif ch in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if not self.stack:
+                    self.end = i + 1
+                    return
+            elif ch == ",":
+                self.commas.append(i)
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+
+def _close(prefix: str, scanner: _Scanner) -> str:
+    text = prefix
+    if scanner.in_string:
+        if scanner.skip == scanner.pos:
+            text = text[:-1]  # dangling backslash
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    elif text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(scanner.stack))
+
+
+def _repair(text: str, scanner: _Scanner) -> Any:
+    """Close a truncated JSON value, cutting back to earlier commas if needed."""
+    body = text[scanner.start:]
+    try:
+        return json.loads(_close(body, scanner))
+    except json.JSONDecodeError:
+        pass
+    # Drop the trailing incomplete member: cut at recent commas, then just
+    # inside the innermost open container
+    cuts = sorted(set(scanner.commas) | {scanner.last_open}, reverse=True)
+    for cut in cuts:
+        prefix = body[: cut - scanner.start]
+        rescanned = _Scanner()
+        rescanned.feed(prefix)
+        try:
+            return json.loads(_close(prefix, rescanned))
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def _decode(text: str, scanner: _Scanner):
+    """Return ``(value, repaired)`` for the scanned text; value is None on failure."""
+    if scanner.start is None:
+        return None, False
+    if scanner.complete:
+        try:
+            return json.loads(text[scanner.start:scanner.end]), False
+        except json.JSONDecodeError:
+            pass
+    value = _repair(text, scanner)
+    return value, value is not None
+
+
+def load_json(text: str) -> Any:
+    """Parse the first JSON value in ``text``, repairing truncation; None on failure."""
+    scanner = _Scanner()
+    scanner.feed(text)
+    return _decode(text, scanner)[0]
+
+
+@dataclass
+class Section:
+    key: str
+    title: str
+    section_type: str
+    hierarchy_level: Any
+    raw_text: str
+    word_count: Any
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "title": self.title,
+            "section_type": self.section_type,
+            "hierarchy_level": self.hierarchy_level,
+        }
+        data.update(self.extra)
+        data["content"] = {"raw_text": self.raw_text, "word_count": self.word_count}
+        return data
+
+
+@dataclass
+class Extraction:
+    """A parsed extraction; ``raw`` is the model output it was built from."""
+
+    raw: str
+    metadata: Optional[Dict[str, Any]]
+    sections: List[Section]
+    valid: bool
+    repaired: bool = False
+    errors: List[str] = field(default_factory=list)
+    parse_seconds: float = 0.0
+    digest: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        if self.metadata is not None:
+            data["document_metadata"] = dict(self.metadata)
+        data["extracted_sections"] = {section.key: section.to_dict() for section in self.sections}
+        return data
+
+    def payload(self) -> Any:
+        """The extraction as a JSON value, or the raw text if it could not be parsed."""
+        return self.to_dict() if self.valid else self.raw
+
+    def to_record(self) -> str:
+        """Serialise for storage outside the process (see :func:`from_record`)."""
+        return json.dumps({
+            "raw": self.raw,
+            "data": self.to_dict(),
+            "valid": self.valid,
+            "repaired": self.repaired,
+            "errors": self.errors,
+            "parse_seconds": self.parse_seconds,
+            "digest": self.digest,
+        })
+
+
+def from_record(record: str) -> Extraction:
+    """Rebuild an :class:`Extraction` written by :meth:`Extraction.to_record`."""
+    stored = json.loads(record)
+    extraction = _build(stored["raw"], stored["data"], stored["valid"])
+    extraction.repaired = stored["repaired"]
+    extraction.errors = stored["errors"]
+    extraction.parse_seconds = stored["parse_seconds"]
+    extraction.digest = stored["digest"]
+    return extraction
+
+
+def validate_extraction(data: Any) -> List[str]:
+    """Return a list of schema problems; empty means the structure is as expected."""
+    if not isinstance(data, dict):
+        return ["top-level value is not an object"]
+    errors = []
+    metadata = data.get("document_metadata")
+    if metadata is not None and not isinstance(metadata, dict):
+        errors.append("document_metadata is not an object")
+    sections = data.get("extracted_sections")
+    if not isinstance(sections, dict):
+        errors.append("extracted_sections is missing or not an object")
+        return errors
+    for key, section in sections.items():
+        if not isinstance(section, dict):
+            errors.append(f"{key} is not an object")
+            continue
+        if not isinstance(section.get("title"), str):
+            errors.append(f"{key}.title is missing or not a string")
+        content = section.get("content")
+        if isinstance(content, dict) and not isinstance(content.get("raw_text", ""), str):
+            errors.append(f"{key}.content.raw_text is not a string")
+    if isinstance(metadata, dict):
+        try:
+            declared = int(metadata.get("total_sections"))
+        except (TypeError, ValueError):
+            declared = None
+        if declared is not None and declared != len(sections):
+            errors.append(f"total_sections is {declared} but {len(sections)} sections were returned")
+    return errors
+
+
+def _build(raw: str, data: Any, valid: bool) -> Extraction:
+    if not valid:
+        # Keep the unparsed output readable rather than dropping it
+        section = Section("raw_content", "Extracted Content", "text", 1, raw, len(raw.split()))
+        return Extraction(raw=raw, metadata=None, sections=[section], valid=False)
+
+    sections = []
+    for key, value in data["extracted_sections"].items():
+        if not isinstance(value, dict):
+            continue
+        extra = {k: v for k, v in value.items() if k not in ("title", "section_type", "hierarchy_level", "content")}
+        content = value.get("content")
+        if isinstance(content, dict):
+            raw_text = str(content.get("raw_text", ""))
+            word_count = content.get("word_count", "")
+        elif content is not None:
+            raw_text, word_count = str(content), ""
+        else:
+            raw_text, word_count = "", ""
+        sections.append(Section(
+            key=key,
+            title=str(value.get("title", key)),
+            section_type=str(value.get("section_type", "unknown")),
+            hierarchy_level=value.get("hierarchy_level", ""),
+            raw_text=raw_text,
+            word_count=word_count,
+            extra=extra,
+        ))
+    metadata = data.get("document_metadata")
+    return Extraction(raw=raw, metadata=metadata if isinstance(metadata, dict) else None, sections=sections, valid=True)
+
+
+def _finish(text: str, scanner: _Scanner, started: float) -> Extraction:
+    data, repaired = _decode(text, scanner)
+    errors = validate_extraction(data) if data is not None else ["output is not parseable JSON"]
+    valid = isinstance(data, dict) and isinstance(data.get("extracted_sections"), dict)
+    extraction = _build(text, data, valid)
+    extraction.repaired = repaired
+    extraction.errors = errors
+    extraction.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    extraction.parse_seconds = time.perf_counter() - started
+    _STATS.record(extraction)
+    return extraction
+
+
+def parse_extraction(text: str) -> Extraction:
+    """Parse complete model output into an :class:`Extraction`."""
+    started = time.perf_counter()
+    scanner = _Scanner()
+    scanner.feed(text)
+    return _finish(text, scanner, started)
+
+
+class IncrementalJSONParser:
+    """Accumulates streamed model output, scanning each chunk as it arrives."""
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._scanner = _Scanner()
+        self._seconds = 0.0
+
+    def feed(self, chunk: str) -> None:
+        started = time.perf_counter()
+        self._chunks.append(chunk)
+        self._scanner.feed(chunk)
+        self._seconds += time.perf_counter() - started
+
+    @property
+    def complete(self) -> bool:
+        """True once the top-level JSON value has been closed."""
+        return self._scanner.complete
+
+    def result(self) -> Extraction:
+        """Finish parsing everything fed so far."""
+        # Back-date the start so parse_seconds includes time spent in feed()
+        return _finish("".join(self._chunks), self._scanner, time.perf_counter() - self._seconds)
+
+
+class _ParseStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.failures = 0
+        self.repaired = 0
+        self.schema_errors = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+    def record(self, extraction: Extraction) -> None:
+        with self._lock:
+            self.documents += 1
+            self.failures += not extraction.valid
+            self.repaired += extraction.repaired
+            self.schema_errors += bool(extraction.errors)
+            self.seconds_total += extraction.parse_seconds
+            self.seconds_max = max(self.seconds_max, extraction.parse_seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            documents = self.documents or 1
+            return {
+                "documents": self.documents,
+                "failures": self.failures,
+                "failure_rate": self.failures / documents,
+                "repaired": self.repaired,
+                "schema_errors": self.schema_errors,
+                "seconds_total": self.seconds_total,
+                "seconds_mean": self.seconds_total / documents,
+                "seconds_max": self.seconds_max,
+            }
+
+
+_STATS = _ParseStats()
+
+
+def parse_stats() -> Dict[str, float]:
+    """Aggregate parse timings and failure counts for this process."""
+    return _STATS.snapshot()
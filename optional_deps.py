@@ -0,0 +1,19 @@
+"""Lazy imports of optional dependencies shared by several modules.
+
+Each helper imports its package on first use and caches the result, so a
+service that never touches the feature does not pay for the import at
+startup. A helper returns ``None`` when the package is not installed and
+callers fall back to their pure-Python path.
+"""
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def numpy():
+    """The ``numpy`` module, or ``None`` when it is not installed."""
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return numpy
@@ -0,0 +1,161 @@
+"""Render extraction results to PDF with FPDF, caching the rendered bytes.
+
+Line wrapping uses the font's own character width table (precomputed once
+per font) instead of counting characters, and the finished document is
+cached by the digest of the model output so repeat downloads skip rendering.
+Input is an already parsed :class:`model_output.Extraction`.
+"""
+
+import hashlib
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from model_output import Extraction
+from ttl_cache import TTLCache
+
+# Bump when the layout changes so cached PDFs and ETags are invalidated
+RENDERER_VERSION = "1"
+
+_BODY_FONT = ("Arial", "", 10)
+_HEADER_FONT = ("Arial", "B", 12)
+_LINE_HEIGHT = 6
+
+_render_cache: TTLCache[bytes] = TTLCache(
+    max_entries=256, ttl=3600, max_weight=64 * 1024 * 1024, weigh=len
+)
+
+
+def result_etag(extraction: Extraction) -> str:
+    """Stable identifier for the PDF rendered from ``extraction``."""
+    digest = hashlib.sha256(extraction.digest.encode("ascii"))
+    digest.update(RENDERER_VERSION.encode("ascii"))
+    return digest.hexdigest()
+
+
+def _latin1(text: Any) -> str:
+    # The core fonts only cover latin-1; replace anything else
+    return str(text).encode("latin-1", "replace").decode("latin-1")
+
+
+class _SectionLayout:
+    """Page header and section layout, mixed into ``FPDF`` by :func:`_pdf_class`."""
+
+    def __init__(self):
+        super().__init__()
+        self._widths: Dict[Tuple[str, str, int], Tuple[Dict[str, float], Dict[str, float]]] = {}
+
+    def header(self):
+        self.set_font("Arial", "B", 16)
+        self.cell(0, 10, "Extracted Document Sections", 0, 1, "C")
+        self.ln(10)
+
+    def section_header(self, title):
+        self.set_font(*_HEADER_FONT)
+        self.cell(0, 8, _latin1(title), 0, 1, "L")
+        self.ln(2)
+
+    def section_content(self, content):
+        self.set_font(*_BODY_FONT)
+        for line in self.wrap(_latin1(content)):
+            self.cell(0, _LINE_HEIGHT, line, 0, 1, "L")
+        self.ln(3)
+
+    def _font_widths(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        # Scale the font's 1/1000 em widths to user units once per font, and
+        # memoise whole-word widths since claim text repeats words heavily
+        key = (self.font_family, self.font_style, self.font_size_pt)
+        widths = self._widths.get(key)
+        if widths is None:
+            scale = self.font_size / 1000.0
+            widths = ({ch: w * scale for ch, w in self.current_font["cw"].items()}, {})
+            self._widths[key] = widths
+        return widths
+
+    def wrap(self, text: str) -> List[str]:
+        """Split ``text`` into lines that fit the printable width."""
+        widths, word_widths = self._font_widths()
+        max_width = self.w - self.l_margin - self.r_margin - 2 * self.c_margin
+        space = widths.get(" ", 0.0)
+        lines: List[str] = []
+        for paragraph in text.split("\n"):
+            # Lines are slices of the word list, joined once when they are full
+            words = paragraph.split(" ")
+            start = 0
+            line_width = -space
+            for index, word in enumerate(words):
+                width = word_widths.get(word)
+                if width is None:
+                    width = word_widths[word] = sum([widths.get(ch, 0.0) for ch in word])
+                line_width += space + width
+                if line_width <= max_width:
+                    continue
+                if index > start:
+                    lines.append(" ".join(words[start:index]))
+                start, line_width = index, width
+                if width > max_width:
+                    # A single word wider than the page is broken by character;
+                    # its last piece starts the next line
+                    piece, piece_width = "", 0.0
+                    for ch in word:
+                        ch_width = widths.get(ch, 0.0)
+                        if piece and piece_width + ch_width > max_width:
+                            lines.append(piece)
+                            piece, piece_width = "", 0.0
+                        piece += ch
+                        piece_width += ch_width
+                    words[index], line_width = piece, piece_width
+            lines.append(" ".join(words[start:]))
+        return lines
+
+
+@lru_cache(maxsize=None)
+def _pdf_class():
+    # fpdf is imported on the first render rather than at startup
+    from fpdf import FPDF
+
+    return type("SectionPDF", (_SectionLayout, FPDF), {})
+
+
+def render_pdf(extraction: Extraction) -> bytes:
+    """Lay out the metadata and sections of an extraction as a PDF."""
+    pdf = _pdf_class()()
+    pdf.add_page()
+
+    # Add document metadata if available
+    metadata = extraction.metadata
+    if metadata is not None:
+        pdf.section_header("Document Information")
+        pdf.section_content(f"Document Type: {metadata.get('document_type', 'Unknown')}")
+        pdf.section_content(f"Total Sections: {metadata.get('total_sections', 'Unknown')}")
+        pdf.section_content(f"Extraction Date: {metadata.get('extraction_timestamp', 'Unknown')}")
+        pdf.ln(5)
+
+    for section in extraction.sections:
+        pdf.section_header(
+            f"{section.title} (Type: {section.section_type}, Level: {section.hierarchy_level})"
+        )
+        if section.raw_text:
+            pdf.section_content(section.raw_text)
+        if section.word_count:
+            pdf.section_content(f"Word Count: {section.word_count}")
+
+        pdf.ln(3)
+        if pdf.get_y() > 250:
+            pdf.add_page()
+
+    output = pdf.output(dest="S")
+    return output.encode("latin-1") if isinstance(output, str) else bytes(output)
+
+
+def render_cached(extraction: Extraction) -> Tuple[bytes, str]:
+    """Return ``(pdf_bytes, etag)``, rendering only on a cache miss."""
+    etag = result_etag(extraction)
+    pdf_bytes = _render_cache.get(etag)
+    if pdf_bytes is None:
+        pdf_bytes = render_pdf(extraction)
+        _render_cache.set(etag, pdf_bytes)
+    return pdf_bytes, etag
+
+
+def cache_stats() -> Dict[str, float]:
+    return _render_cache.stats()
@@ -0,0 +1,199 @@
+"""Local text-layer extraction and structure hints for PDFs.
+
+Instead of shipping a whole PDF to the model and asking it to echo every
+section verbatim, the text layer is read locally with ``pypdf`` and split
+into numbered lines. Only short candidate heading lines are sent to the
+model, which answers with section boundaries; the full ``raw_text`` of each
+section is then rebuilt here from the local lines. Scanned PDFs without a
+usable text layer fall back to the upload path in ``app.py``.
+"""
+
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, List, Sequence, Tuple, Union
+
+# Below this many characters per page on average, treat the PDF as scanned
+MIN_CHARS_PER_PAGE = 40
+# Upper bound on heading candidates sent to the model
+MAX_HINT_LINES = 1500
+_MAX_HEADING_CHARS = 100
+_MAX_HEADING_WORDS = 12
+
+_NUMBERED = re.compile(r"^(\d+(\.\d+)*|[IVXLC]+|[A-Z])[.)]?\s+\S")
+_LETTERS = re.compile(r"[A-Za-z]")
+
+
+@lru_cache(maxsize=None)
+def _pypdf():
+    """The ``pypdf`` module, imported on first use; ``None`` if it is not installed."""
+    try:
+        import pypdf
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return pypdf
+
+
+@dataclass
+class Line:
+    number: int
+    page: int
+    text: str
+
+
+def extract_lines(path: Union[str, BinaryIO]) -> List[Line]:
+    """Return every non-empty text line in the PDF, numbered from 1.
+
+    ``path`` may also be a seekable binary stream, e.g. an in-memory upload.
+    """
+    pypdf = _pypdf()
+    if pypdf is None:
+        return []
+    lines: List[Line] = []
+    reader = pypdf.PdfReader(path)
+    for page_number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        for raw in text.splitlines():
+            stripped = raw.strip()
+            if stripped:
+                lines.append(Line(len(lines) + 1, page_number, stripped))
+    return lines
+
+
+def page_count(lines: Sequence[Line]) -> int:
+    return lines[-1].page if lines else 0
+
+
+def count_pages(path: Union[str, BinaryIO]) -> int:
+    """Return the number of pages in the PDF, or 0 if it cannot be read."""
+    pypdf = _pypdf()
+    if pypdf is None:
+        return 0
+    try:
+        return len(pypdf.PdfReader(path).pages)
+    except Exception:
+        return 0
+
+
+def split_pdf(path: Union[str, BinaryIO], pages_per_chunk: int, dest_dir: str) -> List[Tuple[int, int, str]]:
+    """Write ``pages_per_chunk``-page slices of the PDF to ``dest_dir``.
+
+    Returns ``(first_page, last_page, path)`` tuples with 1-based page numbers.
+    """
+    pypdf = _pypdf()
+    reader = pypdf.PdfReader(path)
+    total = len(reader.pages)
+    chunks = []
+    for first in range(0, total, pages_per_chunk):
+        last = min(first + pages_per_chunk, total)
+        writer = pypdf.PdfWriter()
+        for index in range(first, last):
+            writer.add_page(reader.pages[index])
+        chunk_path = os.path.join(dest_dir, f"{uuid.uuid4().hex}.pdf")
+        with open(chunk_path, "wb") as handle:
+            writer.write(handle)
+        chunks.append((first + 1, last, chunk_path))
+    return chunks
+
+
+def group_by_pages(lines: Sequence[Line], pages_per_chunk: int) -> List[List[Line]]:
+    """Split lines into consecutive groups covering ``pages_per_chunk`` pages each."""
+    groups: List[List[Line]] = []
+    for line in lines:
+        bucket = (line.page - 1) // pages_per_chunk
+        while len(groups) <= bucket:
+            groups.append([])
+        groups[bucket].append(line)
+    return [group for group in groups if group]
+
+
+def has_text_layer(lines: Sequence[Line]) -> bool:
+    """Return True if the extracted text is dense enough to skip the upload."""
+    pages = page_count(lines)
+    if not pages:
+        return False
+    return sum(len(line.text) for line in lines) / pages >= MIN_CHARS_PER_PAGE
+
+
+def is_heading_candidate(text: str) -> bool:
+    """Cheap heuristic for lines that may start a section."""
+    if len(text) > _MAX_HEADING_CHARS or not _LETTERS.search(text):
+        return False
+    words = text.split()
+    if len(words) > _MAX_HEADING_WORDS:
+        return False
+    if _NUMBERED.match(text) or text.endswith(":"):
+        return True
+    if text.isupper():
+        return True
+    return not text.endswith((".", ",", ";")) and all(w[0].isupper() for w in words if w[0].isalpha())
+
+
+def structure_hints(lines: Sequence[Line]) -> str:
+    """Render heading candidates as compact ``L<line> p<page>: text`` rows."""
+    candidates = [line for line in lines if is_heading_candidate(line.text)]
+    if not candidates:
+        # Nothing looks like a heading; offer the first line of each page instead
+        seen = set()
+        candidates = [line for line in lines if not (line.page in seen or seen.add(line.page))]
+    rows = [f"L{line.number} p{line.page}: {line.text}" for line in candidates[:MAX_HINT_LINES]]
+    header = f"Pages {lines[0].page}-{lines[-1].page}, {len(lines)} lines.\n"
+    return header + "\n".join(rows)
+
+
+def assemble_sections(lines: Sequence[Line], boundaries: Sequence[Dict[str, Any]], document_type: str = "PDF") -> Dict[str, Any]:
+    """Build the ``document_metadata``/``extracted_sections`` JSON from boundaries.
+
+    Each boundary names the line number where a section's heading sits; the
+    section's ``raw_text`` runs from the following line up to the next
+    boundary. Text before the first boundary becomes a preamble section.
+    """
+    valid = {}
+    for boundary in boundaries:
+        try:
+            number = int(boundary.get("line"))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= number <= len(lines) and number not in valid:
+            valid[number] = boundary
+    starts = sorted(valid)
+
+    spans = []
+    if not starts or starts[0] > 1:
+        first = starts[0] if starts else len(lines) + 1
+        spans.append((1, first, {"title": "Preamble", "section_type": "paragraph", "hierarchy_level": 1}, False))
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(lines) + 1
+        spans.append((start, end, valid[start], True))
+
+    sections: Dict[str, Any] = {}
+    for start, end, boundary, has_heading in spans:
+        body = lines[start if has_heading else start - 1:end - 1]
+        raw_text = "\n".join(line.text for line in body)
+        if not has_heading and not raw_text:
+            continue
+        heading = lines[start - 1]
+        sections[f"section_{len(sections) + 1}"] = {
+            "title": boundary.get("title") or (heading.text if has_heading else "Preamble"),
+            "section_type": boundary.get("section_type", "mixed"),
+            "hierarchy_level": boundary.get("hierarchy_level", 1),
+            "page_start": heading.page,
+            "page_end": lines[end - 2].page if end - 2 >= 0 else heading.page,
+            "content": {
+                "raw_text": raw_text,
+                "word_count": len(raw_text.split()),
+            },
+        }
+
+    return {
+        "document_metadata": {
+            "document_type": document_type,
+            "total_sections": len(sections),
+            "total_pages": page_count(lines),
+            "extraction_timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "extracted_sections": sections,
+    }
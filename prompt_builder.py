@@ -0,0 +1,135 @@
+"""Token-budgeted prompt assembly for the voice assistant.
+
+Tokens are counted locally: with ``tiktoken`` when it is installed, else
+with a characters-per-token estimate. A prompt is filled in priority order
+until the budget is spent: the latest question, then context chosen for it,
+then older turns from newest to oldest, then a running summary of turns
+that have left the window. Whatever does not fit is truncated or dropped,
+and the per-part token counts are returned with the prompt.
+"""
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from retrieval import estimate_tokens
+
+_HEADER = (
+    "You are assisting in a live conversation. Use the uploaded context to"
+    " ground your answers, but reply concisely and directly to the latest"
+    " question.\n\n"
+)
+_NO_CONTEXT = "(no additional context provided)"
+
+
+@lru_cache(maxsize=None)
+def _tiktoken():
+    # Imported with the first prompt rather than at startup
+    try:
+        import tiktoken
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return tiktoken
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    tiktoken = _tiktoken()
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Number of model tokens in ``text`` (estimated without tiktoken)."""
+    if _tiktoken() is None:
+        return estimate_tokens(text)
+    return len(_encoding(model).encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Cut ``text`` to at most ``max_tokens``, keeping its start (or end)."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _tiktoken() is not None:
+        tokens = _encoding("gpt-4o-mini").encode(text, disallowed_special=())
+        kept = tokens[-max_tokens:] if keep_end else tokens[:max_tokens]
+        return _encoding("gpt-4o-mini").decode(kept)
+    chars = max_tokens * 4
+    return text[-chars:] if keep_end else text[:chars]
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    tokens: Dict[str, int] = field(default_factory=dict)
+    dropped_turns: int = 0
+
+
+def build_prompt(
+    turns: Sequence[str],
+    select_context: Callable[[str, int], Tuple[str, int]],
+    budget: int,
+    summary: Optional[str] = None,
+) -> BuiltPrompt:
+    """Assemble the prompt for the last of ``turns`` within ``budget`` tokens.
+
+    ``select_context(question, max_tokens)`` returns a context blob and its
+    token count; it is called with whatever the question left over.
+    """
+    question = turns[-1] if turns else ""
+    remaining = budget - count_tokens(_HEADER) - 16  # section labels
+
+    # The latest question always goes in; a runaway one keeps its end,
+    # where the actual question usually is
+    question = truncate_tokens(question, max(remaining, 1), keep_end=True)
+    question_tokens = count_tokens(question)
+    remaining -= question_tokens
+
+    context, context_tokens = select_context(question, max(remaining, 0)) if remaining > 0 else ("", 0)
+    remaining -= context_tokens
+
+    history: List[str] = []
+    history_tokens = 0
+    older = list(turns[:-1])
+    for turn in reversed(older):
+        tokens = count_tokens(turn) + 1
+        if tokens > remaining:
+            break
+        history.insert(0, turn)
+        history_tokens += tokens
+        remaining -= tokens
+    dropped = len(older) - len(history)
+
+    summary_text = truncate_tokens(summary or "", remaining)
+    summary_tokens = count_tokens(summary_text) if summary_text else 0
+
+    sections = [_HEADER, f"Context information:\n{context or _NO_CONTEXT}\n\n"]
+    if summary_text:
+        sections.append(f"Earlier conversation summary:\n{summary_text}\n\n")
+    sections.append("Recent conversation transcripts:\n" + "\n".join(history + [question]))
+    text = "".join(sections)
+    return BuiltPrompt(
+        text=text,
+        tokens={
+            "question": question_tokens,
+            "context": context_tokens,
+            "history": history_tokens,
+            "summary": summary_tokens,
+            "total": count_tokens(text),
+        },
+        dropped_turns=dropped,
+    )
+
+
+def summary_prompt(summary: str, turns: Sequence[str]) -> str:
+    """Prompt asking the model to fold ``turns`` into the running ``summary``."""
+    return (
+        "Update the running summary of a live conversation with the turns below."
+        " Keep names, numbers, dates and open questions; stay under 150 words.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\n"
+        "New turns:\n" + "\n".join(turns)
+    )
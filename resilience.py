@@ -0,0 +1,434 @@
+"""Rate limiting, retries, deadlines and circuit breaking for remote model calls.
+
+Every provider call made by a backend goes through a :class:`RemoteCaller`
+for that provider. Before each attempt, the caller waits for a token from
+the provider's :class:`TokenBucket`, so bursts queue locally instead of
+tripping the provider's rate limit. Transient failures (rate limits,
+5xx, timeouts, dropped connections) are retried with full-jitter
+exponential backoff. Nothing waits past the request's deadline. After
+repeated failures the provider's :class:`CircuitBreaker` opens, and calls
+fail fast with :class:`CircuitOpenError` until a trial call succeeds.
+
+Deadlines are carried in a context variable. A request sets one with
+:func:`deadline_scope`, and every call beneath it, including calls on
+pool threads started with :func:`contextvars.copy_context`, sees the
+remaining time.
+
+:class:`UploadJanitor` deletes remote file uploads in the background. It
+retries failed deletes and periodically sweeps for uploads this service
+left behind, for example after a crash.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from instrumentation import Counter, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REMOTE_CALLS = Counter(
+    "remote_calls_total", "Remote model call attempts by outcome.", ("provider", "outcome")
+)
+JANITOR_DELETES = Counter(
+    "janitor_deletes_total", "Background deletes of remote uploads by outcome.", ("provider", "outcome")
+)
+REGISTRY.extend([REMOTE_CALLS, JANITOR_DELETES])
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_NAMES = {"APITimeoutError", "APIConnectionError", "DeadlineExceeded", "ServiceUnavailable"}
+
+
+class CallRejected(Exception):
+    """Base for calls refused locally; retrying them immediately cannot help."""
+
+
+class CircuitOpenError(CallRejected):
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is unavailable after repeated failures; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(CallRejected):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Optional[Deadline]]:
+    """Run the block under a deadline of ``seconds`` (no deadline if ``None`` or 0).
+
+    A deadline that is already set and earlier is kept.
+    """
+    current = _deadline.get()
+    deadline = Deadline(seconds) if seconds else None
+    if current is not None and (deadline is None or current.expires < deadline.expires):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the current deadline, capped at ``default``."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return deadline.remaining() if default is None else min(default, deadline.remaining())
+
+
+class TokenBucket:
+    """Allow ``rate`` calls per second on average, with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token now, or return how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        if self.rate <= 0:
+            return True
+        give_up = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._reserve()
+            if not wait:
+                return True
+            if give_up is not None and time.monotonic() + wait > give_up:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> bool:
+        if self.rate <= 0:
+            return True
+        give_up = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._reserve()
+            if not wait:
+                return True
+            if give_up is not None and time.monotonic() + wait > give_up:
+                return False
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """Opens after ``failures`` consecutive failures; lets one trial call through after ``reset_after`` seconds."""
+
+    def __init__(self, provider: str, failures: int = 5, reset_after: float = 30.0):
+        self.provider = provider
+        self.threshold = failures
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial: Optional[object] = None  # token of the caller making the half-open trial
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.reset_after else "open"
+
+    def _reject_unless_admissible(self) -> bool:
+        # Called with the lock held; True if the circuit is closed
+        if self._opened_at is None or self.threshold <= 0:
+            return True
+        waited = time.monotonic() - self._opened_at
+        if waited < self.reset_after or self._trial is not None:
+            raise CircuitOpenError(self.provider, max(self.reset_after - waited, 1.0))
+        return False
+
+    def check(self) -> None:
+        """Raise :class:`CircuitOpenError` if a call would be rejected now, without admitting one."""
+        with self._lock:
+            self._reject_unless_admissible()
+
+    def allow(self) -> Optional[object]:
+        """Admit a call; returns a trial token when it is the half-open trial, else ``None``.
+
+        A trial must end in :meth:`record_success`, :meth:`record_failure` or
+        :meth:`release_trial`, or the circuit stays half-open for good.
+        """
+        with self._lock:
+            if self._reject_unless_admissible():
+                return None
+            self._trial = token = object()
+            return token
+
+    def release_trial(self, token: Optional[object]) -> None:
+        """Give back a trial that ended without a verdict (cancelled, never sent)."""
+        with self._lock:
+            if token is not None and self._trial is token:
+                self._trial = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial is not None or (self.threshold > 0 and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self._trial = None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether ``error`` looks transient: rate limits, 5xx, timeouts, dropped connections."""
+    if isinstance(error, CallRejected):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # openai errors carry status_code; google.api_core errors carry code
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and status in _RETRYABLE_STATUS:
+        return True
+    return type(error).__name__ in _RETRYABLE_NAMES
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RemoteCaller:
+    """Rate-limited, retried, deadline-bounded calls to one provider."""
+
+    def __init__(
+        self,
+        provider: str,
+        rate: float = 0.0,
+        burst: Optional[float] = None,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 20.0,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+    ):
+        self.provider = provider
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(provider, breaker_failures, breaker_reset)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def _delay(self, attempt: int, error: BaseException) -> float:
+        hinted = _retry_after(error)
+        if hinted is not None:
+            return min(hinted, self.max_backoff)
+        # Full jitter: spreads retries from many callers instead of syncing them
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _before_attempt(self) -> Optional[float]:
+        deadline = _deadline.get()
+        if deadline is not None and deadline.expired:
+            REMOTE_CALLS.inc(provider=self.provider, outcome="deadline")
+            raise DeadlineExceeded(f"deadline passed before calling {self.provider}")
+        self._admit(self.breaker.check)
+        return None if deadline is None else deadline.remaining()
+
+    def _admit(self, gate: Callable[[], Any]) -> Any:
+        try:
+            return gate()
+        except CircuitOpenError:
+            REMOTE_CALLS.inc(provider=self.provider, outcome="rejected_open")
+            raise
+
+    def _after_failure(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Record ``error``; returns the delay before retrying, or ``None`` to give up."""
+        if not is_retryable(error):
+            # The provider answered (e.g. a bad request); it is not unhealthy
+            REMOTE_CALLS.inc(provider=self.provider, outcome="error")
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        delay = self._delay(attempt, error)
+        remaining = remaining_time()
+        if attempt >= self.retries or (remaining is not None and delay >= remaining):
+            REMOTE_CALLS.inc(provider=self.provider, outcome="failed")
+            return None
+        REMOTE_CALLS.inc(provider=self.provider, outcome="retry")
+        logger.info("%s call failed (%s); retry %d in %.2fs", self.provider, error, attempt + 1, delay)
+        return delay
+
+    def _limit(self, remaining: Optional[float]) -> None:
+        if not self.bucket.acquire(timeout=remaining):
+            REMOTE_CALLS.inc(provider=self.provider, outcome="deadline")
+            raise DeadlineExceeded(f"deadline passed waiting for a {self.provider} rate-limit slot")
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        for attempt in range(self.retries + 1):
+            # The rate-limit slot comes first, so a half-open trial is only
+            # taken by a call that is about to be sent
+            self._limit(self._before_attempt())
+            trial = self._admit(self.breaker.allow)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                delay = self._after_failure(attempt, error)
+                if delay is None:
+                    raise
+            else:
+                self.breaker.record_success()
+                REMOTE_CALLS.inc(provider=self.provider, outcome="ok")
+                return result
+            finally:
+                self.breaker.release_trial(trial)  # no-op once success or failure was recorded
+            time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def acall(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        for attempt in range(self.retries + 1):
+            remaining = self._before_attempt()
+            if not await self.bucket.acquire_async(timeout=remaining):
+                REMOTE_CALLS.inc(provider=self.provider, outcome="deadline")
+                raise DeadlineExceeded(f"deadline passed waiting for a {self.provider} rate-limit slot")
+            trial = self._admit(self.breaker.allow)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as error:
+                delay = self._after_failure(attempt, error)
+                if delay is None:
+                    raise
+            else:
+                self.breaker.record_success()
+                REMOTE_CALLS.inc(provider=self.provider, outcome="ok")
+                return result
+            finally:
+                # Also runs on cancellation (a BaseException), e.g. a client disconnecting
+                self.breaker.release_trial(trial)
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"breaker": self.breaker.state, "rate_per_second": self.bucket.rate, "retries": self.retries}
+
+
+def caller_from_env(provider: str, retries: int = 3) -> RemoteCaller:
+    """Build the caller for ``provider`` from ``<PROVIDER>_RATE_LIMIT`` and friends."""
+    prefix = provider.upper()
+    return RemoteCaller(
+        provider,
+        rate=float(os.getenv(f"{prefix}_RATE_LIMIT", "0")),
+        burst=float(os.getenv(f"{prefix}_RATE_BURST")) if os.getenv(f"{prefix}_RATE_BURST") else None,
+        retries=int(os.getenv(f"{prefix}_MAX_RETRIES", str(retries))),
+        breaker_failures=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+        breaker_reset=float(os.getenv(f"{prefix}_BREAKER_RESET", "30")),
+    )
+
+
+class UploadJanitor:
+    """Deletes remote uploads in the background, retrying until they are gone.
+
+    ``delete(name)`` removes one upload. If ``list_uploads`` is given, it
+    should yield ``(name, age_seconds)`` for uploads this service created,
+    and every ``sweep_interval`` seconds those older than ``max_age`` are
+    deleted too.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        delete: Callable[[str], None],
+        list_uploads: Optional[Callable[[], Iterable]] = None,
+        attempts: int = 5,
+        backoff: float = 2.0,
+        sweep_interval: float = 600.0,
+        max_age: float = 3600.0,
+    ):
+        self.provider = provider
+        self._delete = delete
+        self._list_uploads = list_uploads
+        self.attempts = attempts
+        self.backoff = backoff
+        self.sweep_interval = sweep_interval
+        self.max_age = max_age
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"{provider}-janitor", daemon=True)
+        self._thread.start()
+
+    def schedule(self, name: str) -> None:
+        self._queue.put((time.monotonic(), name, 0))
+
+    def _run(self) -> None:
+        next_sweep = time.monotonic() + self.sweep_interval
+        retry: list = []
+        while True:
+            now = time.monotonic()
+            # Due retries go back on the queue; the soonest one bounds the wait
+            due = [item for item in retry if item[0] <= now]
+            retry = [item for item in retry if item[0] > now]
+            for item in due:
+                self._queue.put(item)
+            wake = min([next_sweep] + [item[0] for item in retry])
+            try:
+                _, name, attempt = self._queue.get(timeout=max(wake - time.monotonic(), 0.01))
+            except queue.Empty:
+                if self._list_uploads is not None and time.monotonic() >= next_sweep:
+                    self._sweep()
+                    next_sweep = time.monotonic() + self.sweep_interval
+                continue
+            try:
+                self._delete(name)
+                JANITOR_DELETES.inc(provider=self.provider, outcome="deleted")
+            except Exception as error:
+                if attempt + 1 >= self.attempts:
+                    JANITOR_DELETES.inc(provider=self.provider, outcome="abandoned")
+                    logger.warning("giving up deleting %s upload %s: %s", self.provider, name, error)
+                else:
+                    JANITOR_DELETES.inc(provider=self.provider, outcome="retry")
+                    retry.append((time.monotonic() + self.backoff * 2 ** attempt, name, attempt + 1))
+
+    def _sweep(self) -> None:
+        try:
+            for name, age in self._list_uploads():
+                if age > self.max_age:
+                    self.schedule(name)
+                    JANITOR_DELETES.inc(provider=self.provider, outcome="orphan_found")
+        except Exception as error:
+            logger.warning("listing %s uploads failed: %s", self.provider, error)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
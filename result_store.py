@@ -0,0 +1,160 @@
+"""Server-side storage for extraction results.
+
+The session cookie only carries a short result ID; the parsed extraction
+lives here. Two backends share the same interface: an in-process LRU with
+TTL (default) that keeps objects as-is, and a directory of files that
+survives restarts and can be shared by several workers on one host, using
+``encode``/``decode`` to convert values to and from text.
+"""
+
+import os
+import re
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+from ttl_cache import TTLCache
+
+_RESULT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_result_id() -> str:
+    return uuid.uuid4().hex
+
+
+class ResultStore:
+    """Interface for result backends."""
+
+    def put(self, result_id: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def get(self, result_id: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def delete(self, result_id: str) -> None:
+        raise NotImplementedError
+
+    def save(self, value: Any) -> str:
+        """Store ``value`` under a fresh ID and return the ID."""
+        result_id = new_result_id()
+        self.put(result_id, value)
+        return result_id
+
+
+class MemoryResultStore(ResultStore):
+    """In-process LRU store bounded by entry count, total size and age."""
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl: float = 3600,
+        max_bytes: int = 256 * 1024 * 1024,
+        weigh: Callable[[Any], int] = len,
+    ):
+        self._cache: TTLCache[Any] = TTLCache(
+            max_entries=max_entries, ttl=ttl, max_weight=max_bytes, weigh=weigh
+        )
+
+    def put(self, result_id: str, value: Any) -> None:
+        self._cache.set(result_id, value)
+
+    def get(self, result_id: str) -> Optional[Any]:
+        return self._cache.get(result_id)
+
+    def delete(self, result_id: str) -> None:
+        self._cache.pop(result_id)
+
+
+class DiskResultStore(ResultStore):
+    """One file per result in ``directory``, expired by modification time."""
+
+    def __init__(
+        self,
+        directory: str,
+        max_entries: int = 10000,
+        ttl: float = 24 * 3600,
+        encode: Callable[[Any], str] = str,
+        decode: Callable[[str], Any] = str,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._encode = encode
+        self._decode = decode
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, result_id: str) -> str:
+        if not _RESULT_ID.match(result_id):
+            raise KeyError(result_id)
+        return os.path.join(self.directory, f"{result_id}.json")
+
+    def put(self, result_id: str, value: Any) -> None:
+        path = self._path(result_id)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            handle.write(self._encode(value))
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def get(self, result_id: str) -> Optional[Any]:
+        try:
+            path = self._path(result_id)
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self.delete(result_id)
+                return None
+            with open(path, encoding="utf-8") as handle:
+                return self._decode(handle.read())
+        except (KeyError, OSError):
+            return None
+
+    def delete(self, result_id: str) -> None:
+        try:
+            os.remove(self._path(result_id))
+        except (KeyError, OSError):
+            pass
+
+    def _evict(self) -> None:
+        entries = []
+        cutoff = time.time() - self.ttl
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                if mtime < cutoff:
+                    self._unlink(entry.path)
+                else:
+                    entries.append((mtime, entry.path))
+        if len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[: len(entries) - self.max_entries]:
+                self._unlink(path)
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def make_result_store(backend: str = "memory", **options) -> ResultStore:
+    """Build a result store from a backend name (``memory`` or ``disk``)."""
+    if backend == "memory":
+        return MemoryResultStore(
+            max_entries=options.get("max_entries", 512),
+            ttl=options.get("ttl", 3600),
+            weigh=options.get("weigh", len),
+        )
+    if backend == "disk":
+        return DiskResultStore(
+            options.get("directory", "./results"),
+            max_entries=options.get("max_entries", 10000),
+            ttl=options.get("ttl", 24 * 3600),
+            encode=options.get("encode", str),
+            decode=options.get("decode", str),
+        )
+    raise ValueError(f"Unknown result store backend: {backend}")
@@ -0,0 +1,279 @@
+"""Chunking and retrieval over uploaded context documents.
+
+Documents are split into overlapping word windows and indexed as they
+arrive: a BM25 inverted index always, plus an optional NumPy index of
+hashed term vectors that adds a cosine-similarity signal. Adding or
+removing a document only touches that document's chunks. :meth:`ContextIndex.select`
+returns the best chunks for a query that fit within a token budget, and
+:meth:`ContextIndex.context_blob` the text to put in a prompt. The blob of
+the whole context is kept precomputed and extended on each upload.
+"""
+
+import math
+import re
+import threading
+import zlib
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import optional_deps
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:['.][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in into is it its me my no not of on or our"
+    " so that the their then there these they this to was we were what when which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough model-token count (about four characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def chunk_text(text: str, max_words: int = 120, overlap: int = 20) -> List[str]:
+    """Split ``text`` into windows of at most ``max_words`` words.
+
+    Paragraphs are kept whole when they fit; longer ones are cut into
+    windows that share ``overlap`` words so a sentence split at a boundary
+    is still retrievable from either side.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if not words:
+            continue
+        if current and len(current) + len(words) > max_words:
+            chunks.append(" ".join(current))
+            current = []
+        if len(words) <= max_words:
+            current.extend(words)
+            continue
+        step = max(max_words - overlap, 1)
+        for start in range(0, len(words), step):
+            chunks.append(" ".join(words[start:start + max_words]))
+            if start + max_words >= len(words):
+                break
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+@dataclass
+class Chunk:
+    id: int
+    document_id: str
+    position: int
+    text: str
+    tokens: int
+
+
+class BM25Index:
+    """Incremental Okapi BM25 over chunks identified by integer IDs."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._lengths: Dict[int, int] = {}
+        self._terms: Dict[int, List[str]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, chunk_id: int, terms: List[str]) -> None:
+        counts = Counter(terms)
+        for term, count in counts.items():
+            self._postings[term][chunk_id] = count
+        self._terms[chunk_id] = list(counts)
+        self._lengths[chunk_id] = len(terms)
+        self._total_length += len(terms)
+
+    def remove(self, chunk_id: int) -> None:
+        for term in self._terms.pop(chunk_id, []):
+            postings = self._postings[term]
+            postings.pop(chunk_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(chunk_id, 0)
+
+    def scores(self, terms: Iterable[str]) -> Dict[int, float]:
+        count = len(self._lengths)
+        if not count:
+            return {}
+        average = self._total_length / count or 1.0
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / average)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+class VectorIndex:
+    """Cosine similarity over L2-normalised hashed term vectors, stored in one NumPy matrix."""
+
+    def __init__(self, dimensions: int = 1024):
+        np = optional_deps.numpy()
+        if np is None:
+            raise RuntimeError("numpy is required for the vector index")
+        self._np = np
+        self.dimensions = dimensions
+        self._matrix = np.zeros((64, dimensions), dtype=np.float32)
+        self._rows: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._size = 0
+
+    def _embed(self, terms: List[str]):
+        np = self._np
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term, count in Counter(terms).items():
+            vector[zlib.crc32(term.encode("utf-8")) % self.dimensions] += 1.0 + math.log(count)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def add(self, chunk_id: int, terms: List[str]) -> None:
+        if self._free:
+            row = self._free.pop()
+        else:
+            if self._size == len(self._matrix):
+                # Grow geometrically so appends stay amortised O(1)
+                self._matrix = self._np.concatenate([self._matrix, self._np.zeros_like(self._matrix)])
+            row = self._size
+            self._size += 1
+        self._matrix[row] = self._embed(terms)
+        self._rows[chunk_id] = row
+
+    def remove(self, chunk_id: int) -> None:
+        row = self._rows.pop(chunk_id, None)
+        if row is not None:
+            self._matrix[row] = 0.0
+            self._free.append(row)
+
+    def scores(self, terms: List[str]) -> Dict[int, float]:
+        if not self._rows:
+            return {}
+        similarities = self._matrix[: self._size] @ self._embed(terms)
+        return {chunk_id: float(similarities[row]) for chunk_id, row in self._rows.items()}
+
+
+class ContextIndex:
+    """Chunks of one conversation's context documents, searchable by relevance."""
+
+    def __init__(
+        self,
+        max_words: int = 120,
+        overlap: int = 20,
+        vectors: bool = False,
+        vector_weight: float = 0.5,
+        count_tokens: Callable[[str], int] = estimate_tokens,
+    ):
+        self.max_words = max_words
+        self.overlap = overlap
+        self.vector_weight = vector_weight
+        self._count_tokens = count_tokens
+        self._bm25 = BM25Index()
+        self._vectors: Optional[VectorIndex] = VectorIndex() if vectors and optional_deps.numpy() is not None else None
+        self._chunks: Dict[int, Chunk] = {}
+        self._documents: Dict[str, List[int]] = {}
+        self._next_id = 0
+        self._blob = ""
+        self._blob_tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def document_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._documents)
+
+    def add_document(self, document_id: str, text: str) -> int:
+        """Chunk and index one document; returns the number of chunks added."""
+        pieces = chunk_text(text, self.max_words, self.overlap)
+        counts = [self._count_tokens(piece) for piece in pieces]
+        with self._lock:
+            if document_id in self._documents:
+                return 0
+            ids = []
+            for position, (piece, tokens) in enumerate(zip(pieces, counts)):
+                chunk = Chunk(self._next_id, document_id, position, piece, tokens)
+                self._next_id += 1
+                terms = tokenize(piece)
+                self._bm25.add(chunk.id, terms)
+                if self._vectors is not None:
+                    self._vectors.add(chunk.id, terms)
+                self._chunks[chunk.id] = chunk
+                ids.append(chunk.id)
+            self._documents[document_id] = ids
+            # New documents always sort last, so the full blob only grows at the end
+            if pieces:
+                added = "\n\n".join(pieces)
+                self._blob = f"{self._blob}\n\n{added}" if self._blob else added
+                self._blob_tokens += sum(counts)
+            return len(ids)
+
+    def remove_document(self, document_id: str) -> None:
+        with self._lock:
+            for chunk_id in self._documents.pop(document_id, []):
+                self._bm25.remove(chunk_id)
+                if self._vectors is not None:
+                    self._vectors.remove(chunk_id)
+                del self._chunks[chunk_id]
+            ordered = sorted(self._chunks.values(), key=lambda chunk: chunk.id)
+            self._blob = "\n\n".join(chunk.text for chunk in ordered)
+            self._blob_tokens = sum(chunk.tokens for chunk in ordered)
+
+    def total_tokens(self) -> int:
+        with self._lock:
+            return self._blob_tokens
+
+    def search(self, query: str, k: int = 5) -> List[Chunk]:
+        """Return up to ``k`` chunks ordered by relevance to ``query``."""
+        terms = tokenize(query)
+        with self._lock:
+            scores = self._bm25.scores(terms)
+            if self._vectors is not None and scores:
+                # Put BM25 on a 0..1 scale so the cosine term is comparable
+                top = max(scores.values())
+                scores = {chunk_id: score / top for chunk_id, score in scores.items()}
+                for chunk_id, similarity in self._vectors.scores(terms).items():
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + self.vector_weight * similarity
+            ranked = sorted((score, chunk_id) for chunk_id, score in scores.items() if score > 0)
+            return [self._chunks[chunk_id] for _, chunk_id in reversed(ranked[-k:])] if k else []
+
+    def select(self, query: str, k: int = 6, token_budget: int = 1500) -> List[Chunk]:
+        """Top-``k`` chunks for ``query`` that fit in ``token_budget``, in document order.
+
+        When all of the context fits in the budget it is returned whole.
+        """
+        with self._lock:
+            if self._blob_tokens <= token_budget:
+                return sorted(self._chunks.values(), key=lambda chunk: chunk.id)
+        selected: List[Chunk] = []
+        used = 0
+        for chunk in self.search(query, k):
+            if used + chunk.tokens > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk.tokens
+        return sorted(selected, key=lambda chunk: chunk.id)
+
+    def context_blob(self, query: str, k: int = 6, token_budget: int = 1500) -> Tuple[str, int]:
+        """Prompt text for ``query`` within ``token_budget`` and its token count.
+
+        Reuses the precomputed whole-context blob when it fits.
+        """
+        with self._lock:
+            if self._blob_tokens <= token_budget:
+                return self._blob, self._blob_tokens
+        chunks = self.select(query, k, token_budget)
+        return "\n\n".join(chunk.text for chunk in chunks), sum(chunk.tokens for chunk in chunks)
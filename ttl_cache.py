@@ -0,0 +1,108 @@
+"""Thread-safe in-memory LRU cache with per-entry time-to-live.
+
+Used wherever a process needs a small bounded map of recent values: entries
+expire after ``ttl`` seconds, and the least recently used entries are evicted
+once ``max_entries`` (or the optional ``max_weight``) is exceeded.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """LRU mapping with expiry and hit/miss counters."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: Optional[float] = 3600,
+        max_weight: Optional[int] = None,
+        weigh: Optional[Callable[[V], int]] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self._weigh = weigh or (lambda value: 1)
+        self._data: "OrderedDict[Hashable, Tuple[V, float, int]]" = OrderedDict()
+        self._weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for ``key`` and mark it recently used."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires, _ = item
+            if expires and expires < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        """Insert or replace ``key``, evicting old entries if over capacity."""
+        weight = self._weigh(value)
+        expires = time.monotonic() + self.ttl if self.ttl else 0.0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires, weight)
+            self._weight += weight
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_weight is not None and self._weight > self.max_weight)
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove ``key`` and return its value if present."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data[key][0]
+            self._remove(key)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and not (item[1] and item[1] < time.monotonic())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and current occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._data),
+                "weight": self._weight,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, weight = self._data.pop(key)
+        self._weight -= weight
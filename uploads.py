@@ -0,0 +1,179 @@
+"""Streaming ingestion of uploaded files.
+
+Werkzeug hands each multipart file part to the stream returned by
+``Request._get_file_stream``. :class:`UploadRequest` returns a
+:class:`SpooledUpload`, which hashes and size-checks every chunk as it is
+written, keeps small files in memory and rolls larger ones over to a unique
+temporary file. The parser's write is the only copy: there is no
+``file.save()`` into ``UPLOAD_FOLDER`` and no second read to hash the file.
+
+:class:`LocalFile` gives a file already on disk the same interface, so the
+extraction code can take either.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+from typing import BinaryIO, Optional, Union
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from extraction_cache import file_sha256
+
+
+class SpooledUpload(io.RawIOBase):
+    """Writable/readable upload buffer that tracks size and SHA-256 as it fills."""
+
+    def __init__(
+        self, directory: str, spool_max: int = 1024 * 1024, max_bytes: Optional[int] = None, suffix: str = ".upload"
+    ):
+        super().__init__()
+        self.directory = directory
+        # Kept on the spilled file, as some consumers infer the type from the path
+        self.suffix = suffix
+        self.spool_max = spool_max
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._file: BinaryIO = io.BytesIO()
+        self._path: Optional[str] = None
+        self._detached = False
+
+    # -- io interface used by werkzeug and readers ---------------------------
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        length = len(data)
+        if self.max_bytes is not None and self.size + length > self.max_bytes:
+            raise RequestEntityTooLarge()
+        self.size += length
+        self._digest.update(data)
+        if self._path is None and self.size > self.spool_max:
+            self._rollover()
+        return self._file.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readinto(self, buffer) -> int:
+        return self._file.readinto(buffer)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        # A detached upload outlives the request; the owner calls release()
+        if not self._detached:
+            self.release()
+
+    # -- extraction-facing helpers ------------------------------------------
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def in_memory(self) -> bool:
+        return self._path is None
+
+    @property
+    def path(self) -> str:
+        """Path of the upload on disk, writing it out once if it is still in memory."""
+        if self._path is None:
+            self._rollover()
+        self._file.flush()
+        return self._path
+
+    def reader_input(self) -> Union[str, BinaryIO]:
+        """Something a local parser such as pypdf can read without touching disk."""
+        if self._path is None:
+            # Independent cursor over the spooled bytes (getvalue does not copy)
+            return io.BytesIO(self._file.getvalue())
+        self._file.flush()
+        return self._path
+
+    def detach(self) -> "SpooledUpload":
+        """Keep the upload alive after the request closes; call release() when done."""
+        self._detached = True
+        return self
+
+    def release(self) -> None:
+        super().close()  # flushes through self.flush(), so before _file closes
+        if not self._file.closed:
+            self._file.close()
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+    def _rollover(self) -> None:
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix=self.suffix)
+        disk_file = os.fdopen(fd, "w+b")
+        position = self._file.tell()
+        disk_file.write(self._file.getvalue())
+        disk_file.seek(position)
+        self._file.close()
+        self._file = disk_file
+        self._path = path
+
+
+class LocalFile:
+    """A file already on disk, exposing the same interface as SpooledUpload."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._sha256: Optional[str] = None
+
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = file_sha256(self.path)
+        return self._sha256
+
+    def reader_input(self) -> Union[str, BinaryIO]:
+        return self.path
+
+
+def as_source(document):
+    """Wrap a path as a LocalFile; uploads are returned unchanged."""
+    return LocalFile(document) if isinstance(document, (str, os.PathLike)) else document
+
+
+def upload_suffix(filename: Optional[str]) -> str:
+    """Extension of a client filename, if it is a plain one, else ``.upload``."""
+    suffix = os.path.splitext(filename or "")[1].lower()
+    return suffix if 1 < len(suffix) <= 8 and suffix[1:].isalnum() else ".upload"
+
+
+class UploadRequest(Request):
+    """Flask request whose file parts are written straight into SpooledUploads."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        return SpooledUpload(
+            config["UPLOAD_FOLDER"],
+            spool_max=config.get("UPLOAD_SPOOL_MAX", 1024 * 1024),
+            max_bytes=config.get("MAX_CONTENT_LENGTH"),
+            suffix=upload_suffix(filename),
+        )
@@ -1,107 +1,627 @@
 """FastAPI service for context-aware voice answers without exposing transcripts.
 
 This service keeps user-provided context snippets and recent conversation
-transcripts in memory so that responses can reference both uploaded documents
-and what speakers just said. Only the final model answer is returned; the raw
-transcript stays internal to keep latency and bandwidth low.
+transcripts per session (``X-Session-ID`` header) so that responses can
+reference both uploaded documents and what speakers just said. Only the
+final model answer is returned (optionally streamed token by token); the
+raw transcript stays internal to keep latency and bandwidth low.
+
+Transcription and chat go through the shared model backends (see
+``backends``): the routes in ``VOICE_TRANSCRIBE_MODELS`` and
+``VOICE_CHAT_MODELS`` pick a provider and model per request, and the
+OpenAI backend uses one pooled async client so calls never block the
+event loop.
 """
 
+import asyncio
+import hashlib
+import json
+import logging
 import os
-import tempfile
-from typing import List
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from audio_preprocess import preprocess_audio
+import instrumentation
+from backends import (
+    BackendError,
+    BackendNotConfigured,
+    BackendTimeout,
+    ModelRouter,
+    Route,
+    backend_stats,
+    close_backends,
+    get_backend,
+)
+from audio_stream import SilenceSegmenter, pcm_to_wav
+from prompt_builder import BuiltPrompt, build_prompt, count_tokens, summary_prompt
+from resilience import CallRejected, CircuitOpenError, DeadlineExceeded, deadline_scope
+from retrieval import ContextIndex
+from ttl_cache import TTLCache
+from voice_sessions import SessionState, make_session_store, new_session_id, valid_session_id
+
+# Cheapest route first; see backends.parse_routes for the format
+_TRANSCRIBE_ROUTER = ModelRouter.from_spec(os.getenv("VOICE_TRANSCRIBE_MODELS", "openai:whisper-1"))
+_CHAT_ROUTER = ModelRouter.from_spec(os.getenv("VOICE_CHAT_MODELS", "openai:gpt-4o-mini"))
+# Upper bound on the remote calls made for one question (transcription and answer)
+_REQUEST_DEADLINE = float(os.getenv("VOICE_REQUEST_DEADLINE", "60"))
+
+logger = logging.getLogger(__name__)
+
+# Decode/trim/re-encode uploads before Whisper; ffmpeg and NumPy do the work
+# outside the GIL, so a small thread pool keeps it off the event loop
+_PREPROCESS_AUDIO = os.getenv("VOICE_PREPROCESS_AUDIO", "1") == "1"
+_PREPROCESS_WORKERS = int(os.getenv("VOICE_PREPROCESS_WORKERS", "2"))
+_preprocess_pool: Optional[ThreadPoolExecutor] = None
 
-from fastapi import FastAPI, HTTPException, UploadFile
-from openai import OpenAI
 
-# Initialize OpenAI client once
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def _preprocess_executor() -> ThreadPoolExecutor:
+    # Started on the first upload, so a fresh worker only pays for it when used
+    global _preprocess_pool
+    if _preprocess_pool is None:
+        _preprocess_pool = ThreadPoolExecutor(max_workers=_PREPROCESS_WORKERS, thread_name_prefix="audio-preprocess")
+    return _preprocess_pool
 
-app = FastAPI(title="Voice Assistant", description="Answer using uploaded context and live audio")
 
-# In-memory storage for uploaded context and recent transcripts
-_CONTEXT_MEMORY: List[str] = []
-_CONVERSATION_TRANSCRIPTS: List[str] = []
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    global _preprocess_pool
+    yield
+    await close_backends()
+    if _preprocess_pool is not None:
+        _preprocess_pool.shutdown(wait=False)
+        _preprocess_pool = None
+
+
+# Endpoints; create_app() mounts them on an application
+router = APIRouter()
+
 _MAX_TRANSCRIPT_HISTORY = 5  # Keep only the last few turns to avoid slow, long prompts
+# Hard cap on prompt size; see prompt_builder for what is kept first
+_PROMPT_TOKEN_BUDGET = int(os.getenv("VOICE_PROMPT_TOKEN_BUDGET", "3000"))
+# Fold turns that leave the window into a running summary (one extra chat call)
+_SUMMARISE_EVICTED = os.getenv("VOICE_SUMMARIZE_EVICTED", "0") == "1"
+
+# Default sample rate of PCM streamed to /ws/audio
+_STREAM_SAMPLE_RATE = int(os.getenv("VOICE_STREAM_SAMPLE_RATE", "16000"))
+# Sample rates a client may announce in its start message
+_STREAM_SAMPLE_RATES = range(8000, 48001)
+
+# Uploaded context and recent transcripts, kept per session; the sqlite
+# backend lets several uvicorn workers share sessions
+_SESSIONS = make_session_store(
+    os.getenv("VOICE_SESSION_STORE", "memory"),
+    path=os.getenv("VOICE_SESSION_PATH", "./cache/voice_sessions.sqlite3"),
+    max_sessions=int(os.getenv("VOICE_MAX_SESSIONS", "1000")),
+    ttl=float(os.getenv("VOICE_SESSION_TTL", "3600")),
+    max_context_chars=int(os.getenv("VOICE_MAX_CONTEXT_CHARS", "200000")),
+    max_turns=_MAX_TRANSCRIPT_HISTORY,
+    summarise=_SUMMARISE_EVICTED,
+)
 
 
-def _transcribe_audio(path: str) -> str:
-    """Transcribe an audio file using the Whisper API."""
-    with open(path, "rb") as audio_file:
-        transcription = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            response_format="text",
+# Retrieval over each session's context; only the chunks relevant to the
+# latest question go into the prompt
+_CONTEXT_TOP_K = int(os.getenv("VOICE_CONTEXT_TOP_K", "6"))
+_CONTEXT_TOKEN_BUDGET = int(os.getenv("VOICE_CONTEXT_TOKEN_BUDGET", "1500"))
+_VECTOR_INDEX = os.getenv("VOICE_VECTOR_INDEX", "0") == "1"
+_INDEXES: TTLCache[ContextIndex] = TTLCache(
+    max_entries=int(os.getenv("VOICE_MAX_SESSIONS", "1000")),
+    ttl=float(os.getenv("VOICE_SESSION_TTL", "3600")),
+)
+
+
+def _session_id(response: Response, x_session_id: Optional[str] = Header(None)) -> str:
+    """Resolve the caller's session, issuing a new ID when none is sent."""
+    if x_session_id is None:
+        x_session_id = new_session_id()
+    elif not valid_session_id(x_session_id):
+        raise HTTPException(status_code=400, detail="Invalid X-Session-ID")
+    response.headers["X-Session-ID"] = x_session_id
+    return x_session_id
+
+
+# Level 1: audio digest -> transcript, so resent clips skip Whisper.
+# Level 2: (context version, normalised conversation window) -> answer; the
+# context version changes on every upload and reset, which retires old answers.
+_CACHE_TTL = float(os.getenv("VOICE_CACHE_TTL", "3600"))
+_TRANSCRIPT_CACHE: TTLCache[str] = TTLCache(
+    max_entries=int(os.getenv("VOICE_TRANSCRIPT_CACHE_SIZE", "1024")), ttl=_CACHE_TTL
+)
+_ANSWER_CACHE: TTLCache[Tuple[str, Dict[str, int]]] = TTLCache(
+    max_entries=int(os.getenv("VOICE_ANSWER_CACHE_SIZE", "1024")), ttl=_CACHE_TTL
+)
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+
+def _normalise(text: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+def _answer_key(state: SessionState) -> str:
+    window = "\n".join(_normalise(transcript) for transcript in state.transcripts)
+    return hashlib.sha256(f"{state.context_version}\0{window}".encode("utf-8")).hexdigest()
+
+
+async def _preprocess(filename: str, audio: bytes, content_type: str) -> Tuple[str, bytes, str]:
+    loop = asyncio.get_running_loop()
+    with instrumentation.stage("voice", "preprocess"):
+        result = await loop.run_in_executor(_preprocess_executor(), preprocess_audio, audio, filename, content_type)
+    instrumentation.record_size("voice", "audio_preprocessed", len(result.data))
+    if result.changed:
+        logger.info(
+            "preprocessed %s: %d -> %d bytes (%.0f%% smaller), %.1fs kept, %.1fs silence trimmed, %.0f ms",
+            filename, result.original_bytes, len(result.data),
+            100 * (1 - len(result.data) / result.original_bytes),
+            result.seconds, result.trimmed_seconds, result.elapsed * 1000,
         )
+    return result.filename, result.data, result.content_type
+
+
+async def _transcribe_audio(
+    filename: str, audio: bytes, content_type: str, latency_target: Optional[float] = None
+) -> str:
+    """Transcribe uploaded audio bytes with the routed speech-to-text model."""
+    # Keyed on the upload as received, so a resent clip skips preprocessing too
+    key = hashlib.sha256(audio).hexdigest()
+    cached = _TRANSCRIPT_CACHE.get(key)
+    if cached is not None:
+        return cached
+    if _PREPROCESS_AUDIO:
+        filename, audio, content_type = await _preprocess(filename, audio, content_type)
+    route = _TRANSCRIBE_ROUTER.select(size=len(audio), latency_target=latency_target)
+    started = time.perf_counter()
+    with instrumentation.stage("voice", "transcribe"):
+        transcription = await get_backend(route.backend).transcribe(filename, audio, content_type, route.model)
+    if transcription.strip():
+        # An empty transcript may be a transient failure; let a resend retry it
+        _TRANSCRIPT_CACHE.set(key, transcription)
+    _TRANSCRIBE_ROUTER.observe(route, time.perf_counter() - started)
     return transcription
 
 
-def _build_prompt(transcript: str) -> str:
-    """Construct the user prompt from context and recent conversation."""
+def _chat_messages(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {
+            "role": "system",
+            "content": "You analyze live audio and provide helpful answers instantly.",
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _chat_route(prompt_tokens: int, latency_target: Optional[float]) -> Route:
+    return _CHAT_ROUTER.select(size=prompt_tokens, latency_target=latency_target)
+
+
+async def _answer(prompt: str, route: Route) -> str:
+    """Ask the routed chat model for an answer to the built prompt."""
+    started = time.perf_counter()
+    with instrumentation.stage("voice", "chat"):
+        answer = await get_backend(route.backend).chat(_chat_messages(prompt), route.model)
+    _CHAT_ROUTER.observe(route, time.perf_counter() - started)
+    return answer
+
+
+async def _answer_stream(prompt: str, route: Route) -> AsyncIterator[str]:
+    """Yield the answer's text deltas as the chat model produces them."""
+    started = time.perf_counter()
+    with instrumentation.stage("voice", "chat"):
+        async for text in get_backend(route.backend).chat_stream(_chat_messages(prompt), route.model):
+            yield text
+    _CHAT_ROUTER.observe(route, time.perf_counter() - started)
+
+
+class _Distribution:
+    """Count, mean, max and recent percentiles of a measurement in ``unit``."""
+
+    def __init__(self, unit: str, window: int = 1000):
+        self.unit = unit
+        self._lock = threading.Lock()
+        self._recent: deque = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+            self._recent.append(value)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            recent = sorted(self._recent)
+        percentile = lambda q: recent[min(int(q * len(recent)), len(recent) - 1)] if recent else 0.0
+        return {
+            "count": self.count,
+            f"{self.unit}_mean": self.total / self.count if self.count else 0.0,
+            f"{self.unit}_max": self.max,
+            f"{self.unit}_p50": percentile(0.50),
+            f"{self.unit}_p95": percentile(0.95),
+        }
+
+
+# Time from the chat request to its first streamed token
+_TTFT = _Distribution("seconds")
+# Size of each prompt sent to the chat model
+_PROMPT_TOKENS = _Distribution("tokens")
+# Sessions with a summary call in flight
+_SUMMARISING: set = set()
+# The event loop only keeps weak references to tasks; hold the summary
+# tasks here until they finish so they are not collected mid-call
+_BACKGROUND_TASKS: set = set()
+
+
+def _context_index(session_id: str, state: SessionState) -> ContextIndex:
+    """Return the session's index, indexing only documents it has not seen yet.
+
+    The session store is the source of truth (it may be shared with other
+    workers), so the index is reconciled with its document IDs on each use.
+    """
+    index = _INDEXES.get(session_id)
+    if index is None:
+        index = ContextIndex(vectors=_VECTOR_INDEX, count_tokens=count_tokens)
+    current = {document.id for document in state.context}
+    for document_id in set(index.document_ids) - current:
+        index.remove_document(document_id)
+    for document in state.context:
+        index.add_document(document.id, document.text)
+    _INDEXES.set(session_id, index)
+    return index
+
+
+def _build_prompt(state: SessionState, index: ContextIndex) -> BuiltPrompt:
+    """Construct the user prompt from relevant context and recent conversation."""
+    with instrumentation.stage("voice", "prompt_build"):
+        built = build_prompt(
+            state.transcripts,
+            lambda question, budget: index.context_blob(
+                question, k=_CONTEXT_TOP_K, token_budget=min(budget, _CONTEXT_TOKEN_BUDGET)
+            ),
+            budget=_PROMPT_TOKEN_BUDGET,
+            summary=state.summary,
+        )
+    _PROMPT_TOKENS.record(built.tokens["total"])
+    instrumentation.record_tokens("voice", {f"prompt_{part}": count for part, count in built.tokens.items()})
+    return built
+
+
+async def _summarise(session_id: str, state: SessionState) -> None:
+    """Fold the session's evicted turns into its running summary."""
+    turns = list(state.unsummarised)
+    try:
+        # Summaries are background work; always use the cheapest route
+        route = _CHAT_ROUTER.routes[0]
+        summary = await get_backend(route.backend).chat(
+            [{"role": "user", "content": summary_prompt(state.summary, turns)}], route.model
+        )
+        _SESSIONS.apply_summary(session_id, summary, turns)
+    except (BackendError, CallRejected):
+        pass  # The turns stay queued and are retried after the next eviction
+    finally:
+        _SUMMARISING.discard(session_id)
+
+
+def _maybe_summarise(session_id: str, state: SessionState) -> None:
+    if _SUMMARISE_EVICTED and state.unsummarised and session_id not in _SUMMARISING:
+        _SUMMARISING.add(session_id)
+        task = asyncio.create_task(_summarise(session_id, state))
+        _BACKGROUND_TASKS.add(task)
+        task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+
+def _prepare_turn(session_id: str, transcript: str) -> Tuple[SessionState, str]:
+    """Record the transcript in the session; returns the state and its answer-cache key."""
     # Keep short rolling history to avoid lag
-    _CONVERSATION_TRANSCRIPTS.append(transcript)
-    del _CONVERSATION_TRANSCRIPTS[:-_MAX_TRANSCRIPT_HISTORY]
-
-    context_blob = "\n".join(_CONTEXT_MEMORY).strip() or "(no additional context provided)"
-    conversation_blob = "\n".join(_CONVERSATION_TRANSCRIPTS)
-
-    return (
-        "You are assisting in a live conversation. Use the uploaded context to"
-        " ground your answers, but reply concisely and directly to the latest"
-        " question.\n\n"
-        f"Context information:\n{context_blob}\n\n"
-        f"Recent conversation transcripts:\n{conversation_blob}"
-    )
+    state = _SESSIONS.add_transcript(session_id, transcript)
+    _maybe_summarise(session_id, state)
+    return state, _answer_key(state)
+
+
+async def _respond(
+    session_id: str, transcript: str, latency_target: Optional[float] = None
+) -> Tuple[str, Dict[str, int]]:
+    """Answer the turn; returns the answer and the prompt's token counts."""
+    state, key = _prepare_turn(session_id, transcript)
+    cached = _ANSWER_CACHE.get(key)
+    if cached is not None:
+        return cached
+    prompt = _build_prompt(state, _context_index(session_id, state))
+    route = _chat_route(prompt.tokens["total"], latency_target)
+    result = (await _answer(prompt.text, route), prompt.tokens)
+    _ANSWER_CACHE.set(key, result)
+    return result
+
 
+def _stream_events(
+    session_id: str, transcript: str, mode: str, latency_target: Optional[float] = None
+) -> AsyncIterator[str]:
+    """Relay answer tokens as SSE events or JSON lines, ending with a done record."""
 
-@app.post("/upload_context")
-async def upload_context(file: UploadFile):
+    def encode(event: str, data: Dict) -> str:
+        if mode == "sse":
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps({"type": event, **data}) + "\n"
+
+    state, key = _prepare_turn(session_id, transcript)
+    cached = _ANSWER_CACHE.get(key)
+
+    async def generate():
+        started = time.perf_counter()
+        if cached is not None:
+            answer, prompt_tokens = cached
+            yield encode("token", {"text": answer})
+            yield encode("done", {"answer": answer, "session_id": session_id, "cached": True,
+                                  "prompt_tokens": prompt_tokens, "ttft_seconds": 0.0,
+                                  "total_seconds": time.perf_counter() - started})
+            return
+        ttft = None
+        parts = []
+        try:
+            with deadline_scope(_REQUEST_DEADLINE):
+                prompt = _build_prompt(state, _context_index(session_id, state))
+                route = _chat_route(prompt.tokens["total"], latency_target)
+                async for text in _answer_stream(prompt.text, route):
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                        _TTFT.record(ttft)
+                    parts.append(text)
+                    yield encode("token", {"text": text})
+        except (BackendError, CallRejected) as e:
+            yield encode("error", {"error": str(e)})
+            return
+        answer = "".join(parts)
+        _ANSWER_CACHE.set(key, (answer, prompt.tokens))
+        yield encode("done", {
+            "answer": answer,
+            "session_id": session_id,
+            "cached": False,
+            "prompt_tokens": prompt.tokens,
+            "ttft_seconds": ttft,
+            "total_seconds": time.perf_counter() - started,
+        })
+
+    return generate()
+
+
+@router.post("/upload_context")
+async def upload_context(file: UploadFile, session_id: str = Depends(_session_id)):
     """Upload a text file with background knowledge for future answers."""
-    text = (await file.read()).decode("utf-8", errors="ignore").strip()
-    if text:
-        _CONTEXT_MEMORY.append(text)
-    return {"status": "uploaded", "context_items": len(_CONTEXT_MEMORY)}
+    with instrumentation.stage("voice", "read_upload"):
+        data = await file.read()
+    instrumentation.record_size("voice", "context", len(data))
+    text = data.decode("utf-8", errors="ignore").strip()
+    state = _SESSIONS.add_context(session_id, text) if text else _SESSIONS.get(session_id)
+    # Index the new document now, off the event loop, rather than on the next question
+    with instrumentation.stage("voice", "index"):
+        await asyncio.to_thread(_context_index, session_id, state)
+    return {"status": "uploaded", "context_items": len(state.context), "session_id": session_id}
+
+
+@router.post("/process_audio")
+async def process_audio(
+    request: Request,
+    file: UploadFile,
+    session_id: str = Depends(_session_id),
+    stream: Optional[str] = Query(None, pattern="^(sse|ndjson)$"),
+    latency_target: Optional[float] = Query(None, gt=0),
+):
+    """Transcribe audio and return an answer based on context and conversation.
+
+    With ``?stream=sse`` (or ``Accept: text/event-stream``) or
+    ``?stream=ndjson`` the answer is streamed token by token instead.
+    ``?latency_target=<seconds>`` prefers models observed to answer within
+    that time.
+    """
+    if stream is None and "text/event-stream" in request.headers.get("accept", ""):
+        stream = "sse"
+    try:
+        for router in (_TRANSCRIBE_ROUTER, _CHAT_ROUTER):
+            for route in router.routes:
+                get_backend(route.backend).check()
+    except BackendNotConfigured as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Send the upload straight from memory; no temporary file needed
+    with instrumentation.stage("voice", "read_upload"):
+        audio = await file.read()
+    instrumentation.record_size("voice", "audio", len(audio))
+    try:
+        with deadline_scope(_REQUEST_DEADLINE):
+            transcript = await _transcribe_audio(
+                file.filename or "audio.webm", audio, file.content_type or "audio/webm", latency_target
+            )
+            if not transcript.strip():
+                # Nothing to answer; do not spend a chat call on it
+                raise HTTPException(status_code=422, detail="No speech detected")
+            if stream is not None:
+                media_type = "text/event-stream" if stream == "sse" else "application/x-ndjson"
+                return StreamingResponse(
+                    _stream_events(session_id, transcript, stream, latency_target),
+                    media_type=media_type,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Session-ID": session_id},
+                )
+            answer, prompt_tokens = await _respond(session_id, transcript, latency_target)
+    except (BackendTimeout, DeadlineExceeded) as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+
+    return {"answer": answer, "session_id": session_id, "prompt_tokens": prompt_tokens}
+
+
+@router.post("/reset_context")
+async def reset_context(session_id: str = Depends(_session_id)):
+    """Clear stored context and transcripts for this session only."""
+    _SESSIONS.reset(session_id)
+    _INDEXES.pop(session_id)
+    return {"status": "reset", "session_id": session_id}
+
+
+@router.get("/chat/stats")
+async def chat_stats():
+    """Time-to-first-token of streamed answers, prompt sizes and per-model latency."""
+    return {
+        "ttft": _TTFT.snapshot(),
+        "prompt_tokens": _PROMPT_TOKENS.snapshot(),
+        "model_latency": {"transcribe": _TRANSCRIBE_ROUTER.stats(), "chat": _CHAT_ROUTER.stats()},
+        "backends": backend_stats(),
+    }
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Hit rates and occupancy of the transcript and answer caches."""
+    return {"transcripts": _TRANSCRIPT_CACHE.stats(), "answers": _ANSWER_CACHE.stats()}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage timings, payload sizes and request latency in Prometheus text format."""
+    return PlainTextResponse(instrumentation.render(), media_type=instrumentation.CONTENT_TYPE)
+
 
+@router.get("/sessions/stats")
+async def session_stats():
+    """Occupancy and eviction counters of the session store."""
+    return _SESSIONS.stats()
 
-@app.post("/process_audio")
-async def process_audio(file: UploadFile):
-    """Transcribe audio and return an answer based on context and conversation."""
-    if client.api_key is None:
-        raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not configured")
 
-    # Persist upload to a temporary file for Whisper
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as temp_audio:
-        temp_audio.write(await file.read())
-        temp_path = temp_audio.name
+@router.get("/healthz")
+async def healthz():
+    """Liveness check; answered before any model SDK has been imported."""
+    return {"status": "ok"}
+
+
+@router.websocket("/ws/audio")
+async def stream_audio(websocket: WebSocket):
+    """Answer an utterance streamed as raw PCM frames.
+
+    Binary messages carry 16-bit little-endian mono PCM. Text messages are
+    JSON control messages: ``{"type": "start", "sample_rate": 16000}``
+    (optional, before audio) and ``{"type": "end"}`` once the speaker stops.
+    Each pause-delimited segment is transcribed as soon as it is cut, so by
+    the end message only the last segment is still outstanding. The reply is
+    ``{"type": "answer", ...}``; the connection can carry further utterances.
+    """
+    session_id = websocket.query_params.get("session_id") or websocket.headers.get("x-session-id")
+    if session_id is None:
+        session_id = new_session_id()
+    elif not valid_session_id(session_id):
+        await websocket.close(code=1008, reason="Invalid session_id")
+        return
+    await websocket.accept()
+    await websocket.send_json({"type": "session", "session_id": session_id})
+
+    sample_rate = _STREAM_SAMPLE_RATE
+    segmenter = SilenceSegmenter(sample_rate)
+    pending: List[asyncio.Task] = []
+
+    def transcribe(segment: bytes) -> None:
+        wav = pcm_to_wav(segment, sample_rate)
+        # The task copies the context here, so each segment gets its own deadline
+        with deadline_scope(_REQUEST_DEADLINE):
+            pending.append(asyncio.create_task(_transcribe_audio("segment.wav", wav, "audio/wav")))
 
     try:
-        transcript = _transcribe_audio(temp_path)
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                for segment in segmenter.feed(message["bytes"]):
+                    transcribe(segment)
+                continue
+
+            try:
+                control = json.loads(message.get("text") or "{}")
+            except ValueError:
+                control = None
+            if not isinstance(control, dict):
+                await websocket.send_json({"type": "error", "error": "Control messages must be JSON objects"})
+                continue
+            if control.get("type") == "start":
+                requested = control.get("sample_rate", _STREAM_SAMPLE_RATE)
+                if type(requested) is not int or requested not in _STREAM_SAMPLE_RATES:
+                    await websocket.send_json({
+                        "type": "error",
+                        "error": f"sample_rate must be an integer from {_STREAM_SAMPLE_RATES.start}"
+                                 f" to {_STREAM_SAMPLE_RATES.stop - 1}",
+                    })
+                    continue
+                sample_rate = requested
+                segmenter = SilenceSegmenter(sample_rate)
+            elif control.get("type") == "end":
+                final = segmenter.flush()
+                if final is not None:
+                    transcribe(final)
+                try:
+                    # Segments finish in any order; gather keeps them in speaking order
+                    parts = await asyncio.gather(*pending)
+                    transcript = " ".join(part.strip() for part in parts if part and part.strip())
+                    if not transcript:
+                        await websocket.send_json({"type": "error", "error": "No speech detected"})
+                    else:
+                        with deadline_scope(_REQUEST_DEADLINE):
+                            answer, prompt_tokens = await _respond(session_id, transcript)
+                        await websocket.send_json({
+                            "type": "answer",
+                            "answer": answer,
+                            "session_id": session_id,
+                            "prompt_tokens": prompt_tokens,
+                        })
+                except (BackendError, BackendNotConfigured, CallRejected) as e:
+                    await websocket.send_json({"type": "error", "error": str(e)})
+                finally:
+                    # gather leaves the other segments running when one fails
+                    for task in pending:
+                        task.cancel()
+                    pending = []
+    except WebSocketDisconnect:
+        pass
     finally:
-        # Clean up the temporary file to avoid disk bloat
-        try:
-            os.remove(temp_path)
-        except OSError:
-            pass
-
-    prompt = _build_prompt(transcript)
-
-    chat_response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": "You analyze live audio and provide helpful answers instantly.",
-            },
-            {"role": "user", "content": prompt},
-        ],
-    )
+        for task in pending:
+            task.cancel()
+
 
-    answer = chat_response.choices[0].message.content
-    return {"answer": answer}
+def create_app() -> FastAPI:
+    """Build the voice service.
+
+    Provider SDKs are imported when a backend is first used, so the app
+    starts and answers ``/healthz`` without loading them. Run it with
+    ``uvicorn --factory voice_assistant:create_app`` or use ``app`` below.
+    """
+    app = FastAPI(
+        title="Voice Assistant",
+        description="Answer using uploaded context and live audio",
+        lifespan=_lifespan,
+    )
+    # Request timings for /metrics, and opt-in cProfile dumps (PROFILE_REQUESTS=1)
+    app.add_middleware(instrumentation.ASGIInstrumentation, service="voice")
+    app.include_router(router)
+    return app
 
 
-@app.post("/reset_context")
-async def reset_context():
-    """Clear stored context and transcripts."""
-    _CONTEXT_MEMORY.clear()
-    _CONVERSATION_TRANSCRIPTS.clear()
-    return {"status": "reset"}
+app = create_app()
@@ -0,0 +1,260 @@
+"""Per-session conversation state for the voice assistant.
+
+Each caller identifies itself with a session ID; its uploaded context and
+rolling transcript history live under that ID only, so concurrent calls no
+longer interleave and a reset clears one conversation. Every session is
+bounded (context characters and transcript turns), idle sessions expire,
+and the least recently active ones are evicted once the store is full.
+
+Two backends share one interface: an in-process LRU (default) and a SQLite
+file that several uvicorn workers on one host can share.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from ttl_cache import TTLCache
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+# Turns kept for summarisation if the summariser falls behind
+_MAX_UNSUMMARISED = 50
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def valid_session_id(session_id: str) -> bool:
+    return bool(_SESSION_ID.match(session_id))
+
+
+@dataclass
+class ContextDocument:
+    # Stable ID so retrieval indexes can tell which documents they already hold
+    id: str
+    text: str
+
+
+@dataclass
+class SessionState:
+    context: List[ContextDocument] = field(default_factory=list)
+    transcripts: List[str] = field(default_factory=list)
+    # Changes whenever the context does (and is fresh for a reset session),
+    # so anything derived from the context can be keyed on it
+    context_version: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Running summary of turns that left the window, and turns awaiting it
+    summary: str = ""
+    unsummarised: List[str] = field(default_factory=list)
+
+    def add_context(self, text: str, max_chars: int) -> None:
+        """Append a context document, dropping the oldest ones beyond ``max_chars``."""
+        self.context.append(ContextDocument(uuid.uuid4().hex, text[-max_chars:]))
+        total = sum(len(document.text) for document in self.context)
+        while total > max_chars and len(self.context) > 1:
+            total -= len(self.context.pop(0).text)
+        self.context_version = uuid.uuid4().hex
+
+    def add_transcript(self, transcript: str, max_turns: int, keep_evicted: bool = False) -> None:
+        # A resent clip (client retry) repeats the last turn; don't record it twice
+        if self.transcripts and self.transcripts[-1] == transcript:
+            return
+        self.transcripts.append(transcript)
+        if keep_evicted:
+            self.unsummarised.extend(self.transcripts[:-max_turns])
+            del self.unsummarised[:-_MAX_UNSUMMARISED]
+        del self.transcripts[:-max_turns]
+
+    def apply_summary(self, summary: str, turns: List[str]) -> None:
+        """Store a summary covering ``turns``, unless the session moved on (e.g. was reset)."""
+        if self.unsummarised[:len(turns)] == turns:
+            self.summary = summary
+            del self.unsummarised[:len(turns)]
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "context": [asdict(document) for document in self.context],
+            "transcripts": self.transcripts,
+            "context_version": self.context_version,
+            "summary": self.summary,
+            "unsummarised": self.unsummarised,
+        })
+
+    @classmethod
+    def from_json(cls, text: str) -> "SessionState":
+        data = json.loads(text)
+        context = [ContextDocument(**document) for document in data["context"]]
+        return cls(
+            context=context,
+            transcripts=data["transcripts"],
+            context_version=data.get("context_version") or uuid.uuid4().hex,
+            summary=data.get("summary", ""),
+            unsummarised=data.get("unsummarised", []),
+        )
+
+
+class SessionStore:
+    """Interface for session backends.
+
+    Mutations are done by the store so a backend can make each
+    read-modify-write atomic; callers get back the updated state.
+    """
+
+    def __init__(self, max_context_chars: int = 200_000, max_turns: int = 5, summarise: bool = False):
+        self.max_context_chars = max_context_chars
+        self.max_turns = max_turns
+        self.summarise = summarise
+
+    def get(self, session_id: str) -> SessionState:
+        raise NotImplementedError
+
+    def _update(self, session_id: str, mutate: Callable[[SessionState], None]) -> SessionState:
+        """Apply ``mutate`` to the session atomically and return the new state."""
+        raise NotImplementedError
+
+    def add_context(self, session_id: str, text: str) -> SessionState:
+        return self._update(session_id, lambda state: state.add_context(text, self.max_context_chars))
+
+    def add_transcript(self, session_id: str, transcript: str) -> SessionState:
+        return self._update(
+            session_id, lambda state: state.add_transcript(transcript, self.max_turns, self.summarise)
+        )
+
+    def apply_summary(self, session_id: str, summary: str, turns: List[str]) -> SessionState:
+        return self._update(session_id, lambda state: state.apply_summary(summary, turns))
+
+    def reset(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, float]:
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """In-process sessions, evicted when idle for ``ttl`` seconds or least recently active."""
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 3600, **limits):
+        super().__init__(**limits)
+        self._sessions: TTLCache[SessionState] = TTLCache(max_entries=max_sessions, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> SessionState:
+        return self._sessions.get(session_id) or SessionState()
+
+    def _update(self, session_id: str, mutate) -> SessionState:
+        with self._lock:
+            state = self._sessions.get(session_id) or SessionState()
+            mutate(state)
+            # Re-setting refreshes both the idle timer and LRU position
+            self._sessions.set(session_id, state)
+            return state
+
+    def reset(self, session_id: str) -> None:
+        self._sessions.pop(session_id)
+
+    def stats(self) -> Dict[str, float]:
+        return self._sessions.stats()
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file shared by every worker process on the host."""
+
+    def __init__(self, path: str, max_sessions: int = 10000, ttl: float = 3600, **limits):
+        super().__init__(**limits)
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly below
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS voice_sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS voice_sessions_updated ON voice_sessions (updated)"
+        )
+
+    def _load(self, session_id: str, now: float) -> Optional[SessionState]:
+        row = self._conn.execute(
+            "SELECT state, updated FROM voice_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None
+        return SessionState.from_json(row[0])
+
+    def get(self, session_id: str) -> SessionState:
+        with self._lock:
+            return self._load(session_id, time.time()) or SessionState()
+
+    def _update(self, session_id: str, mutate) -> SessionState:
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so concurrent workers
+            # serialise their read-modify-write of the same session
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = self._load(session_id, now) or SessionState()
+                mutate(state)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO voice_sessions (session_id, state, updated) VALUES (?, ?, ?)",
+                    (session_id, state.to_json(), now),
+                )
+                self._evict(now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return state
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM voice_sessions WHERE updated < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM voice_sessions WHERE session_id IN ("
+            " SELECT session_id FROM voice_sessions ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        )
+
+    def reset(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM voice_sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM voice_sessions").fetchone()
+        return {"entries": entries, "max_sessions": self.max_sessions, "ttl": self.ttl}
+
+
+def make_session_store(backend: str = "memory", **options) -> SessionStore:
+    """Build a session store from a backend name (``memory`` or ``sqlite``)."""
+    limits = {
+        "max_context_chars": options.get("max_context_chars", 200_000),
+        "max_turns": options.get("max_turns", 5),
+        "summarise": options.get("summarise", False),
+    }
+    if backend == "memory":
+        return MemorySessionStore(
+            max_sessions=options.get("max_sessions", 1000),
+            ttl=options.get("ttl", 3600),
+            **limits,
+        )
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            options.get("path", "./cache/voice_sessions.sqlite3"),
+            max_sessions=options.get("max_sessions", 10000),
+            ttl=options.get("ttl", 3600),
+            **limits,
+        )
+    raise ValueError(f"Unknown session store backend: {backend}")